@@ -0,0 +1,256 @@
+#!/usr/bin/env/python
+
+"""
+    bench_ingest.py: Benchmark grant ingest without a VIVO.
+
+    For each size, a synthetic DSP file and fixture graph are made with
+    make_synthetic_dsp.py (and kept for later runs), then grant_ingest.py is
+    run against the VIVO stand-in in bench/standin.  Each run starts with an
+    empty snapshot, so the dictionaries are built from the stand-in.  The
+    stand-in answers queries itself, so the ingest is run without --pool.
+
+    Stage times are taken from the timestamps of the ingest log.  Memory is
+    sampled from /proc while the ingest runs, giving the peak resident size
+    of each stage, and the peak for the whole run is taken from the kernel
+    at exit.  The number of queries made is reported by the stand-in.  The
+    metrics report of each run is kept with its results.
+
+    Each entity a run creates is typed once in its add RDF, so a subject
+    typed more than once is a uri minted for two entities, as worker
+    processes drawing the same random uris would mint.  A run with any
+    fails.
+
+    Results may be saved as a JSON baseline and later runs compared to it.
+
+    Usage: python bench_ingest.py [--sizes 1000,10000] [--jobs 1]
+               [--latency 0] [--save baseline.json] [--compare baseline.json]
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+OUTPUT_DIR = os.path.join(BENCH_DIR, "output")
+
+#   Each stage begins with the first log line starting with its marker and
+#   ends where the next stage begins.  Dictionaries are either made or loaded
+#   from the snapshot.  The dictionaries of a rebuild are made concurrently,
+#   so their stage begins with the rebuild rather than with any one of them
+
+STAGES = [
+    ['dictionaries', ["Rebuild VIVO snapshot",
+                      "Make VIVO dictionaries from VIVO dump",
+                      "Load VIVO snapshot"]],
+    ['read', ["Read DSP Grant Data"]],
+    ['prefetch', ["Prefetch VIVO state"]],
+    ['process', ["Begin Processing"]],
+    ['save', ["End Processing"]],
+    ]
+
+POLL_INTERVAL = 0.02
+
+
+def read_log_stages(log_file_name):
+    """
+    Return a list of [stage, start] for the stages found in an ingest log,
+    in order
+    """
+    found = []
+    names = set()
+    log_file = open(log_file_name)
+    for line in log_file:
+        when = line[:26]
+        text = line[27:]
+        for name, markers in STAGES:
+            if name in names:
+                continue
+            if [m for m in markers if text.startswith(m)]:
+                try:
+                    start = datetime.strptime(when, '%Y-%m-%d %H:%M:%S.%f')
+                except ValueError:
+                    start = datetime.strptime(when[:19], '%Y-%m-%d %H:%M:%S')
+                found.append([name, start])
+                names.add(name)
+    log_file.close()
+    return found
+
+
+def resident_kb(pid):
+    """
+    Return the resident set size in kB of a process, or None if it has gone
+    """
+    try:
+        status_file = open("/proc/%d/status" % pid)
+    except IOError:
+        return None
+    try:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    finally:
+        status_file.close()
+    return None
+
+
+def minted_twice(rdf_file_name):
+    """
+    Return the subjects with more than one rdf:type in an RDF/XML add file
+    """
+    types = {}
+    subject = None
+    rdf_file = open(rdf_file_name)
+    for line in rdf_file:
+        line = line.strip()
+        if line.startswith('<rdf:Description rdf:about="'):
+            subject = line.split('"')[1]
+        elif line.startswith('<rdf:type '):
+            types[subject] = types.get(subject, 0) + 1
+    rdf_file.close()
+    return sorted([uri for uri, n in types.items() if n > 1])
+
+
+def run_ingest(dsp_file_name, graph_file_name, jobs=1, latency=0.0):
+    """
+    Run grant ingest on a DSP file against the stand-in.  Return a
+    dictionary of results
+    """
+    prefix, extension = os.path.splitext(dsp_file_name)
+    snapshot_file_name = prefix + "_snapshot.db"
+    stats_file_name = prefix + "_stats.json"
+    for name in [snapshot_file_name, stats_file_name]:
+        if os.path.exists(name):
+            os.remove(name)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(BENCH_DIR, "standin"),
+                                         REPO_DIR])
+    env['VIVO_STANDIN_GRAPH'] = graph_file_name
+    env['VIVO_STANDIN_LATENCY'] = str(latency)
+    env['VIVO_STANDIN_STATS'] = stats_file_name
+
+    samples = []
+    started = datetime.now()
+    process = subprocess.Popen([sys.executable,
+                                os.path.join(REPO_DIR, "grant_ingest.py"),
+                                dsp_file_name,
+                                "--snapshot", snapshot_file_name,
+                                "--jobs", str(jobs)],
+                               cwd=OUTPUT_DIR, env=env)
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        kb = resident_kb(process.pid)
+        if kb is not None:
+            samples.append([datetime.now(), kb])
+        time.sleep(POLL_INTERVAL)
+    finished = datetime.now()
+    if status != 0:
+        raise RuntimeError("grant_ingest.py failed on " + dsp_file_name)
+    duplicates = minted_twice(prefix + "_add.rdf")
+    if duplicates:
+        raise RuntimeError(str(len(duplicates)) + " uris minted twice by "
+                           "grant_ingest.py on " + dsp_file_name + ": " +
+                           ", ".join(duplicates[:10]))
+
+    #   Stage times and peak memory from the log and the samples
+
+    stages = read_log_stages(prefix + "_log.txt")
+    bounds = [start for name, start in stages] + [finished]
+    result = {'total_seconds': (finished - started).total_seconds(),
+              'peak_rss_kb': usage.ru_maxrss,
+              'stages': {}}
+    for i, [name, start] in enumerate(stages):
+        end = bounds[i + 1]
+        peak = max([kb for when, kb in samples if start <= when < end] or [0])
+        result['stages'][name] = {'seconds': (end - start).total_seconds(),
+                                  'peak_rss_kb': peak}
+    try:
+        stats_file = open(stats_file_name)
+        result['queries'] = json.load(stats_file)['queries']
+        stats_file.close()
+    except IOError:
+        result['queries'] = None
+    try:
+        metrics_file = open(prefix + "_metrics.json")
+        result['metrics'] = json.load(metrics_file)
+        metrics_file.close()
+    except IOError:
+        result['metrics'] = None
+    return result
+
+
+def format_report(results, baseline=None):
+    """
+    Return a text report of results, keyed by size, with the change from a
+    baseline where one is given
+    """
+    lines = []
+    for size in sorted(results, key=int):
+        result = results[size]
+        lines.append("%s rows: %.2f s, peak %d kB, %s queries" %
+                     (size, result['total_seconds'], result['peak_rss_kb'],
+                      result['queries']))
+        for name, markers in STAGES:
+            if name not in result['stages']:
+                continue
+            stage = result['stages'][name]
+            line = "    %-12s %9.2f s %10d kB" % (name, stage['seconds'],
+                                                   stage['peak_rss_kb'])
+            if baseline is not None and size in baseline and \
+                    name in baseline[size]['stages']:
+                before = baseline[size]['stages'][name]['seconds']
+                if before > 0:
+                    line = line + "  %+7.1f%%" % \
+                        (100.0 * (stage['seconds'] - before) / before)
+            lines.append(line)
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grant ingest "
+        "against the VIVO stand-in")
+    parser.add_argument("--sizes", default="1000,10000",
+        help="comma separated numbers of DSP rows")
+    parser.add_argument("--jobs", type=int, default=1,
+        help="passed to grant_ingest.py")
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds added to each stand-in query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to compare with")
+    args = parser.parse_args()
+
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    results = {}
+    for size in args.sizes.split(','):
+        prefix = os.path.join(OUTPUT_DIR, "synthetic_%s_%d" %
+                              (size, args.seed))
+        if not os.path.exists(prefix + ".nt"):
+            subprocess.check_call([sys.executable,
+                                   os.path.join(BENCH_DIR,
+                                                "make_synthetic_dsp.py"),
+                                   size, prefix, "--seed", str(args.seed)])
+        results[size] = run_ingest(prefix + ".txt", prefix + ".nt",
+                                   jobs=args.jobs, latency=args.latency)
+
+    baseline = None
+    if args.compare:
+        baseline_file = open(args.compare)
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+    print format_report(results, baseline)
+    if args.save:
+        save_file = open(args.save, 'w')
+        json.dump(results, save_file, indent=2, sort_keys=True)
+        save_file.close()
@@ -0,0 +1,235 @@
+#!/usr/bin/env/python
+
+"""
+    make_synthetic_dsp.py: Make a synthetic DSP grant data file of any size,
+    and a fixture graph for the VIVO stand-in to match it.
+
+    Rows are modeled on a real DSP extract (large_test_data_set_2.txt by
+    default).  Award types, amounts, date pairs, departments, sponsors,
+    sponsor award ids and the number of PIs, Co-PIs and investigators are
+    sampled from the rows of the model, so the synthetic data has the same
+    column mix, including its invalid values and lines with extra fields.
+    Titles are made by joining the start of one model title to the end of
+    another.
+
+    The fixture graph has the departments, sponsors and people the rows refer
+    to, less a small fraction that are left out to be "not found in VIVO",
+    and a fraction of the grants, with their dates, datetime intervals and
+    PI roles, so that the ingest has grants to add and grants to update.
+
+    Usage: python make_synthetic_dsp.py rows output_prefix [options]
+    Writes output_prefix.txt and output_prefix.nt
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import argparse
+import os
+import random
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dsp_reader import DSP_COLUMNS
+from dsp_reader import read_dsp_rows
+from grant_titles import improve_grant_title
+
+INDIVIDUAL = "http://vivo.ufl.edu/individual/"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDFS = "http://www.w3.org/2000/01/rdf-schema#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+VIVO = "http://vivoweb.org/ontology/core#"
+UFV = "http://vivo.ufl.edu/ontology/vivo-ufl/"
+
+HARVESTED = "2014-01-01 00:00:00"
+
+
+def read_model(file_name):
+    """
+    Return the rows of the model DSP file and the fraction of its lines with
+    extra fields
+    """
+    rows = [row for line_number, row in read_dsp_rows(file_name)
+            if row is not None]
+    model_file = open(file_name)
+    model_file.readline()
+    lines = 0
+    extra = 0
+    for line in model_file:
+        lines = lines + 1
+        if line.count('|') >= len(DSP_COLUMNS):
+            extra = extra + 1
+    model_file.close()
+    return [rows, float(extra) / max(lines, 1)]
+
+
+def literal(value):
+    """
+    Return an N-Triples literal
+    """
+    value = value.replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+    return '"' + value + '"'
+
+
+def triple(s, p, o):
+    return '<' + s + '> <' + p + '> ' + o + ' .\n'
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%m/%d/%Y')
+    except ValueError:
+        return None
+
+
+def make_synthetic_dsp(rows, prefix, model_file_name, existing=0.5,
+                       missing=0.02, seed=1):
+    """
+    Write prefix.txt, a DSP file with rows rows, and prefix.nt, its fixture
+    graph
+    """
+    rng = random.Random(seed)
+    [model, extra_rate] = read_model(model_file_name)
+    title_words = [row['Title'].split() for row in model
+                   if row['Title'].strip() != '']
+    ufid_counts = dict([(column, [len([u for u in row[column].split(',')
+                                       if u != '']) for row in model])
+                        for column in ['PI', 'CoPI', 'Inv']])
+    people = ["%08d" % n for n in rng.sample(xrange(10000000, 99999999),
+                                             max(500, rows // 4))]
+
+    dsp_file = open(prefix + ".txt", 'w')
+    graph_file = open(prefix + ".nt", 'w')
+    dsp_file.write('|'.join(DSP_COLUMNS) + '\r\n')
+
+    depts = set()
+    sponsors = set()
+    used_people = set()
+    dates = {}
+    intervals = {}
+
+    for i in xrange(rows):
+        row = dict(rng.choice(model))
+        row['AwardID'] = "%08d" % (10000000 + i)
+        start = rng.choice(title_words)
+        end = rng.choice(title_words)
+        row['Title'] = ' '.join(start[:(len(start) + 1) // 2] +
+                                end[(len(end) + 1) // 2:])
+        for column in ['PI', 'CoPI', 'Inv']:
+            row[column] = ','.join(rng.sample(people,
+                                              rng.choice(ufid_counts[column])))
+            used_people.update([u for u in row[column].split(',') if u != ''])
+        amounts = rng.choice(model)
+        row['TotalAwarded'] = amounts['TotalAwarded']
+        row['DirectCosts'] = amounts['DirectCosts']
+        row['Note'] = ''
+        depts.add(row['DeptID'])
+        sponsors.add(row['SponsorID'])
+
+        fields = [row[column] for column in DSP_COLUMNS]
+        if rng.random() < extra_rate:
+            fields[2] = fields[2].replace(' ', '| ', 1)
+        dsp_file.write(u'|'.join(fields).encode('utf-8') + '\r\n')
+
+        #   Some of the grants are already in VIVO
+
+        if rng.random() >= existing:
+            continue
+        grant = INDIVIDUAL + "grant" + row['AwardID']
+        out = [triple(grant, RDF + 'type', '<' + VIVO + 'Grant>'),
+               triple(grant, UFV + 'psContractNumber',
+                      literal(row['AwardID'])),
+               triple(grant, RDFS + 'label',
+                      literal(improve_grant_title(row['Title']))),
+               triple(grant, VIVO + 'totalAwardAmount',
+                      literal(row['TotalAwarded'])),
+               triple(grant, VIVO + 'grantDirectCosts',
+                      literal(row['DirectCosts'])),
+               triple(grant, VIVO + 'sponsorAwardId',
+                      literal(row['SponsorAwardID'])),
+               triple(grant, VIVO + 'localAwardId', literal(row['AwardID'])),
+               triple(grant, UFV + 'dateHarvested', literal(HARVESTED)),
+               triple(grant, VIVO + 'grantAwardedBy',
+                      '<' + INDIVIDUAL + 'sponsor' + row['SponsorID'] + '>'),
+               triple(grant, VIVO + 'administeredBy',
+                      '<' + INDIVIDUAL + 'dept' + row['DeptID'] + '>')]
+        start_date = parse_date(row['StartDate'])
+        end_date = parse_date(row['EndDate'])
+        if start_date is not None and end_date is not None:
+            for date in [start_date, end_date]:
+                if date not in dates:
+                    dates[date] = INDIVIDUAL + "date" + \
+                        date.strftime('%Y%m%d')
+                    out.append(triple(dates[date], RDF + 'type',
+                                      '<' + VIVO + 'DateTimeValue>'))
+                    out.append(triple(dates[date], VIVO + 'dateTime',
+                                      literal(date.isoformat()) + '^^<' +
+                                      XSD + 'dateTime>'))
+                    out.append(triple(dates[date], VIVO + 'dateTimePrecision',
+                                      '<' + VIVO + 'yearMonthDayPrecision>'))
+            key = (start_date, end_date)
+            if key not in intervals:
+                intervals[key] = INDIVIDUAL + "dti" + \
+                    start_date.strftime('%Y%m%d') + end_date.strftime('%Y%m%d')
+                out.append(triple(intervals[key], RDF + 'type',
+                                  '<' + VIVO + 'DateTimeInterval>'))
+                out.append(triple(intervals[key], VIVO + 'start',
+                                  '<' + dates[start_date] + '>'))
+                out.append(triple(intervals[key], VIVO + 'end',
+                                  '<' + dates[end_date] + '>'))
+            out.append(triple(grant, VIVO + 'dateTimeInterval',
+                              '<' + intervals[key] + '>'))
+        for n, ufid in enumerate([u for u in row['PI'].split(',') if u != '']):
+            role = grant + "pi" + str(n)
+            person = INDIVIDUAL + "person" + ufid
+            out.append(triple(role, RDF + 'type',
+                              '<' + VIVO + 'PrincipalInvestigatorRole>'))
+            out.append(triple(role, VIVO + 'roleContributesTo',
+                              '<' + grant + '>'))
+            out.append(triple(role, VIVO + 'principalInvestigatorRoleOf',
+                              '<' + person + '>'))
+            out.append(triple(grant, VIVO + 'relatedRole', '<' + role + '>'))
+            out.append(triple(person, VIVO + 'hasPrincipalInvestigatorRole',
+                              '<' + role + '>'))
+        graph_file.write(u''.join(out).encode('utf-8'))
+
+    #   The departments, sponsors and people, less a few left out to be "not
+    #   found in VIVO"
+
+    for kind, key_property, keys in [
+            ['dept', UFV + 'deptID', depts],
+            ['sponsor', UFV + 'sponsorID', sponsors],
+            ['person', UFV + 'ufid', used_people]]:
+        for key in sorted(keys):
+            if key.strip() == '' or rng.random() < missing:
+                continue
+            uri = INDIVIDUAL + kind + key
+            graph_file.write(triple(uri, key_property, literal(key))
+                             .encode('utf-8'))
+            graph_file.write(triple(uri, UFV + 'dateHarvested',
+                                    literal(HARVESTED)))
+    dsp_file.close()
+    graph_file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a synthetic DSP "
+        "grant data file and a fixture graph for the VIVO stand-in")
+    parser.add_argument("rows", type=int, help="number of rows to make")
+    parser.add_argument("prefix", help="output file name prefix")
+    parser.add_argument("--model", default=os.path.join(REPO_DIR,
+        "large_test_data_set_2.txt"), help="DSP file to model rows on")
+    parser.add_argument("--existing", type=float, default=0.5,
+        help="fraction of grants already in VIVO")
+    parser.add_argument("--missing", type=float, default=0.02,
+        help="fraction of departments, sponsors and people not in VIVO")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    make_synthetic_dsp(args.rows, args.prefix, args.model,
+                       existing=args.existing, missing=args.missing,
+                       seed=args.seed)
@@ -0,0 +1,448 @@
+#!/usr/bin/env/python
+
+"""
+    vivofoundation.py: Local stand-in for the vivofoundation module, for
+    running grant ingest without a VIVO.  Put bench/standin first on
+    PYTHONPATH.
+
+    Lookups and SPARQL queries are answered from a fixture graph, an
+    N-Triples file named by the VIVO_STANDIN_GRAPH environment variable.
+    VIVO_STANDIN_LATENCY adds a delay in seconds to each query, to stand for
+    the round trip to VIVO.  If VIVO_STANDIN_STATS names a file, the number
+    of queries made is written to it as JSON at exit.
+
+    vivo_sparql_query handles the basic graph patterns used by grant ingest
+    -- triple patterns joined on variables, FILTER (?v IN (...)) and
+    FILTER (str(?v) >= "...").  It is not a general SPARQL engine.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "standin"
+
+from xml.sax.saxutils import escape
+import atexit
+import json
+import os
+import random
+import re
+import time
+
+PREFIXES = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'rdfs': 'http://www.w3.org/2000/01/rdf-schema#',
+    'xsd': 'http://www.w3.org/2001/XMLSchema#',
+    'vivo': 'http://vivoweb.org/ontology/core#',
+    'ufVivo': 'http://vivo.ufl.edu/ontology/vivo-ufl/'
+    }
+
+LATENCY = float(os.environ.get('VIVO_STANDIN_LATENCY', '0'))
+
+TRIPLE_PATTERN = re.compile(
+    r'^<([^>]*)>\s+<([^>]*)>\s+(?:<([^>]*)>|"((?:[^"\\]|\\.)*)"'
+    r'(?:\^\^<([^>]*)>|@([A-Za-z-]+))?)\s*\.\s*$')
+
+stats = {'queries': 0, 'dictionaries': 0}
+graph = None
+
+#   New uris are drawn from a generator seeded with 1, so serial runs mint
+#   the same uris.  A process forked from the one that seeded it, such as a
+#   --jobs worker, reseeds it with its process id, so that workers do not
+#   mint the same uris as each other
+
+uri_random = random.Random(1)
+uri_random_pid = os.getpid()
+
+
+class Graph(object):
+    """
+    Triples indexed by subject, by predicate and by predicate and object.
+    Objects are [type, value, datatype, lang] with type 'uri' or 'literal'
+    """
+
+    def __init__(self):
+        self.by_s = {}
+        self.by_p = {}
+        self.by_po = {}
+
+    def add(self, s, p, o):
+        self.by_s.setdefault(s, []).append((p, o))
+        self.by_p.setdefault(p, []).append((s, o))
+        self.by_po.setdefault((p, o[1]), []).append(s)
+
+    def objects(self, s, p):
+        return [o for q, o in self.by_s.get(s, []) if q == p]
+
+    def values(self, p):
+        """
+        Return a dictionary of object value to subject for a predicate
+        """
+        return dict([(o[1], s) for s, o in self.by_p.get(p, [])])
+
+
+def unescape_literal(value):
+    return value.replace('\\"', '"').replace('\\n', '\n')\
+        .replace('\\\\', '\\')
+
+
+def load_graph(file_name):
+    """
+    Read an N-Triples file into a Graph
+    """
+    g = Graph()
+    for line in open(file_name):
+        line = line.decode('utf-8').strip()
+        if line == '' or line.startswith('#'):
+            continue
+        m = TRIPLE_PATTERN.match(line)
+        if m is None:
+            continue
+        s, p, o_uri, o_literal, datatype, lang = m.groups()
+        if o_uri is not None:
+            g.add(s, p, ('uri', o_uri, None, None))
+        else:
+            g.add(s, p, ('literal', unescape_literal(o_literal), datatype,
+                         lang))
+    return g
+
+
+def get_graph():
+    global graph
+    if graph is None:
+        file_name = os.environ.get('VIVO_STANDIN_GRAPH', None)
+        if file_name is None:
+            graph = Graph()
+        else:
+            graph = load_graph(file_name)
+    return graph
+
+
+def write_stats():
+    file_name = os.environ.get('VIVO_STANDIN_STATS', None)
+    if file_name is not None:
+        stats_file = open(file_name, 'w')
+        json.dump(stats, stats_file)
+        stats_file.close()
+
+atexit.register(write_stats)
+
+
+def round_trip():
+    stats['queries'] = stats['queries'] + 1
+    if LATENCY > 0:
+        time.sleep(LATENCY)
+
+
+def expand(term):
+    """
+    Return the full uri of a prefixed name or <uri>
+    """
+    if term.startswith('<'):
+        return term[1:-1]
+    if ':' in term:
+        prefix, local = term.split(':', 1)
+        if prefix in PREFIXES:
+            return PREFIXES[prefix] + local
+    return term
+
+
+def literal_or_uri(term):
+    """
+    Return the value of a string literal, or the full uri of a uri term
+    """
+    if term.startswith('"'):
+        return term[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return expand(term)
+
+#   SPARQL
+
+WHERE_PATTERN = re.compile(r'WHERE\s*\{(.*)\}', re.S | re.I)
+SELECT_PATTERN = re.compile(r'SELECT\s+(.*?)\s+WHERE', re.S | re.I)
+IN_FILTER = re.compile(
+    r'FILTER\s*\(\s*(?:str\()?(\?\w+)\)?\s+IN\s*\((.*?)\)\s*\)', re.S)
+GE_FILTER = re.compile(r'FILTER\s*\(\s*str\((\?\w+)\)\s*>=\s*"([^"]*)"\s*\)')
+TERM = re.compile(r'\?\w+|<[^>]*>|"[^"]*"|[\w-]+:[\w-]+|\ba\b')
+
+
+def match_term(term, value, solution):
+    """
+    Match a pattern term against a value ('uri' or literal tuple or uri
+    string).  Return the extended solution or None
+    """
+    if term.startswith('?'):
+        if term in solution:
+            bound = solution[term]
+            return solution if bound[1] == value[1] else None
+        extended = dict(solution)
+        extended[term] = value
+        return extended
+    if term.startswith('"'):
+        return solution if value[1] == term[1:-1] else None
+    return solution if value[1] == expand(term) else None
+
+
+def evaluate_pattern(g, pattern, solution):
+    """
+    Generate the solutions extending solution that match a triple pattern
+    """
+    s, p, o = pattern
+    if p == 'a':
+        p = 'rdf:type'
+    if s.startswith('?') and s in solution:
+        s_value = solution[s][1]
+    elif not s.startswith('?'):
+        s_value = expand(s)
+    else:
+        s_value = None
+    if s_value is not None:
+        for pv, ov in g.by_s.get(s_value, []):
+            extended = match_term(p, ('uri', pv, None, None), solution)
+            if extended is not None:
+                extended = match_term(o, ov, extended)
+                if extended is not None:
+                    extended = match_term(s, ('uri', s_value, None, None),
+                                          extended)
+                    if extended is not None:
+                        yield extended
+        return
+    if not p.startswith('?'):
+        p_value = expand(p)
+        if not o.startswith('?') or o in solution:
+            if o.startswith('?'):
+                o_value = solution[o][1]
+            elif o.startswith('"'):
+                o_value = o[1:-1]
+            else:
+                o_value = expand(o)
+            for sv in g.by_po.get((p_value, o_value), []):
+                yield match_term(s, ('uri', sv, None, None), solution)
+            return
+        for sv, ov in g.by_p.get(p_value, []):
+            extended = match_term(s, ('uri', sv, None, None), solution)
+            extended = match_term(o, ov, extended)
+            if extended is not None:
+                yield extended
+        return
+    for sv, pairs in g.by_s.items():
+        for pv, ov in pairs:
+            extended = match_term(s, ('uri', sv, None, None), solution)
+            if extended is not None:
+                extended = match_term(p, ('uri', pv, None, None), extended)
+            if extended is not None:
+                extended = match_term(o, ov, extended)
+                if extended is not None:
+                    yield extended
+
+
+def binding(value):
+    """
+    Return a SPARQL JSON result binding for a value
+    """
+    kind, v, datatype, lang = value
+    if kind == 'uri':
+        return {'type': 'uri', 'value': v}
+    b = {'type': 'literal', 'value': v}
+    if datatype is not None:
+        b['type'] = 'typed-literal'
+        b['datatype'] = datatype
+    if lang is not None:
+        b['xml:lang'] = lang
+    return b
+
+
+def vivo_sparql_query(query, debug=False, **kwargs):
+    """
+    Answer a SPARQL SELECT query from the fixture graph.  Return the result
+    in SPARQL JSON result form
+    """
+    round_trip()
+    g = get_graph()
+    body = WHERE_PATTERN.search(query).group(1)
+    select = SELECT_PATTERN.search(query).group(1).split()
+
+    in_filters = {}
+    in_kinds = {}
+    for var, terms in IN_FILTER.findall(body):
+        terms = [t.strip() for t in terms.split(',')]
+        in_filters[var] = set([literal_or_uri(t) for t in terms])
+        in_kinds[var] = 'literal' if terms[0].startswith('"') else 'uri'
+    ge_filters = GE_FILTER.findall(body)
+    body = GE_FILTER.sub('', IN_FILTER.sub('', body))
+    patterns = []
+    for statement in body.split(' .'):
+        terms = TERM.findall(statement)
+        if len(terms) == 3:
+            patterns.append(terms)
+
+    #   Variables filtered by IN are bound first, as VALUES would be
+
+    solutions = [{}]
+    for var in in_filters:
+        if any([var in [pattern[0], pattern[2]] for pattern in patterns]):
+            solutions = [dict(solution.items() +
+                              [(var, (in_kinds[var], value, None, None))])
+                         for solution in solutions
+                         for value in in_filters[var]]
+    for pattern in patterns:
+        solutions = [extended for solution in solutions
+                     for extended in evaluate_pattern(g, pattern, solution)]
+    for var, values in in_filters.items():
+        solutions = [solution for solution in solutions
+                     if solution[var][1] in values]
+    for var, low in ge_filters:
+        solutions = [solution for solution in solutions
+                     if solution[var][1] >= low]
+
+    bindings = []
+    for solution in solutions:
+        bindings.append(dict([(var[1:], binding(solution[var]))
+                              for var in select if var in solution]))
+    return {'head': {'vars': [var[1:] for var in select]},
+            'results': {'bindings': bindings}}
+
+#   Dictionaries and lookups
+
+
+def make_dictionary(predicate):
+    round_trip()
+    stats['dictionaries'] = stats['dictionaries'] + 1
+    return get_graph().values(expand(predicate))
+
+
+def make_deptid_dictionary(debug=False):
+    return make_dictionary('ufVivo:deptID')
+
+
+def make_ufid_dictionary(debug=False):
+    return make_dictionary('ufVivo:ufid')
+
+
+def find_deptid(deptid, deptid_dictionary):
+    if deptid in deptid_dictionary:
+        return [True, deptid_dictionary[deptid]]
+    return [False, None]
+
+
+def find_person(ufid, ufid_dictionary):
+    if ufid in ufid_dictionary:
+        return [True, ufid_dictionary[ufid]]
+    return [False, None]
+
+
+def find_vivo_uri(predicate, value):
+    round_trip()
+    subjects = get_graph().by_po.get((expand(predicate), value), [])
+    if subjects:
+        return subjects[0]
+    return None
+
+#   RDF
+
+
+def rdf_header():
+    return """<?xml version="1.0" encoding="ASCII"?>
+<rdf:RDF
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:rdfs="http://www.w3.org/2000/01/rdf-schema#"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema#"
+    xmlns:vivo="http://vivoweb.org/ontology/core#"
+    xmlns:ufVivo="http://vivo.ufl.edu/ontology/vivo-ufl/">
+"""
+
+
+def rdf_footer():
+    return "</rdf:RDF>\n"
+
+
+def get_vivo_uri():
+    """
+    Return a new uri not in the fixture graph
+    """
+    global uri_random_pid
+    if os.getpid() != uri_random_pid:
+        uri_random.seed(os.getpid())
+        uri_random_pid = os.getpid()
+    g = get_graph()
+    while True:
+        uri = "http://vivo.ufl.edu/individual/n" + \
+            str(uri_random.randint(1000000000, 9999999999))
+        if uri not in g.by_s:
+            return uri
+
+
+def assert_resource_property(uri, resource_property, resource_uri):
+    return '<rdf:Description rdf:about="' + uri + '">\n    <' + \
+        resource_property + ' rdf:resource="' + resource_uri + \
+        '"/>\n</rdf:Description>\n'
+
+
+def assert_data_property(uri, data_property, value):
+    """
+    value is a string, or a dictionary with the value and its xml:lang or
+    datatype, as in SPARQL results
+    """
+    attributes = u''
+    if isinstance(value, dict):
+        if 'datatype' in value:
+            attributes = u' rdf:datatype="' + value['datatype'] + u'"'
+        elif 'xml:lang' in value:
+            attributes = u' xml:lang="' + value['xml:lang'] + u'"'
+        value = value['value']
+    return u'<rdf:Description rdf:about="' + uri + u'">\n    <' + \
+        data_property + attributes + u'>' + escape(value) + u'</' + \
+        data_property + u'>\n</rdf:Description>\n'
+
+
+def update_data_property(uri, data_property, vivo_value, source_value):
+    if vivo_value is not None:
+        vivo_value = vivo_value['value']
+    if source_value == '':
+        source_value = None
+    if vivo_value == source_value:
+        return ["", ""]
+    add = ""
+    sub = ""
+    if source_value is not None:
+        add = assert_data_property(uri, data_property, source_value)
+    if vivo_value is not None:
+        sub = assert_data_property(uri, data_property, vivo_value)
+    return [add, sub]
+
+
+def update_resource_property(uri, resource_property, vivo_value,
+                             source_value):
+    if vivo_value == source_value:
+        return ["", ""]
+    add = ""
+    sub = ""
+    if source_value is not None:
+        add = assert_resource_property(uri, resource_property, source_value)
+    if vivo_value is not None:
+        sub = assert_resource_property(uri, resource_property, vivo_value)
+    return [add, sub]
+
+
+def make_datetime_rdf(datetime, precision="vivo:yearMonthDayPrecision"):
+    uri = get_vivo_uri()
+    rdf = '<rdf:Description rdf:about="' + uri + '">\n' + \
+        '    <rdf:type rdf:resource="' + expand('vivo:DateTimeValue') + \
+        '"/>\n' + \
+        '    <vivo:dateTime rdf:datatype="' + expand('xsd:dateTime') + \
+        '">' + datetime + '</vivo:dateTime>\n' + \
+        '    <vivo:dateTimePrecision rdf:resource="' + expand(precision) + \
+        '"/>\n</rdf:Description>\n'
+    return [rdf, uri]
+
+
+def make_dt_interval_rdf(start_uri, end_uri):
+    uri = get_vivo_uri()
+    rdf = '<rdf:Description rdf:about="' + uri + '">\n' + \
+        '    <rdf:type rdf:resource="' + expand('vivo:DateTimeInterval') + \
+        '"/>\n'
+    if start_uri is not None:
+        rdf = rdf + '    <vivo:start rdf:resource="' + start_uri + '"/>\n'
+    if end_uri is not None:
+        rdf = rdf + '    <vivo:end rdf:resource="' + end_uri + '"/>\n'
+    rdf = rdf + '</rdf:Description>\n'
+    return [rdf, uri]
@@ -0,0 +1,176 @@
+#!/usr/bin/env/python
+
+"""
+    vivogrants.py: Local stand-in for the vivogrants module, for running
+    grant ingest without a VIVO.  Answers from the fixture graph of the
+    vivofoundation stand-in.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "standin"
+
+from datetime import datetime
+import vivofoundation as vt
+from vivofoundation import expand
+
+GRANT_DATA_PROPERTIES = [
+    ['title', 'rdfs:label'],
+    ['total_award_amount', 'vivo:totalAwardAmount'],
+    ['grant_direct_costs', 'vivo:grantDirectCosts'],
+    ['sponsor_award_id', 'vivo:sponsorAwardId'],
+    ['local_award_id', 'vivo:localAwardId'],
+    ['pcn', 'ufVivo:psContractNumber'],
+    ['harvested_by', 'ufVivo:harvestedBy'],
+    ['date_harvested', 'ufVivo:dateHarvested']
+    ]
+
+GRANT_RESOURCE_PROPERTIES = [
+    ['sponsor_uri', 'vivo:grantAwardedBy'],
+    ['administered_by_uri', 'vivo:administeredBy'],
+    ['dti_uri', 'vivo:dateTimeInterval']
+    ]
+
+GRANT_ROLES = [
+    ['pi_uris', 'vivo:PrincipalInvestigatorRole',
+     'vivo:principalInvestigatorRoleOf', 'vivo:hasPrincipalInvestigatorRole'],
+    ['coi_uris', 'vivo:CoPrincipalInvestigatorRole',
+     'vivo:co-PrincipalInvestigatorRoleOf',
+     'vivo:hasCo-PrincipalInvestigatorRole'],
+    ['inv_uris', 'vivo:InvestigatorRole', 'vivo:investigatorRoleOf',
+     'vivo:hasInvestigatorRole']
+    ]
+
+
+def make_sponsor_dictionary(debug=False):
+    return vt.make_dictionary('ufVivo:sponsorID')
+
+
+def find_sponsor(sponsor_id, sponsor_dictionary):
+    if sponsor_id in sponsor_dictionary:
+        return [True, sponsor_dictionary[sponsor_id]]
+    return [False, None]
+
+
+def make_grant_dictionary(debug=False):
+    return vt.make_dictionary('ufVivo:psContractNumber')
+
+
+def make_date_dictionary(datetime_precision="vivo:yearMonthDayPrecision",
+                         debug=False):
+    """
+    Return a dictionary of datetime to date uri for the dates of the given
+    precision
+    """
+    vt.round_trip()
+    g = vt.get_graph()
+    precision = expand(datetime_precision)
+    date_dictionary = {}
+    for s, o in g.by_p.get(expand('vivo:dateTime'), []):
+        if precision in [p[1] for p in
+                         g.objects(s, expand('vivo:dateTimePrecision'))]:
+            date_dictionary[datetime.strptime(o[1][:19],
+                                              '%Y-%m-%dT%H:%M:%S')] = s
+    return date_dictionary
+
+
+def make_datetime_interval_dictionary(debug=False):
+    """
+    Return a dictionary of start uri + end uri to datetime interval uri
+    """
+    vt.round_trip()
+    g = vt.get_graph()
+    dti_dictionary = {}
+    for s in g.by_po.get((expand('rdf:type'),
+                          expand('vivo:DateTimeInterval')), []):
+        start = [v[1] for v in g.objects(s, expand('vivo:start'))]
+        end = [v[1] for v in g.objects(s, expand('vivo:end'))]
+        key = (start[0] if start else '') + (end[0] if end else '')
+        dti_dictionary[key] = s
+    return dti_dictionary
+
+
+def find_datetime_interval(start_uri, end_uri, dti_dictionary):
+    key = (start_uri or '') + (end_uri or '')
+    if key in dti_dictionary:
+        return [True, dti_dictionary[key]]
+    return [False, None]
+
+
+def get_grant(grant_uri):
+    """
+    Return a dictionary of the attributes and investigator uris of a grant
+    """
+    vt.round_trip()
+    g = vt.get_graph()
+    grant = {'uri': grant_uri}
+    for name, predicate in GRANT_DATA_PROPERTIES:
+        values = g.objects(grant_uri, expand(predicate))
+        if values:
+            grant[name] = vt.binding(values[0])
+    for name, predicate in GRANT_RESOURCE_PROPERTIES:
+        values = g.objects(grant_uri, expand(predicate))
+        if values:
+            grant[name] = values[0][1]
+    for uri_type, role_class, role_of, has_role in GRANT_ROLES:
+        grant[uri_type] = []
+    for role in g.objects(grant_uri, expand('vivo:relatedRole')):
+        for uri_type, role_class, role_of, has_role in GRANT_ROLES:
+            for person in g.objects(role[1], expand(role_of)):
+                grant[uri_type].append(person[1])
+    return grant
+
+
+def add_grant(grant_data):
+    """
+    Return RDF for a new grant and its roles, and the uri of the grant
+    """
+    grant_uri = vt.get_vivo_uri()
+    ardf = vt.assert_resource_property(grant_uri, 'rdf:type',
+                                       expand('vivo:Grant'))
+    for name, predicate in GRANT_DATA_PROPERTIES:
+        if grant_data.get(name, None) not in [None, '']:
+            ardf = ardf + vt.assert_data_property(grant_uri, predicate,
+                                                  grant_data[name])
+    for name, predicate in GRANT_RESOURCE_PROPERTIES:
+        if grant_data.get(name, None) is not None:
+            ardf = ardf + vt.assert_resource_property(grant_uri, predicate,
+                                                      grant_data[name])
+    for uri_type, role_class, role_of, has_role in GRANT_ROLES:
+        for person_uri in grant_data.get(uri_type, []):
+            role_uri = vt.get_vivo_uri()
+            ardf = ardf + \
+                vt.assert_resource_property(role_uri, 'rdf:type',
+                                            expand(role_class)) + \
+                vt.assert_resource_property(role_uri,
+                                            'vivo:roleContributesTo',
+                                            grant_uri) + \
+                vt.assert_resource_property(role_uri, role_of, person_uri) + \
+                vt.assert_resource_property(grant_uri, 'vivo:relatedRole',
+                                            role_uri) + \
+                vt.assert_resource_property(person_uri, has_role, role_uri)
+    return [ardf, grant_uri]
+
+
+def update_grant(grant_uri, grant_data):
+    """
+    Return add and sub RDF to bring a grant up to date.  Roles are not
+    compared
+    """
+    vivo_grant = get_grant(grant_uri)
+    ardf = ""
+    srdf = ""
+    for name, predicate in GRANT_DATA_PROPERTIES:
+        [add, sub] = vt.update_data_property(grant_uri, predicate,
+                                             vivo_grant.get(name, None),
+                                             grant_data.get(name, None))
+        ardf = ardf + add
+        srdf = srdf + sub
+    for name, predicate in GRANT_RESOURCE_PROPERTIES:
+        [add, sub] = vt.update_resource_property(grant_uri, predicate,
+                                                 vivo_grant.get(name, None),
+                                                 grant_data.get(name, None))
+        ardf = ardf + add
+        srdf = srdf + sub
+    return [ardf, srdf]
@@ -0,0 +1,64 @@
+#!/usr/bin/env/python
+
+"""
+    bench_grant_titles.py: Micro-benchmark of grant title improvement.
+    Improves every title in a DSP data file with the abbreviation cascade
+    and with the single pass improve_grant_title (first with empty caches,
+    then again with warm caches).  Checks that the results are identical and
+    reports the time taken by each.
+
+    Usage: python bench_grant_titles.py [dsp_file_name]
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import sys
+import time
+import grant_titles
+
+if len(sys.argv) > 1:
+    dsp_file_name = sys.argv[1]
+else:
+    dsp_file_name = "large_test_data_set_2.txt"
+
+titles = []
+dsp_file = open(dsp_file_name)
+dsp_file.readline()  # header
+for line in dsp_file:
+    fields = line.rstrip('\r\n').split('|')
+    if len(fields) > 2 and fields[2].strip(',') != '':
+        titles.append(fields[2])
+dsp_file.close()
+print len(titles), "titles,", len(set(titles)), "distinct, from", dsp_file_name
+
+abbreviations = grant_titles.read_abbreviations()
+
+start = time.time()
+cascade = [grant_titles.cascade_grant_title(title, abbreviations)
+           for title in titles]
+cascade_time = time.time() - start
+
+grant_titles.word_cache.clear()
+grant_titles.title_cache.clear()
+start = time.time()
+cold = [grant_titles.improve_grant_title(title) for title in titles]
+cold_time = time.time() - start
+
+start = time.time()
+warm = [grant_titles.improve_grant_title(title) for title in titles]
+warm_time = time.time() - start
+
+differences = [i for i in range(len(titles)) if cascade[i] != cold[i] or
+               cascade[i] != warm[i]]
+for i in differences[:10]:
+    print "Differs:", repr(titles[i]), repr(cascade[i]), repr(cold[i])
+
+print "Cascade      %8.3f sec" % cascade_time
+print "Single pass  %8.3f sec  %6.1fx  (empty caches)" % \
+    (cold_time, cascade_time / cold_time)
+print "Single pass  %8.3f sec  %6.1fx  (warm caches)" % \
+    (warm_time, cascade_time / warm_time)
+print len(differences), "differences"
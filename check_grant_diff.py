@@ -0,0 +1,253 @@
+#!/usr/bin/env/python
+
+"""
+    check_grant_diff.py: Check the add and sub triples grant_diff makes for
+    grants with more than one of something in VIVO -- several labels,
+    several sponsors, several roles of a person -- and for role changes.
+    Each case is a grant state as grant_prefetch returns it, DSP data for
+    the grant and the add and sub triples expected.  A literal with a
+    datatype or language is written as in N-Triples, value^^datatype or
+    value@lang.  The sub RDF of each case is read back as N-Triples and
+    checked to hold the same triples, datatypes and languages.  Reports
+    each case and the triples that differ, and exits with the number of
+    cases that fail.
+
+    New roles are minted by vivofoundation.get_vivo_uri, so a VIVO, or the
+    stand-in in bench/standin, must be at hand.  New role uris are written
+    as NEW in the expected triples.
+
+    Usage: python check_grant_diff.py
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import sys
+import grant_diff as gd
+import grant_prefetch as gp
+from rdf_sink import rdfxml_to_ntriples
+from rdf_sink import BlankNodes
+from vivo_graph import TRIPLE
+from vivo_graph import unescape
+from grant_prefetch import VIVO
+from grant_prefetch import RDF
+from grant_prefetch import RDFS
+
+GRANT = "http://vivo.ufl.edu/individual/grant1"
+ALICE = "http://vivo.ufl.edu/individual/person1"
+BOB = "http://vivo.ufl.edu/individual/person2"
+SPONSOR = "http://vivo.ufl.edu/individual/sponsor1"
+OTHER_SPONSOR = "http://vivo.ufl.edu/individual/sponsor2"
+
+LABEL = RDFS + 'label'
+AWARDED_BY = VIVO + 'grantAwardedBy'
+RELATED_ROLE = VIVO + 'relatedRole'
+PI_ROLE = VIVO + 'PrincipalInvestigatorRole'
+PI_ROLE_OF = VIVO + 'principalInvestigatorRoleOf'
+HAS_PI_ROLE = VIVO + 'hasPrincipalInvestigatorRole'
+COI_ROLE = VIVO + 'CoPrincipalInvestigatorRole'
+COI_ROLE_OF = VIVO + 'co-PrincipalInvestigatorRoleOf'
+HAS_COI_ROLE = VIVO + 'hasCo-PrincipalInvestigatorRole'
+CONTRIBUTES_TO = VIVO + 'roleContributesTo'
+XSD_STRING = "http://www.w3.org/2001/XMLSchema#string"
+XSD_INT = "http://www.w3.org/2001/XMLSchema#int"
+
+
+def literal(value, datatype=None, lang=None):
+    """
+    Return a SPARQL result binding of a literal
+    """
+    binding = {'type': 'literal', 'value': value}
+    if datatype is not None:
+        binding['type'] = 'typed-literal'
+        binding['datatype'] = datatype
+    if lang is not None:
+        binding['xml:lang'] = lang
+    return binding
+
+
+def resource(uri):
+    return {'type': 'uri', 'value': uri}
+
+
+def grant_state(labels=[], sponsors=[], pi_roles=[], coi_roles=[],
+                amounts=[]):
+    """
+    Return the prefetched state of GRANT with the given labels, sponsors,
+    total award amounts and roles.  Labels and amounts are strings or
+    bindings.  Roles are [person uri, role uri]
+    """
+    vivo_grant = gp.empty_grant_state()
+    for name, values in [['title', labels], ['total_award_amount', amounts]]:
+        vivo_grant[name] = [value if isinstance(value, dict) else
+                            literal(value) for value in values]
+    vivo_grant['sponsor_uri'] = list(sponsors)
+    for role_type, role_class, role_of, roles in [
+            ['pi_roles', PI_ROLE, PI_ROLE_OF, pi_roles],
+            ['coi_roles', COI_ROLE, COI_ROLE_OF, coi_roles]]:
+        for person_uri, role_uri in roles:
+            vivo_grant[role_type].setdefault(person_uri, []).append(role_uri)
+            vivo_grant['role_triples'][role_uri] = [
+                [RDF + 'type', resource(role_class)],
+                [CONTRIBUTES_TO, resource(GRANT)],
+                [role_of, resource(person_uri)]]
+    return vivo_grant
+
+
+def role_triples(role_uri, person_uri, role_class=PI_ROLE,
+                 role_of=PI_ROLE_OF, has_role=HAS_PI_ROLE):
+    """
+    Return the triples of a role of a person in GRANT, and its links
+    """
+    return set([(role_uri, RDF + 'type', role_class),
+                (role_uri, CONTRIBUTES_TO, GRANT),
+                (role_uri, role_of, person_uri),
+                (GRANT, RELATED_ROLE, role_uri),
+                (person_uri, has_role, role_uri)])
+
+
+def object_text(value, datatype, lang):
+    """
+    Return the object of a triple, with its datatype or language as in
+    N-Triples
+    """
+    if datatype is not None:
+        return value + u"^^" + datatype
+    if lang is not None:
+        return value + u"@" + lang
+    return value
+
+
+def triple_set(triples, vivo_grant):
+    """
+    Return a set of (subject, predicate, object) of grant_diff triples with
+    the uris of new roles written as NEW
+    """
+    known = set(vivo_grant['role_triples'].keys()) | \
+        set([GRANT, ALICE, BOB, SPONSOR, OTHER_SPONSOR])
+    new = set([triple[0] for triple in triples
+               if triple[1] == RDF + 'type' and triple[0] not in known])
+
+    def named(uri):
+        if uri in new:
+            return "NEW"
+        return uri
+    return set([(named(subject), predicate,
+                 named(object_text(value, datatype, lang)))
+                for subject, predicate, value, literal, datatype, lang
+                in triples])
+
+
+def rdf_triple_set(rdf):
+    """
+    Return a set of (subject, predicate, object) of the triples in RDF/XML
+    """
+    triples = set()
+    for line in rdfxml_to_ntriples(rdf.encode('ascii', 'xmlcharrefreplace'),
+                                   BlankNodes()):
+        s, p, o, value, datatype, lang = TRIPLE.match(line.strip()).groups()
+        if value is not None:
+            o = object_text(unescape(value.decode('ascii')), datatype, lang)
+        else:
+            o = o[1:-1]
+        triples.add((s[1:-1], p, o))
+    return triples
+
+
+def check(name, grant_data, vivo_grant, add, sub):
+    """
+    Diff a grant.  Print the case and any difference from the expected add
+    and sub triples.  Return True if the triples are as expected
+    """
+    desired = gd.desired_triples(GRANT, grant_data, vivo_grant)
+    current = gd.current_triples(GRANT, vivo_grant)
+    found_add = triple_set(gd.difference(desired, current), vivo_grant)
+    sub_triples = gd.difference(current, desired)
+    found_sub = triple_set(sub_triples, vivo_grant)
+    rdf_sub = rdf_triple_set(gd.triples_rdf(sub_triples))
+    passed = found_add == add and found_sub == sub and rdf_sub == sub
+    print "%-6s %s" % (passed and "ok" or "FAILED", name)
+    for label, found, expected in [["add", found_add, add],
+                                   ["sub", found_sub, sub],
+                                   ["sub RDF", rdf_sub, sub]]:
+        for triple in sorted(found - expected):
+            print "    unexpected", label, triple
+        for triple in sorted(expected - found):
+            print "    missing", label, triple
+    return passed
+
+cases = [
+    ["Extra label is removed",
+     {'title': u"Title", 'sponsor_uri': SPONSOR},
+     grant_state(labels=[u"Title", u"Old title"], sponsors=[SPONSOR]),
+     set(),
+     set([(GRANT, LABEL, u"Old title")])],
+    ["Changed label replaces every label",
+     {'title': u"New title", 'sponsor_uri': SPONSOR},
+     grant_state(labels=[u"Title", u"Old title"], sponsors=[SPONSOR]),
+     set([(GRANT, LABEL, u"New title")]),
+     set([(GRANT, LABEL, u"Title"), (GRANT, LABEL, u"Old title")])],
+    ["Typed and tagged labels are retracted with their datatype and "
+     "language",
+     {'title': u"Title", 'total_award_amount': u"523818"},
+     grant_state(labels=[literal(u"Old", datatype=XSD_STRING),
+                         literal(u"Old title", lang=u"en")],
+                 amounts=[literal(u"523818", datatype=XSD_INT)]),
+     set([(GRANT, LABEL, u"Title")]),
+     set([(GRANT, LABEL, u"Old^^" + XSD_STRING),
+          (GRANT, LABEL, u"Old title@en")])],
+    ["Tagged label equal to DSP by value is kept",
+     {'title': u"Title"},
+     grant_state(labels=[literal(u"Title", lang=u"en-US")]),
+     set(),
+     set()],
+    ["Extra sponsor is removed",
+     {'title': u"Title", 'sponsor_uri': SPONSOR},
+     grant_state(labels=[u"Title"], sponsors=[OTHER_SPONSOR, SPONSOR]),
+     set(),
+     set([(GRANT, AWARDED_BY, OTHER_SPONSOR)])],
+    ["Empty title removes the labels",
+     {'title': u"", 'sponsor_uri': SPONSOR},
+     grant_state(labels=[u"Title", u"Old title"], sponsors=[SPONSOR]),
+     set(),
+     set([(GRANT, LABEL, u"Title"), (GRANT, LABEL, u"Old title")])],
+    ["Duplicate role keeps the first by uri",
+     {'title': u"Title", 'pi_uris': [ALICE]},
+     grant_state(labels=[u"Title"],
+                 pi_roles=[[ALICE, GRANT + "pi2"], [ALICE, GRANT + "pi1"]]),
+     set(),
+     role_triples(GRANT + "pi2", ALICE)],
+    ["Duplicate roles of a person no longer in DSP are removed",
+     {'title': u"Title", 'pi_uris': [BOB]},
+     grant_state(labels=[u"Title"],
+                 pi_roles=[[ALICE, GRANT + "pi1"], [ALICE, GRANT + "pi2"],
+                           [BOB, GRANT + "pi3"]]),
+     set(),
+     role_triples(GRANT + "pi1", ALICE) |
+     role_triples(GRANT + "pi2", ALICE)],
+    ["Person listed twice gets one role",
+     {'title': u"Title", 'pi_uris': [ALICE, ALICE]},
+     grant_state(labels=[u"Title"]),
+     role_triples("NEW", ALICE),
+     set()],
+    ["Person moved from PI to CoPI",
+     {'title': u"Title", 'coi_uris': [ALICE]},
+     grant_state(labels=[u"Title"], pi_roles=[[ALICE, GRANT + "pi1"]]),
+     role_triples("NEW", ALICE, COI_ROLE, COI_ROLE_OF, HAS_COI_ROLE),
+     role_triples(GRANT + "pi1", ALICE)],
+    ["Person both PI and CoPI keeps both roles",
+     {'title': u"Title", 'pi_uris': [ALICE], 'coi_uris': [ALICE]},
+     grant_state(labels=[u"Title"], pi_roles=[[ALICE, GRANT + "pi1"]],
+                 coi_roles=[[ALICE, GRANT + "coi1"]]),
+     set(),
+     set()]
+    ]
+
+failed = 0
+for name, grant_data, vivo_grant, add, sub in cases:
+    if not check(name, grant_data, vivo_grant, add, sub):
+        failed = failed + 1
+print len(cases), "cases,", failed, "failed"
+sys.exit(failed)
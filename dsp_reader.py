@@ -0,0 +1,98 @@
+#!/usr/bin/env/python
+
+"""
+    dsp_reader.py: Read grant data from the Division of Sponsored Programs
+    one row at a time.
+
+    DSP data is pipe delimited with a header line and fourteen columns.  Lines
+    are decoded as UTF-8, or as Windows-1252 when they are not UTF-8.  Byte
+    order marks are removed.
+
+    Some lines have fifteen or sixteen fields -- DSP writes commas in the
+    Title and SponsorAwardID as pipes.  These are recovered by finding the
+    StartDate and EndDate, which fix the columns around them.  The extra
+    fields are joined back with commas.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import hashlib
+import re
+
+DSP_COLUMNS = ['AwardIDType', 'AwardID', 'Title', 'TotalAwarded',
+               'DirectCosts', 'StartDate', 'EndDate', 'PI', 'CoPI', 'Inv',
+               'DeptID', 'SponsorID', 'SponsorAwardID', 'Note']
+
+DATE_PATTERN = re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$')
+
+BOM = u'\ufeff'
+
+
+def decode_dsp_line(line):
+    """
+    Decode a line of DSP data.  Return unicode without line ending or byte
+    order mark
+    """
+    try:
+        line = line.decode('utf-8')
+    except UnicodeDecodeError:
+        line = line.decode('cp1252', 'replace')
+    return line.rstrip(u'\r\n').replace(BOM, u'')
+
+
+def split_dsp_line(line):
+    """
+    Split a line of DSP data into a row dictionary keyed by column name.
+    Return None if the line can not be split into the DSP columns
+    """
+    fields = line.split(u'|')
+    n = len(fields)
+    if n < len(DSP_COLUMNS):
+        return None
+    if n > len(DSP_COLUMNS):
+
+        #   Find the dates.  The Title ends before the two amounts preceding
+        #   them.  If the dates can not be found, the extra fields are taken
+        #   to be in the Title
+
+        title_end = n - 11
+        for k in range(3, n - 10):
+            if DATE_PATTERN.match(fields[k + 2].strip()) and \
+                DATE_PATTERN.match(fields[k + 3].strip()):
+                title_end = k
+                break
+        fields = [fields[0], fields[1], u','.join(fields[2:title_end])] + \
+            fields[title_end:title_end + 9] + \
+            [u','.join(fields[title_end + 9:n - 1]), fields[n - 1]]
+    return dict(zip(DSP_COLUMNS, fields))
+
+
+def dsp_fingerprint(row, salt=""):
+    """
+    Return a fingerprint of the content of a row of DSP data.  salt is
+    included so that a change in how rows are processed changes every
+    fingerprint
+    """
+    content = u'|'.join([salt] + [row[column] for column in DSP_COLUMNS])
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def read_dsp_rows(file_name):
+    """
+    Generate [line_number, row] for each line of DSP data following the
+    header.  row is None for lines that can not be split into the DSP
+    columns.  Blank lines are skipped
+    """
+    dsp_file = open(file_name, 'rb')
+    line_number = 1
+    dsp_file.readline()  # header
+    for line in dsp_file:
+        line_number = line_number + 1
+        line = decode_dsp_line(line)
+        if line.strip() == u'':
+            continue
+        yield [line_number, split_dsp_line(line)]
+    dsp_file.close()
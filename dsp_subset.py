@@ -0,0 +1,136 @@
+#!/usr/bin/env/python
+
+"""
+    dsp_subset.py: Select a subset of the grants in DSP data by pcn, for
+    development and test runs.
+
+    A pcn is selected by a hash of the pcn, by a range of pcns or by a list
+    of pcns, or by all of those given.  Selection by hash takes the pcns
+    whose md5 hash falls in the first fraction of the hashes, so the same
+    pcns are selected by every run, on every machine, whatever else is in
+    the file, and a larger fraction selects the pcns of a smaller one and
+    more.  The salt selects a different subset of the same size.
+
+    Rows of grants not in the subset are dropped as the DSP file is read,
+    before they are validated or their keys looked up, so the processing
+    of rows -- validation, key lookups, prefetching and diffing the grants
+    -- costs in proportion to the size of the subset.  The lookup
+    dictionaries are not pruned.  The date, datetime interval and grant
+    dictionaries are loaded in full, as are the department, person and
+    sponsor dictionaries unless their keys are resolved on demand, so a
+    subset run costs at least that load.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import hashlib
+
+HASH_DIGITS = 15
+
+
+def pcn_hash(pcn, salt=""):
+    """
+    Return a fraction in [0, 1) from the md5 hash of a pcn
+    """
+    content = (salt + u'|' + pcn).encode('utf-8')
+    return int(hashlib.md5(content).hexdigest()[:HASH_DIGITS], 16) / \
+        float(16 ** HASH_DIGITS)
+
+
+def pcn_order(pcn):
+    """
+    Return a key ordering pcns -- numeric pcns by number, before any
+    others, which are in string order
+    """
+    pcn = pcn.strip()
+    if pcn.isdigit():
+        return [0, int(pcn), pcn]
+    return [1, 0, pcn]
+
+
+def parse_pcn_range(text):
+    """
+    Return [first, last] from a range of pcns given as "first:last".  Either
+    may be left out for a range open at that end.  Raise ValueError for a
+    range that is not of that form
+    """
+    if text.count(':') != 1:
+        raise ValueError("A range of pcns is first:last, not " + text)
+    [first, last] = [bound.strip() or None for bound in text.split(':')]
+    return [first, last]
+
+
+def read_pcn_list(file_name):
+    """
+    Return the set of pcns in a file, separated by white space or commas.
+    Text from # to the end of a line is a comment
+    """
+    pcns = set()
+    pcn_file = open(file_name)
+    for line in pcn_file:
+        line = line.split('#', 1)[0].replace(',', ' ')
+        pcns.update([pcn.decode('utf-8') for pcn in line.split()])
+    pcn_file.close()
+    return pcns
+
+
+class DspSubset(object):
+    """
+    A subset of pcns -- those whose hash is less than fraction, in the range
+    [first, last] and in the set of pcns, for each of these that is not
+    None.  Use "pcn in subset"
+    """
+
+    def __init__(self, fraction=None, pcn_range=None, pcns=None, salt=""):
+        self.fraction = fraction
+        self.salt = salt
+        self.first = None
+        self.last = None
+        if pcn_range is not None:
+            [self.first, self.last] = pcn_range
+        self.pcns = pcns
+
+    def __contains__(self, pcn):
+        pcn = pcn.strip()
+        if self.pcns is not None and pcn not in self.pcns:
+            return False
+        if self.first is not None and pcn_order(pcn) < \
+                pcn_order(self.first):
+            return False
+        if self.last is not None and pcn_order(pcn) > pcn_order(self.last):
+            return False
+        if self.fraction is not None and pcn_hash(pcn, self.salt) >= \
+                self.fraction:
+            return False
+        return True
+
+    def identity(self):
+        """
+        Return a dictionary describing the subset, the same for the same
+        subset, for the identity of a run
+        """
+        pcns = None
+        if self.pcns is not None:
+            pcns = hashlib.md5(u'\n'.join(sorted(self.pcns)).encode(
+                'utf-8')).hexdigest()
+        return {'fraction': self.fraction, 'salt': self.salt,
+                'first': self.first, 'last': self.last, 'pcns': pcns}
+
+    def describe(self):
+        """
+        Return words describing the subset, for the log
+        """
+        words = []
+        if self.fraction is not None:
+            words.append("pcns hashing below " + str(self.fraction))
+            if self.salt:
+                words.append("with salt " + self.salt)
+        if self.first is not None or self.last is not None:
+            words.append("pcns from " + (self.first or "the first") +
+                         " to " + (self.last or "the last"))
+        if self.pcns is not None:
+            words.append(str(len(self.pcns)) + " listed pcns")
+        return ", ".join(words)
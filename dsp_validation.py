@@ -0,0 +1,153 @@
+#!/usr/bin/env/python
+
+"""
+    dsp_validation.py: Check DSP grant data in batches with declarative
+    rules.
+
+    A batch is checked in one pass over its rows.  The values of a row used
+    by the rules are converted once -- award amounts as numbers and dates
+    as datetimes -- and every rule is tested on them.  Each rule is a test
+    of the values of a row, and a message for a row failing it.  The pass
+    gives the rows accepted and the messages for the rows rejected, in row
+    order and, within a row, in rule order.
+
+    A ValidationReport groups the failures of all batches by rule for the
+    summary at the end of the exception file.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from grant_dates import parse_dsp_date
+
+BATCH_SIZE = 5000
+
+#   Number of pcns listed for each rule in the summary
+
+SUMMARY_PCNS = 10
+
+
+def to_number(value):
+    """
+    Return the number in a string, or None if it is not a number
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def row_values(row):
+    """
+    Return a dictionary of the values of a row used by the rules
+    """
+    return {'total': to_number(row['TotalAwarded']),
+            'direct': to_number(row['DirectCosts']),
+            'start': parse_dsp_date(row['StartDate']),
+            'end': parse_dsp_date(row['EndDate'])}
+
+
+def missing(value):
+    return value is None
+
+
+def negative(value):
+    return value is not None and value < 0
+
+
+def less_than(first, second):
+    return first is not None and second is not None and first < second
+
+#   Rules are [name, test, message].  test takes the values of a row and
+#   returns True if the row fails the rule.  message takes a failing row
+#   and returns the words of its exception
+
+VALIDATION_RULES = [
+    ['total_award_invalid',
+     lambda v: missing(v['total']),
+     lambda r: ["Total Award Amount", r['TotalAwarded'], "invalid number"]],
+    ['direct_costs_invalid',
+     lambda v: missing(v['direct']),
+     lambda r: ["Grant Direct Costs", r['DirectCosts'], "invalid number"]],
+    ['total_award_negative',
+     lambda v: negative(v['total']),
+     lambda r: ["Total Award Amount", r['TotalAwarded'],
+                "must not be negative"]],
+    ['direct_costs_negative',
+     lambda v: negative(v['direct']),
+     lambda r: ["Grant Direct Costs", r['DirectCosts'],
+                "must not be negative"]],
+    ['total_award_less_than_direct_costs',
+     lambda v: less_than(v['total'], v['direct']),
+     lambda r: ["Total Award Amount", r['TotalAwarded'],
+                "must not be less than Grant Direct Costs",
+                r['DirectCosts']]],
+    ['start_date_invalid',
+     lambda v: missing(v['start']),
+     lambda r: ["Start date", r['StartDate'], "invalid"]],
+    ['end_date_invalid',
+     lambda v: missing(v['end']),
+     lambda r: ["End date", r['EndDate'], "invalid"]],
+    ['end_date_before_start_date',
+     lambda v: less_than(v['end'], v['start']),
+     lambda r: ["End date", r['EndDate'], "before start date",
+                r['StartDate']]],
+    ]
+
+
+class ValidationReport(object):
+    """
+    The failures of each rule, grouped by rule
+    """
+
+    def __init__(self):
+        self.failures = dict([(name, []) for name, test, message in
+                              VALIDATION_RULES])
+
+    def add(self, name, pcn):
+        self.failures[name].append(pcn)
+
+    def counts(self):
+        return dict([(name, len(pcns)) for name, pcns in
+                     self.failures.items()])
+
+    def summary(self):
+        """
+        Return lines summarizing the failures of each rule that failed
+        """
+        lines = []
+        for name, test, message in VALIDATION_RULES:
+            pcns = self.failures[name]
+            if not pcns:
+                continue
+            line = name + ": " + str(len(pcns)) + " rows.  " + \
+                ", ".join(pcns[:SUMMARY_PCNS])
+            if len(pcns) > SUMMARY_PCNS:
+                line = line + ", ..."
+            lines.append(line + "\n")
+        return lines
+
+
+def validate_batch(rows, report):
+    """
+    Check a batch of rows in one pass.  Set the award amounts and dates of
+    each row and mark the rows failing any rule.  Add the failures to
+    report.  Return the exception lines for the batch
+    """
+    lines = []
+    for row in rows:
+        values = row_values(row)
+        if values['total'] is not None:
+            row['total_award_amount'] = row['TotalAwarded']
+        if values['direct'] is not None:
+            row['grant_direct_costs'] = row['DirectCosts']
+        row['start_date'] = values['start']
+        row['end_date'] = values['end']
+        for name, test, message in VALIDATION_RULES:
+            if test(values):
+                row['any_error'] = True
+                report.add(name, row['pcn'])
+                lines.append(u" ".join([row['pcn']] + message(row)) + u"\n")
+    return lines
@@ -0,0 +1,123 @@
+#!/usr/bin/env/python
+
+"""
+    grant_checkpoint.py: Checkpoints for resuming a grant ingest run that
+    stopped partway through processing.
+
+    A checkpoint has two parts.  The state of the run when processing
+    begins -- the VIVO dictionaries, including the dates and datetime
+    intervals created while reading the DSP data, the DSP dictionary, the
+    action report, the prefetched VIVO grants and the pcns selected for
+    processing -- is pickled once, to file_name_checkpoint.pkl.  The
+    progress of processing -- the number of selected pcns done, the grants
+    added so far and the lengths of the output files -- is written to
+    file_name_checkpoint.json every thousand or so pcns.  Both are written to a
+    temporary file and renamed, so a checkpoint is never half written.
+
+    On resume the output files are cut back to their lengths at the last
+    checkpoint and processing continues with the next pcn, so the output is
+    that of a run that was never interrupted.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import cPickle
+import json
+import os
+
+CHECKPOINT_VERSION = 3
+
+
+def state_file_name(file_name):
+    return file_name + "_checkpoint.pkl"
+
+
+def progress_file_name(file_name):
+    return file_name + "_checkpoint.json"
+
+
+def run_identity(dsp_file_name, options):
+    """
+    Return a description of a run -- its DSP file and the options that shape
+    its output -- that must match for a checkpoint to be resumed
+    """
+    status = os.stat(dsp_file_name)
+    return {'version': CHECKPOINT_VERSION,
+            'dsp_file_name': os.path.abspath(dsp_file_name),
+            'dsp_file_size': status.st_size,
+            'dsp_file_mtime': status.st_mtime,
+            'options': options}
+
+
+def replace_file(file_name, write):
+    """
+    Write a file by calling write with a temporary file, then renaming it
+    """
+    temporary_name = file_name + ".tmp"
+    temporary_file = open(temporary_name, 'wb')
+    write(temporary_file)
+    temporary_file.close()
+    os.rename(temporary_name, file_name)
+
+
+def save_state(file_name, identity, state):
+    """
+    Save the state of a run at the start of processing.  Any earlier
+    progress is removed
+    """
+    if os.path.exists(progress_file_name(file_name)):
+        os.remove(progress_file_name(file_name))
+    replace_file(state_file_name(file_name),
+                 lambda f: cPickle.dump([identity, state], f, 2))
+
+
+def save_progress(file_name, identity, progress):
+    """
+    Save the progress of processing
+    """
+    replace_file(progress_file_name(file_name),
+                 lambda f: json.dump([identity, progress], f))
+
+
+def load_checkpoint(file_name, identity):
+    """
+    Return [state, progress] of the checkpoint of a run with the given
+    identity, or None if there is no such checkpoint.  The first progress is
+    saved just after the state.  A state without progress is not a
+    checkpoint
+    """
+    try:
+        progress_file = open(progress_file_name(file_name))
+    except IOError:
+        return None
+    [progress_identity, progress] = json.load(progress_file)
+    progress_file.close()
+    if progress_identity != identity:
+        return None
+    try:
+        state_file = open(state_file_name(file_name), 'rb')
+    except IOError:
+        return None
+    [state_identity, state] = cPickle.load(state_file)
+    state_file.close()
+    if state_identity != identity:
+        return None
+    return [state, progress]
+
+
+def remove_checkpoint(file_name):
+    for name in [state_file_name(file_name), progress_file_name(file_name)]:
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def truncate_file(file_name, length):
+    """
+    Cut a file back to the given length
+    """
+    truncated_file = open(file_name, 'r+b')
+    truncated_file.truncate(length)
+    truncated_file.close()
@@ -0,0 +1,145 @@
+#!/usr/bin/env/python
+
+"""
+    grant_dates.py: Dates and datetime intervals for grant ingest, interned
+    so that each distinct date costs one parse and one lookup however many
+    grants share it.
+
+    parse_dsp_date parses the m/d/Y dates of the DSP data and remembers each
+    string it has seen.  The DSP data has few distinct dates, so nearly every
+    call is a dictionary hit.  The strings remembered are emptied when there
+    are CACHE_SIZE of them, so a long-running process does not grow.
+
+    Datetime intervals are indexed by the tuple (start uri, end uri), with
+    None for an open end, rather than by the concatenation of the uris.
+
+    A DateIndex finds the uri of a date or interval, creating the ones not
+    in VIVO.  The RDF for the new dates and intervals is collected and
+    written in one batch by flush.  The dates and intervals created are
+    kept apart as well, since they are not in VIVO until the RDF is loaded.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import vivofoundation as vt
+
+DSP_DATE_FORMAT = '%m/%d/%Y'
+
+#   Most date strings remembered
+
+CACHE_SIZE = 100000
+
+parsed_dates = {}
+
+
+def parse_dsp_date(value):
+    """
+    Return the datetime of a DSP date string, or None if it is not a valid
+    m/d/Y date.  Each distinct string is parsed once
+    """
+    try:
+        return parsed_dates[value]
+    except KeyError:
+        pass
+    try:
+        date = datetime.strptime(value, DSP_DATE_FORMAT)
+    except ValueError:
+        date = None
+    if len(parsed_dates) >= CACHE_SIZE:
+        parsed_dates.clear()
+    parsed_dates[value] = date
+    return date
+
+
+def interval_bindings(end_property, debug=False):
+    """
+    Return a dictionary of datetime interval uri to the uri of its start or
+    end date
+    """
+    query = """
+    SELECT ?dti ?date WHERE
+    {
+    ?dti rdf:type vivo:DateTimeInterval .
+    ?dti """ + end_property + """ ?date .
+    }"""
+    result = vt.vivo_sparql_query(query, debug=debug)
+    try:
+        bindings = result["results"]["bindings"]
+    except KeyError:
+        bindings = []
+    return dict([(b['dti']['value'], b['date']['value']) for b in bindings])
+
+
+def make_datetime_interval_index(debug=False):
+    """
+    Return a dictionary of datetime interval uri keyed by the tuple
+    (start uri, end uri).  An interval with no start or no end has None in
+    its place
+    """
+    starts = interval_bindings("vivo:start", debug=debug)
+    ends = interval_bindings("vivo:end", debug=debug)
+    index = {}
+    for dti in set(starts.keys()) | set(ends.keys()):
+        index[(starts.get(dti, None), ends.get(dti, None))] = dti
+    return index
+
+
+class DateIndex(object):
+    """
+    The uris of the dates and datetime intervals used by the DSP data.  New
+    dates and intervals are added to date_dictionary and interval_index as
+    they are created, and to created, keyed by dictionary name
+    """
+
+    def __init__(self, date_dictionary, interval_index):
+        self.date_dictionary = date_dictionary
+        self.interval_index = interval_index
+        self.created = {'date': {}, 'datetime_interval': {}}
+        self.pending = []
+
+    def date_uri(self, date):
+        """
+        Return [found, uri] for a datetime.  A date not found in VIVO is
+        created
+        """
+        try:
+            return [True, self.date_dictionary[date]]
+        except KeyError:
+            pass
+        [add, uri] = vt.make_datetime_rdf(date.isoformat())
+        self.date_dictionary[date] = uri
+        self.created['date'][date] = uri
+        self.pending.append(add)
+        return [False, uri]
+
+    def interval_uri(self, start_uri, end_uri):
+        """
+        Return [found, uri] for the interval from start_uri to end_uri,
+        either of which may be None.  An interval not found in VIVO is
+        created.  There is no interval without a start or an end
+        """
+        key = (start_uri, end_uri)
+        try:
+            return [True, self.interval_index[key]]
+        except KeyError:
+            pass
+        if start_uri is None and end_uri is None:
+            return [False, None]
+        [add, uri] = vt.make_dt_interval_rdf(start_uri, end_uri)
+        self.interval_index[key] = uri
+        self.created['datetime_interval'][key] = uri
+        self.pending.append(add)
+        return [False, uri]
+
+    def flush(self, add_file):
+        """
+        Write the RDF for the dates and intervals created since the last
+        flush to add_file
+        """
+        if self.pending:
+            add_file.write("".join(self.pending))
+            self.pending = []
@@ -0,0 +1,203 @@
+#!/usr/bin/env/python
+
+"""
+    grant_diff.py: Update a grant as the difference of two sets of triples.
+
+    The triples a grant should have are made from its DSP record -- its data
+    and resource properties and a role for each of its PIs, CoPIs and
+    investigators.  The triples it has are made from its prefetched VIVO
+    state.  The add RDF is the triples it should have and does not, and the
+    sub RDF the triples it has and should not.  Each set is made and
+    compared in one pass, however many properties and roles change.
+
+    A triple is (subject, predicate uri, object, literal, datatype, lang),
+    literal True for a literal object.  A literal read from VIVO keeps its
+    datatype uri or language, so that the sub RDF retracts the triple VIVO
+    holds; other triples have None for both.  Triples are compared by their
+    first four, so literals are compared by value, as
+    vivofoundation.update_data_property compares them.  A person keeping a
+    role keeps the role in VIVO, with all its triples.  A role is minted for
+    each person new to a role, with the triples vivogrants.add_grant gives
+    the roles of a new grant, so that a role is the same whether it is added
+    with its grant or later.
+
+    This replaces vivogrants.update_grant, which compares the grant as
+    get_grant returns it.  For each property it calls update_data_property
+    or update_resource_property with one VIVO value: a value differing from
+    DSP is subtracted and the DSP value added, and any other values of the
+    property are left in VIVO.  For each role type it takes the person of
+    each role, one role per person, and sorts the people into three cases
+    (see the 0.2 entry of CHANGELOG.md): in VIVO and DSP, the role is kept;
+    in VIVO only, the role is removed; in DSP only, a role is added.
+
+    The difference keeps those three cases and differs where VIVO holds
+    more than one of something:
+
+    -   Every value of a property in VIVO other than the DSP value is
+        subtracted, so a grant is left with the DSP value only.
+    -   A person with several roles of one type in the grant keeps the first
+        by uri.  The others are removed, with their triples and the links to
+        them from the grant and the person.
+    -   A person listed twice in a role column of DSP gets one role.
+    -   A removed role loses the triples of which it is the subject, and the
+        links to it.  Its datetime interval, if any, is left in VIVO.
+
+    check_grant_diff.py checks these cases.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import vivofoundation as vt
+import grant_rdf
+from grant_prefetch import GRANT_DATA_PROPERTIES
+from grant_prefetch import GRANT_RESOURCE_PROPERTIES
+from grant_prefetch import GRANT_ROLES
+from grant_prefetch import expand_prefix
+from grant_prefetch import compact_uri
+from grant_prefetch import VIVO
+from grant_prefetch import RDF
+
+RDF_TYPE = RDF + 'type'
+RELATED_ROLE = VIVO + 'relatedRole'
+ROLE_CONTRIBUTES_TO = VIVO + 'roleContributesTo'
+
+
+def resource_triple(subject, predicate_uri, uri):
+    return (subject, predicate_uri, uri, False, None, None)
+
+
+def literal_triple(subject, predicate_uri, value):
+    return (subject, predicate_uri, value, True, None, None)
+
+
+def vivo_triple(subject, predicate_uri, value):
+    """
+    Return the triple of a value in VIVO, a SPARQL result binding
+    """
+    if value['type'] == 'uri':
+        return resource_triple(subject, predicate_uri, value['value'])
+    return (subject, predicate_uri, value['value'], True,
+            value.get('datatype', None), value.get('xml:lang', None))
+
+
+def role_links(grant_uri, person_uri, role_uri, role):
+    """
+    Return the triples linking a role to its grant and its person
+    """
+    has_role = role[4]
+    return [resource_triple(grant_uri, RELATED_ROLE, role_uri),
+            resource_triple(person_uri, expand_prefix(has_role), role_uri)]
+
+
+def vivo_role_triples(role_uri, vivo_grant):
+    """
+    Return the prefetched triples of a role in VIVO
+    """
+    return [vivo_triple(role_uri, predicate_uri, value)
+            for predicate_uri, value in vivo_grant['role_triples'][role_uri]]
+
+
+def new_role_triples(grant_uri, person_uri, role):
+    """
+    Return the triples of a new role of the given role type (an entry of
+    GRANT_ROLES) for the person in the grant, with a new uri.  These are
+    the triples vivogrants.add_grant gives each role of a new grant
+    """
+    uri_type, role_type, role_class, role_of, has_role, role_of_uri = role
+    role_uri = vt.get_vivo_uri()
+    triples = [resource_triple(role_uri, RDF_TYPE, expand_prefix(role_class)),
+               resource_triple(role_uri, ROLE_CONTRIBUTES_TO, grant_uri),
+               resource_triple(role_uri, role_of_uri, person_uri)]
+    return triples + role_links(grant_uri, person_uri, role_uri, role)
+
+
+def current_triples(grant_uri, vivo_grant):
+    """
+    Return the triples of a grant in VIVO, from its prefetched state
+    """
+    triples = []
+    for name, predicate, predicate_uri in GRANT_DATA_PROPERTIES:
+        for value in vivo_grant[name]:
+            triples.append(vivo_triple(grant_uri, predicate_uri, value))
+    for name, predicate, predicate_uri in GRANT_RESOURCE_PROPERTIES:
+        for value in vivo_grant[name]:
+            triples.append(resource_triple(grant_uri, predicate_uri, value))
+    for role in GRANT_ROLES:
+        for person_uri, role_uris in sorted(vivo_grant[role[1]].items()):
+            for role_uri in sorted(role_uris):
+                triples.extend(vivo_role_triples(role_uri, vivo_grant))
+                triples.extend(role_links(grant_uri, person_uri, role_uri,
+                                          role))
+    return triples
+
+
+def desired_triples(grant_uri, grant_data, vivo_grant):
+    """
+    Return the triples a grant should have, from its DSP data.  People with
+    a role in VIVO keep it, the first by uri if they have several.  People
+    new to a role are given a new role
+    """
+    triples = []
+    for name, predicate, predicate_uri in GRANT_DATA_PROPERTIES:
+        value = grant_data.get(name, None)
+        if value is not None and value != '':
+            triples.append(literal_triple(grant_uri, predicate_uri, value))
+    for name, predicate, predicate_uri in GRANT_RESOURCE_PROPERTIES:
+        value = grant_data.get(name, None)
+        if value is not None:
+            triples.append(resource_triple(grant_uri, predicate_uri, value))
+    for role in GRANT_ROLES:
+        uri_type, role_type = role[0], role[1]
+        vivo_roles = vivo_grant[role_type]
+        people = set()
+        for person_uri in grant_data.get(uri_type, []):
+            if person_uri in people:
+                continue
+            people.add(person_uri)
+            if person_uri in vivo_roles:
+                role_uri = min(vivo_roles[person_uri])
+                triples.extend(vivo_role_triples(role_uri, vivo_grant))
+                triples.extend(role_links(grant_uri, person_uri, role_uri,
+                                          role))
+            else:
+                triples.extend(new_role_triples(grant_uri, person_uri, role))
+    return triples
+
+
+def difference(triples, other):
+    """
+    Return the triples not in other, each once, in order.  Triples are
+    compared by subject, predicate, object and literal
+    """
+    seen = set([triple[:4] for triple in other])
+    different = []
+    for triple in triples:
+        if triple[:4] not in seen:
+            seen.add(triple[:4])
+            different.append(triple)
+    return different
+
+
+def triples_rdf(triples):
+    """
+    Return RDF/XML for a list of triples
+    """
+    return grant_rdf.triples_rdf([(subject, compact_uri(predicate_uri),
+                                   value, literal, datatype, lang)
+                                  for subject, predicate_uri, value, literal,
+                                  datatype, lang in triples])
+
+
+def diff_grant(grant_uri, grant_data, vivo_grant):
+    """
+    Given the uri of a grant, the DSP data for the grant and the prefetched
+    VIVO state of the grant, return addition and subtraction RDF to bring
+    the grant in VIVO up to date with DSP.  No queries are made of VIVO
+    """
+    desired = desired_triples(grant_uri, grant_data, vivo_grant)
+    current = current_triples(grant_uri, vivo_grant)
+    return [triples_rdf(difference(desired, current)),
+            triples_rdf(difference(current, desired))]
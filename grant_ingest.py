@@ -24,7 +24,6 @@
     
     Future
     --  Use add_person from vivopeople to create new investigators
-    --  Use argparse for command line arguments.
     --  Add -v parameter to command line to route log to stdout
 """
 
@@ -34,354 +33,1344 @@ __license__ = "BSD 3-Clause license"
 __version__ = "0.8"
 
 from datetime import datetime
-import random  # for testing purposes, select subsets of records to process
-import sys
+from datetime import timedelta
+import argparse
 import os
-import vivofoundation
+import glob
+import shutil
+import tempfile
+import traceback
+import vivofoundation as vt
+from vivogrants import *
 import vivogrants
-import codecs
-
-def make_dsp_dictionary(file_name="grant_data.csv", debug=False):
+import multiprocessing
+import random
+import time
+from dsp_reader import read_dsp_rows
+from dsp_reader import dsp_fingerprint
+from dsp_subset import DspSubset
+from dsp_subset import parse_pcn_range
+from dsp_subset import read_pcn_list
+import grant_snapshot as gs
+import grant_prefetch as gp
+import grant_checkpoint as gk
+from rdf_sink import RdfSink
+from rdf_sink import NTriplesSink
+from rdf_compact import compact
+from rdf_compact import replace_files
+from grant_titles import improve_grant_title
+from grant_record import make_grant_record
+from grant_record import set_harvest
+from grant_record import GrantRecord
+from dsp_validation import validate_batch
+from dsp_validation import ValidationReport
+from dsp_validation import BATCH_SIZE
+from grant_dates import make_datetime_interval_index
+from grant_dates import DateIndex
+from grant_lookup import collect_dsp_keys
+from grant_lookup import resolve_keys
+from grant_lookup import KeyResolver
+from grant_diff import diff_grant
+import grant_rdf
+from ingest_metrics import Metrics
+from ingest_profile import Profiler
+from ingest_log import IngestLog
+from ingest_log import LEVELS
+from ingest_log import FORMATS
+from sparql_client import SparqlClient
+from sparql_client import run_concurrently
+from sparql_client import default_endpoint
+from vivo_graph import VivoGraph
+
+#   DSP rows read between progress lines in the debug log
+
+PROGRESS_ROWS = 10000
+
+def parse_dsp_rows(file_name, counts):
     """
-    Read a CSV file with grant data from the Division of Sponsored Programs.
-    Create a dictionary with one entry per PeopleSoft Contract Number (pcn).
+    Generate a row dictionary for each line of DSP data.  Lines that can not
+    be split into the DSP columns are reported and counted as errors
+    """
+    for line_number, row in read_dsp_rows(file_name):
+        counts['rows'] = counts['rows'] + 1
+        if counts['rows'] % PROGRESS_ROWS == 0:
+            log.debug("Read", counts['rows'], "DSP rows")
+        if row is None:
+            exc_log.error("Line", line_number,
+                          "can not be split into DSP columns")
+            counts['errors'] = counts['errors'] + 1
+            continue
+        row['any_error'] = False
+        yield row
 
-    If multiple rows exist in the data for a particular pcn,
-    the last row will be used in the dictionary
+
+def select_dsp_rows(rows, subset, counts):
     """
-    dsp_dictionary = {}
-    ardf = ""
-    error_count = 0
-    dsp_data = vt.read_csv(file_name)
-    for row in dsp_data.keys():
-        any_error = False
+    Drop the rows of grants not in the subset, and count them
+    """
+    for row in rows:
+        if row['AwardID'] not in subset:
+            counts['unselected'] = counts['unselected'] + 1
+            continue
+        yield row
 
-        if row % 100 == 0:
-            print row
-            
-        pcn = dsp_data[row]['AwardID']
 
-        # Simple attributes
+def skip_unchanged_rows(rows, fingerprints, grants, skipped, counts):
+    """
+    Fingerprint each row.  Rows whose fingerprint is the one recorded for
+    their pcn by the last run found in VIVO are unchanged and are skipped,
+    if their grant, in grants, is in VIVO still.  The pcn of the last row
+    skipped for a pcn is in skipped until a later row for the pcn is not.
+    Rows are buffered further on, so the caller drops the pcns in skipped
+    from the DSP dictionary once every row is read, since the last row for
+    a pcn is the one used
+    """
+    for row in rows:
+        row['fingerprint'] = dsp_fingerprint(row, __version__)
+        if fingerprints.get(row['AwardID'], None) == row['fingerprint'] and \
+                row['AwardID'] in grants:
+            counts['unchanged'] = counts['unchanged'] + 1
+            skipped.add(row['AwardID'])
+            continue
+        skipped.discard(row['AwardID'])
+        yield row
 
-        dsp_data[row]['pcn'] = pcn
-        dsp_data[row]['title'] = improve_grant_title(dsp_data[row]['Title'])
-        dsp_data[row]['sponsor_award_id'] = dsp_data[row]['SponsorAwardID']
-        dsp_data[row]['local_award_id'] = dsp_data[row]['AwardID']
-        dsp_data[row]['harvested_by'] = 'Python Grants ' + __version__
-        dsp_data[row]['date_harvested'] = str(datetime.now())
 
-        # Award amounts
+def normalize_dsp_rows(rows):
+    """
+    Add the simple attributes of each grant to its row.  local_award_id,
+    harvested_by and date_harvested are the same for every row and are kept
+    by GrantRecord
+    """
+    for row in rows:
+        row['pcn'] = row['AwardID']
+        row['title'] = improve_grant_title(row['Title'])
+        row['sponsor_award_id'] = row['SponsorAwardID']
+        yield row
 
-        try:
-            total = float(dsp_data[row]['TotalAwarded'])
-            dsp_data[row]['total_award_amount'] = dsp_data[row]['TotalAwarded']
-        except ValueError:
-            total = None
-            print >>exc_file, pcn, "Total Award Amount", \
-                dsp_data[row]['TotalAwarded'], "invalid number"
-            any_error = True
 
-        try:
-            direct = float(dsp_data[row]['DirectCosts'])
-            dsp_data[row]['grant_direct_costs'] = dsp_data[row]['DirectCosts']
-        except ValueError:
-            direct = None
-            print >>exc_file, pcn, "Grant Direct Costs", \
-                dsp_data[row]['DirectCosts'], "invalid number"
-            any_error = True
-
-        if total is not None and total < 0:
-            print >>exc_file, pcn, "Total Award Amount", \
-                dsp_data[row]['total_award_amount'], "must not be negative"
-            any_error = True
-
-        if direct is not None and direct < 0:
-            print >>exc_file, pcn, "Grant Direct Costs", \
-                dsp_data[row]['grant_direct_costs'], "must not be negative"
-            any_error = True
-
-        if direct is not None and total is not None and total < direct:
-            print >>exc_file, pcn, "Total Award Amount", \
-                dsp_data[row]['total_award_amount'],\
-                "must not be less than Grant Direct Costs", \
-                dsp_data[row]['grant_direct_costs']
-            any_error = True
+def validate_dsp_rows(rows):
+    """
+    Check the award amounts and dates of the rows in batches, with the rules
+    of dsp_validation.  Errors are reported and the row is marked.  Marked
+    rows continue through the pipeline so that all of their errors are
+    reported
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            exc_log.log_lines('error', validate_batch(batch,
+                                                      validation_report))
+            for row in batch:
+                yield row
+            batch = []
+    if batch:
+        exc_log.log_lines('error', validate_batch(batch, validation_report))
+        for row in batch:
+            yield row
+
+
+def resolve_dsp_rows(rows, resolver):
+    """
+    Resolve the department, sponsor, dates and investigators of each row to
+    VIVO uris.  Keys are resolved by the resolver, which reports those not
+    found.  Dates and datetime intervals not in VIVO are created by the date
+    index
+    """
+    for row in rows:
+        pcn = row['pcn']
 
         # Admin department
 
-        [found, administered_by_uri] = vt.find_deptid(dsp_data[row]['DeptID'], \
-            deptid_dictionary)
+        [found, administered_by_uri] = resolver.resolve('DeptID',
+                                                        row['DeptID'], pcn)
+        metrics.lookup('deptid', found)
         if found:
-            dsp_data[row]['administered_by_uri'] = administered_by_uri
+            row['administered_by_uri'] = administered_by_uri
         else:
-            print >>exc_file, pcn, "DeptID", dsp_data[row]['DeptID'], \
-                "not found in VIVO"
-            any_error = True
+            row['any_error'] = True
 
         # Sponsor
 
-        [found, sponsor_uri] = find_sponsor(dsp_data[row]['SponsorID'], \
-            sponsor_dictionary)
+        [found, sponsor_uri] = resolver.resolve('Sponsor', row['SponsorID'],
+                                                pcn)
+        metrics.lookup('sponsor', found)
         if found:
-            dsp_data[row]['sponsor_uri'] = sponsor_uri
+            row['sponsor_uri'] = sponsor_uri
         else:
-            print >>exc_file, pcn, "Sponsor", dsp_data[row]['SponsorID'], \
-                "not found in VIVO"
-            any_error = True
+            row['any_error'] = True
 
         # Start and End dates
 
-        try:
-            start_date = datetime.strptime(dsp_data[row]['StartDate'],\
-                '%m/%d/%Y')
-            if start_date in date_dictionary:
-                start_date_uri = date_dictionary[start_date]
-            else:
-                [add, start_date_uri] = \
-                    vt.make_datetime_rdf(start_date.isoformat())
-                date_dictionary[start_date] = start_date_uri
-                ardf = ardf + add
-        except ValueError:
-            print >>exc_file, pcn, "Start date", dsp_data[row]['StartDate'], \
-                "invalid"
-            start_date = None
-            start_date_uri = None
-            any_error = True
-
-        try:
-            end_date = datetime.strptime(dsp_data[row]['EndDate'],\
-                '%m/%d/%Y')
-            if end_date in date_dictionary:
-                end_date_uri = date_dictionary[end_date]
-            else:
-                [add, end_date_uri] = \
-                    vt.make_datetime_rdf(end_date.isoformat())
-                date_dictionary[end_date] = end_date_uri
-                ardf = ardf + add
-        except ValueError:
-            print >>exc_file, pcn, "End date", dsp_data[row]['EndDate'], \
-                "invalid"
-            end_date = None
-            end_date_uri = None
-            any_error = True
-
-
-        if end_date is not None and start_date is not None and \
-            end_date < start_date:
-            print >>exc_file, pcn, "End date", dsp_data[row]['EndDate'], \
-                "before start date", dsp_data[row]['StartDate']
-            any_error = True
-
-        [found, dti_uri] = find_datetime_interval(start_date_uri, \
-            end_date_uri, datetime_interval_dictionary)
-        if found:
-            dsp_data[row]['dti_uri'] = dti_uri
-        else:
-            if start_date_uri is not None or end_date_uri is not None:
-                [add, dti_uri] = vt.make_dt_interval_rdf(start_date_uri, \
-                    end_date_uri)
-                datetime_interval_dictionary[start_date_uri+\
-                    end_date_uri] = dti_uri
-                ardf = ardf + add
-                dsp_data[row]['dti_uri'] = dti_uri
+        start_date_uri = None
+        if row['start_date'] is not None:
+            [found, start_date_uri] = date_index.date_uri(row['start_date'])
+            metrics.lookup('date', found)
+            if not found:
+                metrics.count('dates_created')
+
+        end_date_uri = None
+        if row['end_date'] is not None:
+            [found, end_date_uri] = date_index.date_uri(row['end_date'])
+            metrics.lookup('date', found)
+            if not found:
+                metrics.count('dates_created')
+
+        [found, dti_uri] = date_index.interval_uri(start_date_uri, \
+            end_date_uri)
+        metrics.lookup('datetime_interval', found)
+        if dti_uri is not None:
+            row['dti_uri'] = dti_uri
+            if not found:
+                metrics.count('datetime_intervals_created')
 
         # Investigators
 
         investigator_names = [['pi_uris', 'PI'], ['coi_uris', 'CoPI'],\
             ['inv_uris', 'Inv']]
         for uri_type, ufid_type in investigator_names:
-            dsp_data[row][uri_type] = []
-            if dsp_data[row][ufid_type] != '' and \
-                dsp_data[row][ufid_type] != None:
-                ufid_list = dsp_data[row][ufid_type].split(',')
+            row[uri_type] = []
+            if row[ufid_type] != '' and \
+                row[ufid_type] != None:
+                ufid_list = row[ufid_type].split(',')
                 for ufid in ufid_list:
-                    [found, uri] = vt.find_person(ufid, ufid_dictionary)
+                    [found, uri] = resolver.resolve('UFID', ufid, pcn,
+                                                    ufid_type)
+                    metrics.lookup('ufid', found)
                     if found:
-                        dsp_data[row][uri_type].append(uri)
+                        row[uri_type].append(uri)
                     else:
-                        print >>exc_file, pcn, ufid_type, ufid, \
-                            "not found in VIVO"
-                        any_error = True
+                        row['any_error'] = True
+
+        yield row
+
+
+def make_dsp_dictionary(add_file, file_name="grant_data.csv",
+                        fingerprints=None, subset=None, debug=False):
+    """
+    Read a CSV file with grant data from the Division of Sponsored Programs.
+    Create a dictionary with one entry per PeopleSoft Contract Number (pcn).
+
+    The file is streamed through a pipeline of generators -- parse, select,
+    skip unchanged, normalize, validate, resolve -- one row at a time.  Only
+    rows without errors are kept, each as a GrantRecord holding just the
+    values needed to add or update the grant.  RDF for new dates and datetime
+    intervals is written to add_file in one batch at the end.  DeptIDs,
+    SponsorIDs and UFIDs not found in VIVO are reported at the end, once
+    each, with the grants using them.
+
+    Rows whose fingerprint matches the one given for their pcn in
+    fingerprints, and whose grant is in the grant dictionary, are skipped.
+    Pass no fingerprints to process every row.
+    Rows of grants not in subset, a DspSubset, are dropped before anything
+    else is done with them.  Pass no subset to process every grant.
+
+    If multiple rows exist in the data for a particular pcn,
+    the last row will be used in the dictionary
+    """
+    if fingerprints is None:
+        fingerprints = {}
+    dsp_dictionary = {}
+    counts = {'rows': 0, 'errors': 0, 'unchanged': 0, 'unselected': 0}
+    set_harvest('Python Grants ' + __version__, str(datetime.now()))
+    rows = parse_dsp_rows(file_name, counts)
+    if subset is not None:
+        rows = select_dsp_rows(rows, subset, counts)
+    skipped = set()
+    rows = skip_unchanged_rows(rows, fingerprints, grant_dictionary, skipped,
+                               counts)
+    rows = normalize_dsp_rows(rows)
+    rows = validate_dsp_rows(rows)
+    resolver = KeyResolver({'DeptID': [vt.find_deptid, deptid_dictionary],
+                            'Sponsor': [find_sponsor, sponsor_dictionary],
+                            'UFID': [vt.find_person, ufid_dictionary]})
+    rows = resolve_dsp_rows(rows, resolver)
+    for row in rows:
 
         # If there are any errors in the data, we can't add the grant
 
-        if any_error:
-            error_count = error_count + 1
+        if row['any_error']:
+            counts['errors'] = counts['errors'] + 1
             continue
 
-        # Assign row to dictionary entry
+        # Assign record of row to dictionary entry
+
+        dsp_dictionary[row['pcn']] = make_grant_record(row)
+    for pcn in skipped:
+        dsp_dictionary.pop(pcn, None)
+    date_index.flush(add_file)
+    exc_log.log_lines('error', resolver.report())
+    for kind, n in resolver.missing_counts().items():
+        metrics.count('missing_' + kind.lower(), n)
+    if subset is not None:
+        log.info("DSP data has ", counts['unselected'],
+                 " rows of grants not in the subset")
+        metrics.count('dsp_unselected', counts['unselected'])
+    return [counts['errors'], counts['unchanged'], dsp_dictionary]
+
+def process_pcns(pcns, add_file, sub_file):
+    """
+    Process each pcn in the list of pcns according to its case in the action
+    report.  Write RDF to add_file and sub_file.  Return a list of log
+    records [time, pcn, message] and a dictionary of the uris of the
+    grants added, keyed by pcn
+    """
+    log_records = []
+    new_grants = {}
+    for pcn in pcns:
+        if action_report[pcn] == 1:
+
+            #   Case 1: DSP Only. Add Grant to VIVO.
+
+            log_records.append([time.time(), pcn, "Case 1: Add   "])
+
+            grant_data = dsp_dictionary[pcn]
+            [add, grant_uri] = grant_rdf.new_grant_rdf(grant_data)
+            new_grants[pcn] = grant_uri
+            add_file.write(add)
+            metrics.count('grants_added')
+
+        elif action_report[pcn] == 2:
+
+            # Case 2: VIVO Only.  Nothing to do.
+
+            pass
+
+        else:
+
+            #   Case 3: DSP and VIVO. Update grant.
+
+            log_records.append([time.time(), pcn, "Case 3: Update"])
+
+            grant_uri = grant_dictionary[pcn]
+            grant_data = dsp_dictionary[pcn]
+
+            [add, sub] = diff_grant(grant_uri, grant_data,
+                                    vivo_grants[grant_uri])
+            add_file.write(add)
+            sub_file.write(sub)
+            metrics.count('grants_updated')
+    return [log_records, new_grants]
 
-        dsp_dictionary[pcn] = dsp_data[row]
-    return [ardf, error_count, dsp_dictionary]
+
+def shard_file_name(rdf_file_name, shard_number):
+    """
+    Return the name of the file holding a shard's part of an RDF file
+    """
+    return rdf_file_name + ".shard%04d" % shard_number
+
+
+def process_shard(shard):
+    """
+    Process a shard [shard_number, pcns] in a worker process.  The shard's
+    RDF is written to shard files, to be merged by the parent process.
+    Return the shard number, the results of process_pcns, the metrics of
+    the shard and the uris minted for it
+    """
+    [shard_number, pcns] = shard
+    metrics.clear()
+    del minted_uris[:]
+    if metrics.profiler is not None:
+        metrics.profiler.begin_part(shard_number)
+    if sparql_client is not None:
+        sparql_client.close()
+    shard_add_file = add_file.open_part(shard_file_name(add_file.file_name,
+                                                        shard_number))
+    shard_sub_file = sub_file.open_part(shard_file_name(sub_file.file_name,
+                                                        shard_number))
+    [log_records, new_grants] = process_pcns(pcns, shard_add_file,
+                                             shard_sub_file)
+    shard_add_file.close()
+    shard_sub_file.close()
+    if metrics.profiler is not None:
+        metrics.profiler.end_part()
+    return [shard_number, log_records, new_grants, metrics.report(),
+            list(minted_uris)]
+
+
+def save_progress(done, new_grants):
+    """
+    Save the progress of processing -- the number of selected pcns done, the
+    grants added so far and the lengths of the output files -- so that the
+    run can be resumed from here
+    """
+    gk.save_progress(file_name, run_identity, {
+        'done': done, 'new_grants': new_grants,
+        'add': add_file.checkpoint(), 'sub': sub_file.checkpoint(),
+        'log': log.tell(), 'exc': exc_log.tell()})
 
 # Driver program starts here
 
 debug = False
 
-# Fraction of records to be processed. Set to 1.0 to process all
-
-sample = 1.00
-
-if len(sys.argv) > 1:
-    dsp_file_name = str(sys.argv[1])
-else:
-    dsp_file_name = "vivo_grants.txt"
-file_name, file_extension = os.path.splitext(dsp_file_name)
-
-add_file = codecs.open(file_name+"_add.rdf", mode='w', encoding='ascii',
-                       errors='xmlcharrefreplace')
-sub_file = codecs.open(file_name+"_sub.rdf", mode='w', encoding='ascii',
-                       errors='xmlcharrefreplace')
-log_file = codecs.open(file_name+"_log.txt", mode='w', encoding='ascii',
-                       errors='xmlcharrefreplace')
-exc_file = codecs.open(file_name+"_exc.txt", mode='w', encoding='ascii',
-                       errors='xmlcharrefreplace')
-
-print >>log_file, datetime.now(), "Grant Ingest Version", __version__
-print >>log_file, datetime.now(), "VIVO Tools Version", vt.__version__
-
-add_file.write(vt.rdf_header())
-sub_file.write(vt.rdf_header())
-
-print >>log_file, datetime.now(), "Make VIVO DeptID Dictionary"
-deptid_dictionary = vt.make_deptid_dictionary(debug=debug)
-print >>log_file, datetime.now(), "VIVO deptid dictionary has ", \
-    len(deptid_dictionary), " entries"
-
-print >>log_file, datetime.now(), "Make VIVO UFID Dictionary"
-ufid_dictionary = vt.make_ufid_dictionary(debug=debug)
-print >>log_file, datetime.now(), "VIVO ufid dictionary has ", \
-    len(ufid_dictionary), " entries"
-
-print >>log_file, datetime.now(), "Make VIVO Sponsor Dictionary"
-sponsor_dictionary = make_sponsor_dictionary(debug=debug)
-print >>log_file, datetime.now(), "VIVO sponsor dictionary has ", \
-    len(sponsor_dictionary), " entries"
-
-print >>log_file, datetime.now(), "Make VIVO Date Dictionary"
-date_dictionary = \
-    make_date_dictionary(datetime_precision="vivo:yearMonthDayPrecision",\
-    debug=debug)
-print >>log_file, datetime.now(), "VIVO date dictionary has ", \
-    len(date_dictionary), " entries"
-
-print >>log_file, datetime.now(), "Make VIVO Datetime Interval Dictionary"
-datetime_interval_dictionary = make_datetime_interval_dictionary(debug=debug)
-print >>log_file, datetime.now(), "VIVO datetime interval dictionary has ", \
-    len(datetime_interval_dictionary), " entries"
-
-
-print >>log_file, datetime.now(), "Make VIVO Grant Dictionary"
-grant_dictionary = make_grant_dictionary(debug=debug)
-print >>log_file, datetime.now(), "VIVO grant dictionary has ", \
-    len(grant_dictionary), " entries"
-
-#   Read the DSP data and make a dictionary ready to be processed.  The
-#   dictionary will contain data values and references to VIVO entities
-#   (people and dates) sufficient to create or update each grant.  New dates
-#   and datetime intervals might be needed.  The make_dsp_dictionary process
-#   creates these and returns RDF for them to be added to VIVO.
-
-print >>log_file, datetime.now(), "Read DSP Grant Data from", \
-      dsp_file_name
-[ardf, error_count, dsp_dictionary] = \
-    make_dsp_dictionary(file_name=dsp_file_name,\
-    debug=debug)
-if ardf != "":
-    add_file.write(ardf)
-print >>log_file, datetime.now(), "DSP data has ", len(dsp_dictionary), \
-    " valid entries"
-print >>log_file, datetime.now(), "DSP data has ", error_count, \
-    " invalid entries.  See exception file for details"
-
-#   Loop through the DSP data and the VIVO data, adding each pcn to the
-#   action report.  1 for DSP only.  2 for VIVO only.  3 for both
-
-action_report = {}
-for pcn in dsp_dictionary.keys():
-    action_report[pcn] = action_report.get(pcn, 0) + 1
-for pcn in grant_dictionary.keys():
-    action_report[pcn] = action_report.get(pcn, 0) + 2
-
-print >>log_file, datetime.now(), "Action report has ", len(action_report), \
-    "entries"
-
-#   Loop through the action report for each pcn.  Count and log the cases
-
-n1 = 0
-n2 = 0
-n3 = 0
-for pcn in action_report.keys():
-    if action_report[pcn] == 1:
-        n1 = n1 + 1
-    elif action_report[pcn] == 2:
-        n2 = n2 + 1
-    else:
-        n3 = n3 + 1
+#   Log of a daemon, in its drop directory
+
+DAEMON_LOG = "grant_daemon_log.txt"
+
+#   Dictionaries a run adds to.  A daemon run adds to copies of them.  The
+#   entries its runs create are kept apart, as folded entries, and added to
+#   the copies for each run until they are found in VIVO
+
+CREATED_DICTIONARIES = ['date', 'datetime_interval', 'grant']
+
+#   Uris minted by get_vivo_uri in this process since its run or shard
+#   began.  Workers are forked with the random state of the parent, which
+#   get_vivo_uri draws from, so each reseeds, and the uris minted by the
+#   workers of a run are checked for duplicates before their RDF is merged
+
+minted_uris = []
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create addition and "
+        "subtraction RDF to bring VIVO grants up to date with DSP grant data")
+    parser.add_argument("dsp_file_name", nargs="?", default="vivo_grants.txt",
+        help="DSP grant data file.  Output file names are derived from it")
+    parser.add_argument("--snapshot", default="vivo_snapshot.db",
+        help="snapshot file holding the VIVO lookup dictionaries between runs")
+    parser.add_argument("--rebuild", action="store_true",
+        help="rebuild the snapshot from VIVO rather than refreshing it")
+    parser.add_argument("--max-age", type=int, default=7,
+        help="days after which the snapshot is rebuilt rather than refreshed")
+    parser.add_argument("--jobs", type=int, default=1,
+        help="number of processes for adding and updating grants")
+    parser.add_argument("--full", action="store_true",
+        help="process every DSP row, including rows unchanged since the last "
+        "run")
+    parser.add_argument("--sample", type=float, metavar="FRACTION",
+        help="process the grants whose pcns hash into the first FRACTION of "
+        "hashes.  The same grants are selected by every run")
+    parser.add_argument("--sample-salt", default="",
+        help="salt of the pcn hash, to select a different sample of the "
+        "same size")
+    parser.add_argument("--pcn-range", metavar="FIRST:LAST",
+        help="process the grants with pcns from FIRST to LAST.  Either may "
+        "be left out")
+    parser.add_argument("--pcns", metavar="FILE",
+        help="process the grants with the pcns listed in FILE")
+    parser.add_argument("--pool", action="store_true",
+        help="send SPARQL queries through a pool of keep-alive connections "
+        "rather than through vivofoundation")
+    parser.add_argument("--endpoint",
+        help="VIVO SPARQL endpoint of the connection pool.  By default the "
+        "endpoint vivofoundation queries")
+    parser.add_argument("--connections", type=int, default=4,
+        help="most SPARQL queries in flight at once, and dictionaries made at "
+        "once")
+    parser.add_argument("--min-interval", type=float, default=0.0,
+        help="least number of seconds between the starts of SPARQL queries")
+    parser.add_argument("--format", choices=["rdfxml", "nt"], default="rdfxml",
+        help="write RDF/XML add and sub files, or N-Triples chunk files")
+    parser.add_argument("--chunk-mb", type=float, default=10.0,
+        help="largest N-Triples chunk file in megabytes")
+    parser.add_argument("--gzip", action="store_true",
+        help="gzip the N-Triples chunk files")
+    parser.add_argument("--checkpoint-every", type=int, default=1000,
+        help="grants processed between checkpoints.  0 for no checkpoints")
+    parser.add_argument("--resume", action="store_true",
+        help="resume an interrupted run from its last checkpoint")
+    parser.add_argument("--log-level", default="debug",
+        choices=sorted(LEVELS, key=LEVELS.get),
+        help="least level logged.  The lines for each grant are debug.  info "
+        "for the run only")
+    parser.add_argument("--log-format", default="text", choices=FORMATS,
+        help="text lines, or JSON lines with time, level and message")
+    parser.add_argument("--on-demand", action="store_true",
+        help="when the snapshot is rebuilt, resolve only the DeptIDs, UFIDs "
+        "and SponsorIDs used by the DSP data.  The snapshot is then not saved")
+    parser.add_argument("--offline", metavar="DUMP",
+        help="answer VIVO queries from an N-Triples dump of VIVO (.nt or "
+        ".nt.gz) held in memory, rather than from the endpoint.  The snapshot "
+        "dictionaries are neither used nor saved, and no fingerprints are "
+        "saved")
+
+    parser.add_argument("--compact", action="store_true",
+        help="at the end of the run, sort the add and sub RDF by subject, "
+        "drop duplicate triples, and drop from the add RDF triples the sub "
+        "RDF removes")
+    parser.add_argument("--profile", action="store_true",
+        help="profile each stage of the run.  pstats files and collapsed "
+        "stacks for flame graphs are written to <dsp file>_profile, and the "
+        "functions taking the most time to the log")
+    parser.add_argument("--daemon", metavar="DROP_DIR",
+        help="run as a daemon, ingesting each DSP file that lands in DROP_DIR "
+        "with the lookup dictionaries kept in memory between runs.  "
+        "Interrupted runs are resumed")
+    parser.add_argument("--pattern", default="vivo_grants*.txt",
+        help="DSP files ingested by the daemon")
+    parser.add_argument("--poll", type=float, default=30.0,
+        help="seconds between looks at the drop directory")
+    args = parser.parse_args()
+    if args.sample is not None and not 0.0 < args.sample <= 1.0:
+        parser.error("--sample is a fraction greater than 0 and at most 1")
+    if args.pcn_range is not None:
+        try:
+            parse_pcn_range(args.pcn_range)
+        except ValueError, error:
+            parser.error(str(error))
+    if args.pool and args.offline:
+        parser.error("--offline answers queries from a dump and can not be "
+                     "used with --pool")
+    if args.pool and args.endpoint is None and \
+            default_endpoint(vt) is None:
+        parser.error("vivofoundation has no default endpoint.  Give "
+                     "--endpoint with --pool")
+    if args.daemon and args.on_demand:
+        parser.error("--on-demand resolves the keys of one DSP file and can "
+                     "not be used with --daemon")
+    return args
+
+
+def make_subset():
+    """
+    Return the DspSubset of grants to process given by the arguments, or
+    None to process every grant
+    """
+    if args.sample is None and args.pcn_range is None and args.pcns is None:
+        return None
+    pcn_range = None
+    if args.pcn_range is not None:
+        pcn_range = parse_pcn_range(args.pcn_range)
+    pcns = None
+    if args.pcns is not None:
+        pcns = read_pcn_list(args.pcns)
+    return DspSubset(fraction=args.sample, pcn_range=pcn_range, pcns=pcns,
+                     salt=args.sample_salt)
+
+
+def connect_vivo():
+    """
+    With --pool, send the SPARQL queries of vivofoundation and vivogrants
+    through a pool of keep-alive connections, which limits the number of
+    queries in flight.  Offline, they are answered from a dump of VIVO in memory, and new uris
+    are those not in the dump.  Each call is recorded by the metrics
+    """
+    global sparql_client, vivo_graph
+    sparql_client = None
+    vivo_graph = None
+    if args.offline:
+        metrics.begin_stage('load_vivo_dump')
+        log.info("Load VIVO dump", args.offline)
+        vivo_graph = VivoGraph()
+        vivo_graph.load(args.offline)
+        log.info("VIVO dump has", vivo_graph.triples, "triples")
+        vivo_graph.install([vt, vivogrants])
+    elif args.pool:
+        sparql_client = SparqlClient(args.endpoint or default_endpoint(vt),
+                                     max_connections=max(1, args.connections),
+                                     min_interval=args.min_interval)
+        sparql_client.install([vt, vivogrants])
+    metrics.instrument_sparql([vt, vivogrants])
+    record_minted_uris([vt, vivogrants])
+
+
+def record_minted_uris(modules):
+    """
+    Replace get_vivo_uri in each of the modules with a wrapper adding each
+    uri it returns to minted_uris
+    """
+    for module in modules:
+        get_uri = getattr(module, 'get_vivo_uri', None)
+        if get_uri is None or getattr(get_uri, 'recorded', False):
+            continue
 
-print >>log_file, datetime.now(), n1,\
-    " Grants in DSP only.  These will be added to VIVO."
-print >>log_file, datetime.now(), n2,\
-    " Grants in VIVO only.  No action will be taken."
-print >>log_file, datetime.now(), n3,\
-    " Grants in both DSP and VIVO.  Will be updated as needed."
+        def minted_uri(get_uri=get_uri):
+            uri = get_uri()
+            minted_uris.append(uri)
+            return uri
+        minted_uri.recorded = True
+        module.get_vivo_uri = minted_uri
 
-# Set up complete.  Now loop through the action report. Process each pcn
 
-print >>log_file, datetime.now(), "Begin Processing"
-row = 0
-for pcn in sorted(action_report.keys()):
-    row = row + 1
-    if row % 100 == 0:
-        print row
+def check_minted_uris(seen, uris):
+    """
+    Add uris minted by a worker to the set of uris seen in the run.  Raise
+    ValueError if any was seen before, since two entities would share it
+    """
+    duplicates = []
+    for uri in uris:
+        if uri in seen:
+            duplicates.append(uri)
+        seen.add(uri)
+    if duplicates:
+        raise ValueError("Uris minted twice in one run: " +
+                         ", ".join(duplicates[:10]))
 
-    ardf = ""
-    srdf = ""
-    r = random.random()  # random floating point between 0.0 and 1.0
-    if r > sample:
-        continue
 
-    if action_report[pcn] == 1:
+def logged_dictionary(title, name, function):
+    """
+    Return function, which makes a VIVO dictionary, timed by the metrics as
+    name_dictionary and logging the start of the dictionary and its size
+    when it is made.  The dictionaries of a rebuild are made concurrently,
+    so each is logged by the thread making it
+    """
+    timed_function = metrics.timed(name.replace(' ', '_') + '_dictionary',
+                                   function)
 
-        #   Case 1: DSP Only. Add Grant to VIVO.
+    def make_dictionary(*args, **kwargs):
+        log.info("Make VIVO", title, "Dictionary")
+        dictionary = timed_function(*args, **kwargs)
+        log.info("VIVO", name, "dictionary has ", len(dictionary), " entries")
+        return dictionary
+    return make_dictionary
 
-        print >>log_file, datetime.now(), pcn, "Case 1: Add   "
 
-        grant_data = dsp_dictionary[pcn]
-        [add, grant_uri] = add_grant(grant_data)
-        ardf = ardf + add
+def confirm_pending(snapshot, dictionaries, run_started):
+    """
+    Fold the dates, datetime intervals and grants minted by earlier runs
+    and since found in VIVO into the dictionaries, and the DSP row
+    fingerprints of the grants found into the fingerprints.  Those not found
+    within the maximum age of the snapshot are dropped
+    """
+    metrics.begin_stage('confirm_pending')
+    counts = gs.confirm_pending(snapshot, dictionaries,
+                                run_started - timedelta(days=args.max_age),
+                                debug=debug)
+    log.info("Found in VIVO", counts['date'], "dates,",
+             counts['datetime_interval'], "datetime intervals and",
+             counts['grant'], "grants created by earlier runs.",
+             counts['pending'], "not yet found.", counts['expired'],
+             "never found and dropped")
+    log.info("Found in VIVO the grants of", counts['fingerprint'],
+             "DSP row fingerprints of earlier runs")
+
+
+def no_folded():
+    """
+    Return empty folded entries -- the entries of each created dictionary,
+    and the DSP row fingerprints of the grants, created by the runs of a
+    daemon and pending in the snapshot
+    """
+    return dict([(name, {}) for name in CREATED_DICTIONARIES +
+                 ['fingerprint']])
 
-    elif action_report[pcn] == 2:
 
-        # Case 2: VIVO Only.  Nothing to do.
+def prune_folded(snapshot, folded):
+    """
+    Drop the folded entries no longer pending in the snapshot -- found in
+    VIVO, and so in the dictionaries, or never found and dropped -- and the
+    fingerprints of the grants dropped
+    """
+    for name in CREATED_DICTIONARIES:
+        pending = gs.pending_keys(snapshot, name)
+        for key in folded[name].keys():
+            if key not in pending:
+                del folded[name][key]
+    for pcn in folded['fingerprint'].keys():
+        if pcn not in folded['grant']:
+            del folded['fingerprint'][pcn]
 
-        pass
 
-    else:
+def load_lookups(snapshot, dsp_file_name, run_started, warm=None):
+    """
+    Return [dictionaries, unsaved_reason] -- the VIVO lookup dictionaries,
+    keyed by the names of gs.DICTIONARY_NAMES, and the reason they are not
+    to be saved in the snapshot, or None.
+
+    The snapshot is refreshed with the changes harvested into VIVO since it
+    was last saved, or rebuilt from VIVO when it is missing, stale or a
+    rebuild is requested.  Offline, the dictionaries are made from the
+    dump.  warm, the [dictionaries, refreshed, unsaved_reason, folded]
+    kept by a daemon, is used instead of the snapshot, refreshed with the
+    changes harvested since refreshed.  The dates, datetime intervals and
+    grants created by earlier runs are added once they are found in VIVO.
+    The dictionaries a run adds to are copies of those kept by a daemon,
+    with the folded entries of its earlier runs still pending added
+    """
+    if warm is not None:
+        [dictionaries, refreshed, unsaved_reason, folded] = warm
+        if vivo_graph is None:
+            metrics.begin_stage('refresh_snapshot')
+            log.info("Refresh VIVO dictionaries with changes harvested since",
+                     refreshed)
+            refresh_counts = gs.refresh_snapshot(dictionaries, refreshed,
+                                                 workers=args.connections,
+                                                 debug=debug)
+            confirm_pending(snapshot, dictionaries, run_started)
+            for name in gs.DICTIONARY_NAMES:
+                log.info("VIVO", name, "dictionary has ",
+                         len(dictionaries[name]), " entries, ",
+                         refresh_counts[name], " refreshed")
+        prune_folded(snapshot, folded)
+        dictionaries = dict(dictionaries)
+        for name in CREATED_DICTIONARIES:
+            dictionaries[name] = dict(dictionaries[name])
+            dictionaries[name].update(folded[name])
+        log.info("Added", len(folded['date']), "dates,",
+                 len(folded['datetime_interval']), "datetime intervals and",
+                 len(folded['grant']), "grants created by earlier runs of "
+                 "the daemon, and not yet found in VIVO, to the dictionaries")
+        return [dictionaries, unsaved_reason]
+
+    refreshed = gs.snapshot_refreshed(snapshot)
+    unsaved_reason = None
+
+    if vivo_graph is not None:
+
+        #   Offline, the dictionaries are made from the indexes of the dump.
+        #   The dump may be older than the run, so they are not saved in the
+        #   snapshot
+
+        metrics.begin_stage('dictionaries')
+        log.info("Make VIVO dictionaries from VIVO dump", args.offline)
+        log.info("Make VIVO DeptID Dictionary")
+        deptid_dictionary = vivo_graph.dictionary(gs.HARVESTED_KEYS['deptid'])
+        log.info("Make VIVO UFID Dictionary")
+        ufid_dictionary = vivo_graph.dictionary(gs.HARVESTED_KEYS['ufid'])
+        log.info("Make VIVO Sponsor Dictionary")
+        sponsor_dictionary = vivo_graph.dictionary(
+            gs.HARVESTED_KEYS['sponsor'])
+        log.info("Make VIVO Date Dictionary")
+        date_dictionary = vivo_graph.date_dictionary(
+            "vivo:yearMonthDayPrecision")
+        log.info("Make VIVO Datetime Interval Dictionary")
+        datetime_interval_dictionary = make_datetime_interval_index(
+            debug=debug)
+        log.info("Make VIVO Grant Dictionary")
+        grant_dictionary = vivo_graph.dictionary(gs.HARVESTED_KEYS['grant'])
+        for name, dictionary in [['deptid', deptid_dictionary],
+                                 ['ufid', ufid_dictionary],
+                                 ['sponsor', sponsor_dictionary],
+                                 ['date', date_dictionary],
+                                 ['datetime interval',
+                                  datetime_interval_dictionary],
+                                 ['grant', grant_dictionary]]:
+            log.info("VIVO", name, "dictionary has ", len(dictionary),
+                     " entries")
+        unsaved_reason = "VIVO dictionaries were made from a VIVO dump"
+
+    elif args.rebuild or refreshed is None or \
+        run_started - refreshed > timedelta(days=args.max_age):
+
+        log.info("Rebuild VIVO snapshot", args.snapshot)
+
+        #   The dictionaries are independent.  They are made concurrently,
+        #   each with its own SPARQL queries.  On demand, the DeptID, UFID
+        #   and Sponsor dictionaries have only the keys used by the DSP data.
+        #   They are not saved in the snapshot
+
+        metrics.begin_stage('dictionaries')
+        if args.on_demand:
+            log.info("Collect DeptIDs, UFIDs and SponsorIDs from",
+                     dsp_file_name)
+            dsp_keys = collect_dsp_keys(dsp_file_name, subset)
+            log.info("DSP data uses", len(dsp_keys['deptid']), "DeptIDs,",
+                     len(dsp_keys['ufid']), "UFIDs and",
+                     len(dsp_keys['sponsor']), "SponsorIDs")
+            lookup_calls = [
+                [logged_dictionary(title, name, resolve_keys),
+                 [gs.HARVESTED_KEYS[name], dsp_keys[name]],
+                 {'debug': debug}] for title, name in
+                [['DeptID', 'deptid'], ['UFID', 'ufid'],
+                 ['Sponsor', 'sponsor']]]
+            unsaved_reason = "DeptIDs, UFIDs and SponsorIDs were resolved " \
+                "on demand"
+        else:
+            lookup_calls = [
+                [logged_dictionary('DeptID', 'deptid',
+                                   vt.make_deptid_dictionary),
+                 [], {'debug': debug}],
+                [logged_dictionary('UFID', 'ufid', vt.make_ufid_dictionary),
+                 [], {'debug': debug}],
+                [logged_dictionary('Sponsor', 'sponsor',
+                                   make_sponsor_dictionary),
+                 [], {'debug': debug}]]
+        [deptid_dictionary, ufid_dictionary, sponsor_dictionary,
+         date_dictionary, datetime_interval_dictionary,
+         grant_dictionary] = run_concurrently(lookup_calls + [
+            [logged_dictionary('Date', 'date', make_date_dictionary), [],
+             {'datetime_precision': "vivo:yearMonthDayPrecision",
+              'debug': debug}],
+            [logged_dictionary('Datetime Interval', 'datetime interval',
+                               make_datetime_interval_index), [],
+             {'debug': debug}],
+            [logged_dictionary('Grant', 'grant', make_grant_dictionary), [],
+             {'debug': debug}]], args.connections)
+        confirm_pending(snapshot, {'date': date_dictionary,
+                                   'datetime_interval':
+                                       datetime_interval_dictionary,
+                                   'grant': grant_dictionary},
+                        run_started)
 
-        #   Case 3: DSP and VIVO. Update grant.
+    else:
 
-        print >>log_file, datetime.now(), pcn, "Case 3: Update"
+        metrics.begin_stage('load_snapshot')
+        log.info("Load VIVO snapshot", args.snapshot, "refreshed", refreshed)
+        dictionaries = gs.load_snapshot(snapshot)
+        metrics.begin_stage('refresh_snapshot')
+        log.info("Refresh VIVO snapshot with changes harvested since",
+                 refreshed)
+        refresh_counts = gs.refresh_snapshot(dictionaries, refreshed,
+                                             workers=args.connections,
+                                             debug=debug)
+        confirm_pending(snapshot, dictionaries, run_started)
+        for name in gs.DICTIONARY_NAMES:
+            log.info("VIVO", name, "dictionary has ", len(dictionaries[name]),
+                     " entries, ", refresh_counts[name], " refreshed")
+        return [dictionaries, unsaved_reason]
+
+    return [{'deptid': deptid_dictionary,
+             'ufid': ufid_dictionary,
+             'sponsor': sponsor_dictionary,
+             'date': date_dictionary,
+             'datetime_interval': datetime_interval_dictionary,
+             'grant': grant_dictionary}, unsaved_reason]
+
+
+def ingest(dsp_file_name, warm=None, resume=False):
+    """
+    Ingest a DSP file.  Write its add and sub RDF, log, exception and
+    metrics files.  warm is the [dictionaries, refreshed, unsaved_reason,
+    folded] kept by a daemon, or None to load the dictionaries for this run.
+    With resume, an interrupted run of the file is resumed from its last
+    checkpoint.  Return [run_started, created] -- the time the run started
+    and the entries it saved as pending, as for folded entries, or None if
+    it saved none
+    """
+    global file_name, run_identity, add_file, sub_file, log, exc_log, subset
+
+    metrics.clear()
+    del minted_uris[:]
+    file_name, file_extension = os.path.splitext(dsp_file_name)
+    subset = make_subset()
+
+    #   A resumed run continues from the last checkpoint of an interrupted
+    #   run of the same DSP file with the same output options.  Its output
+    #   files are cut back to their lengths at the checkpoint
+
+    options = {'format': args.format, 'chunk_mb': args.chunk_mb,
+               'gzip': args.gzip, 'full': args.full,
+               'on_demand': args.on_demand, 'offline': args.offline}
+    if subset is not None:
+        options['subset'] = subset.identity()
+    run_identity = gk.run_identity(dsp_file_name, options)
+    checkpoint = None
+    if resume:
+        checkpoint = gk.load_checkpoint(file_name, run_identity)
+        if checkpoint is None and warm is None:
+            print "No checkpoint to resume for", dsp_file_name, \
+                "Starting from the beginning"
+    if checkpoint is None:
+        progress = {'add': None, 'sub': None}
+        file_mode = 'w'
+    else:
+        [state, progress] = checkpoint
+        gk.truncate_file(file_name+"_log.txt", progress['log'])
+        gk.truncate_file(file_name+"_exc.txt", progress['exc'])
+        file_mode = 'a'
+
+    if args.format == "nt":
+        max_bytes = int(args.chunk_mb * 1024 * 1024)
+        add_file = NTriplesSink(file_name+"_add", max_bytes=max_bytes,
+                                compress=args.gzip, resume=progress['add'])
+        sub_file = NTriplesSink(file_name+"_sub", max_bytes=max_bytes,
+                                compress=args.gzip, resume=progress['sub'])
+    else:
+        add_file = RdfSink(file_name+"_add.rdf", resume=progress['add'])
+        sub_file = RdfSink(file_name+"_sub.rdf", resume=progress['sub'])
+
+    #   The log and exception files are written by background threads.  The
+    #   exception file has every exception, whatever the log level, and no
+    #   times.  They are closed however the run ends
+
+    log = IngestLog(file_name+"_log.txt", mode=file_mode,
+                    level=args.log_level, format=args.log_format)
+    exc_log = IngestLog(file_name+"_exc.txt", mode=file_mode,
+                        format=args.log_format, stamp=False)
+    if args.profile:
+        metrics.profiler = Profiler(file_name+"_profile", log=log)
+    try:
+        if warm is None:
+            connect_vivo()
+        return process_dsp_file(dsp_file_name, warm, checkpoint)
+    finally:
+        if metrics.profiler is not None:
+            metrics.profiler.close()
+            metrics.profiler = None
+        log.close()
+        exc_log.close()
+
+
+def process_dsp_file(dsp_file_name, warm, checkpoint):
+    """
+    The body of a run of ingest, once its output files are open.  Return
+    [run_started, created], as for ingest
+    """
+    global deptid_dictionary, ufid_dictionary, sponsor_dictionary
+    global date_dictionary, datetime_interval_dictionary, grant_dictionary
+    global date_index, validation_report, dsp_dictionary, action_report
+    global vivo_grants
+
+    snapshot = gs.open_snapshot(args.snapshot)
+
+    if checkpoint is None:
+
+        log.info("Grant Ingest Version", __version__)
+        log.info("VIVO Tools Version", vt.__version__)
+
+        add_file.write_header()
+        sub_file.write_header()
+
+        #   Load the VIVO lookup dictionaries
+
+        run_started = datetime.now()
+        [dictionaries, unsaved_reason] = load_lookups(snapshot, dsp_file_name,
+                                                      run_started, warm)
+        folded = no_folded()
+        if warm is not None:
+            folded = warm[3]
+        deptid_dictionary = dictionaries['deptid']
+        ufid_dictionary = dictionaries['ufid']
+        sponsor_dictionary = dictionaries['sponsor']
+        date_dictionary = dictionaries['date']
+        datetime_interval_dictionary = dictionaries['datetime_interval']
+        grant_dictionary = dictionaries['grant']
+
+        #   A subset run knows only some of the grants in the DSP data.
+        #   Neither its dictionaries nor its fingerprints are saved, so that a
+        #   later run of the whole file is not misled by it
+
+        if subset is not None and unsaved_reason is None:
+            unsaved_reason = "Only a subset of the grants was processed"
+
+        #   Read the DSP data and make a dictionary ready to be processed.
+        #   The dictionary will contain data values and references to VIVO
+        #   entities (people and dates) sufficient to create or update each
+        #   grant.  New dates and datetime intervals might be needed.  The
+        #   make_dsp_dictionary process creates these and writes RDF for them
+        #   to the add file.
+
+        #   Rows unchanged since the last run that processed them and whose
+        #   RDF is in VIVO are skipped unless a full run is requested.  The
+        #   fingerprints of the rows processed by this run are saved as
+        #   pending, for the runs after its RDF is loaded.
+
+        if args.full:
+            log.info("Full run.  All DSP rows will be processed")
+            skip_fingerprints = None
+        else:
+            log.info("Delta run.  DSP rows unchanged since the last run will "
+                     "be skipped")
+            skip_fingerprints = gs.load_fingerprints(snapshot)
+            skip_fingerprints.update(folded['fingerprint'])
+
+        metrics.begin_stage('read_dsp')
+        date_index = DateIndex(date_dictionary, datetime_interval_dictionary)
+        validation_report = ValidationReport()
+        log.info("Read DSP Grant Data from", dsp_file_name)
+        if subset is not None:
+            log.info("Subset run.  Only grants in the subset will be "
+                     "processed:", subset.describe())
+        [error_count, unchanged_count, dsp_dictionary] = \
+            make_dsp_dictionary(add_file, file_name=dsp_file_name,\
+            fingerprints=skip_fingerprints, subset=subset, debug=debug)
+        log.info("DSP data has ", unchanged_count,
+                 " entries unchanged since the last run")
+        log.info("DSP data has ", len(dsp_dictionary), " valid entries")
+        log.info("DSP data has ", error_count,
+                 " invalid entries.  See exception file for details")
+        metrics.count('dsp_unchanged', unchanged_count)
+        metrics.count('dsp_valid', len(dsp_dictionary))
+        metrics.count('dsp_invalid', error_count)
+        for name, n in validation_report.counts().items():
+            metrics.count('rule_' + name, n)
+        summary = validation_report.summary()
+        if summary:
+            exc_log.info()
+            exc_log.info("Summary of DSP data failing validation rules")
+            exc_log.log_lines('info', summary)
+
+        #   Loop through the DSP data and the VIVO data, adding each pcn to the
+        #   action report.  1 for DSP only.  2 for VIVO only.  3 for both.  In
+        #   a subset run, only the VIVO grants in the subset are reported
+
+        metrics.begin_stage('action_report')
+        action_report = {}
+        for pcn in dsp_dictionary.keys():
+            action_report[pcn] = action_report.get(pcn, 0) + 1
+        for pcn in grant_dictionary.keys():
+            if subset is None or pcn in subset:
+                action_report[pcn] = action_report.get(pcn, 0) + 2
+
+        log.info("Action report has ", len(action_report), "entries")
+
+        #   Loop through the action report for each pcn.  Count and log the
+        #   cases
+
+        n1 = 0
+        n2 = 0
+        n3 = 0
+        for pcn in action_report.keys():
+            if action_report[pcn] == 1:
+                n1 = n1 + 1
+            elif action_report[pcn] == 2:
+                n2 = n2 + 1
+            else:
+                n3 = n3 + 1
+
+        log.info(n1, " Grants in DSP only.  These will be added to VIVO.")
+        log.info(n2, " Grants in VIVO only.  No action will be taken.")
+        log.info(n3, " Grants in both DSP and VIVO.  Will be updated as "
+                 "needed.")
+        metrics.count('case_1', n1)
+        metrics.count('case_2', n2)
+        metrics.count('case_3', n3)
+
+        #   A grant added by an earlier run whose RDF has not been found in
+        #   VIVO is added again.  If both runs are loaded, VIVO will have the
+        #   grant twice
+
+        readded = gs.pending_keys(snapshot, 'grant') & \
+            set([pcn for pcn in action_report if action_report[pcn] == 1])
+        if readded:
+            log.warning(len(readded), "grants to be added were added by an "
+                        "earlier run whose RDF has not been found in VIVO.  "
+                        "Load the RDF of only one of the runs")
+
+        #   A grant added by an earlier run of the daemon and changed since
+        #   is updated before it is found in VIVO, as a grant with nothing in
+        #   VIVO.  Its RDF is written again, with new roles
+
+        unfound = set([pcn for pcn in folded['grant']
+                       if action_report.get(pcn, 0) == 3])
+        if unfound:
+            log.warning(len(unfound), "grants to be updated were added by an "
+                        "earlier run of the daemon whose RDF has not been "
+                        "found in VIVO.  They are added again.  Load the RDF "
+                        "of each run before the next")
+
+        #   Fetch the VIVO state of the grants to be updated in a few batched
+        #   queries rather than one grant at a time in the processing loop
+
+        metrics.begin_stage('prefetch')
+        case3_uris = [grant_dictionary[pcn] for pcn in action_report.keys() \
+            if action_report[pcn] == 3]
+        log.info("Prefetch VIVO state of", len(case3_uris), "grants")
+        vivo_grants = gp.prefetch_grants(case3_uris, debug=debug)
+        log.info("Prefetch complete")
+
+        # Set up complete.  Now loop through the action report.  Process each
+        # pcn
+
+        log.info("Begin Processing")
+        selected = [pcn for pcn in sorted(action_report.keys())
+                    if action_report[pcn] != 2]
+
+        #   Save the state of the run for resuming it
+
+        if args.checkpoint_every > 0:
+            gk.save_state(file_name, run_identity, {
+                'run_started': run_started,
+                'dictionaries': {'deptid': deptid_dictionary,
+                                 'ufid': ufid_dictionary,
+                                 'sponsor': sponsor_dictionary,
+                                 'date': date_dictionary,
+                                 'datetime_interval':
+                                     datetime_interval_dictionary,
+                                 'grant': grant_dictionary},
+                'harvest': [GrantRecord.harvested_by,
+                            GrantRecord.date_harvested],
+                'unsaved_reason': unsaved_reason,
+                'created': date_index.created,
+                'folded': folded,
+                'dsp_dictionary': dsp_dictionary,
+                'action_report': action_report,
+                'vivo_grants': vivo_grants,
+                'selected': selected})
+            save_progress(0, {})
+        created = date_index.created
+        done = 0
+        new_grants = {}
 
-        grant_uri = grant_dictionary[pcn]
-        grant_data = dsp_dictionary[pcn]
+    else:
 
-        [add, sub] = update_grant(grant_uri, grant_data)
-        ardf = ardf + add
-        srdf = srdf + sub
+        #   Resume.  Restore the state of the run and the progress at the last
+        #   checkpoint
+
+        [state, progress] = checkpoint
+        run_started = state['run_started']
+        deptid_dictionary = state['dictionaries']['deptid']
+        ufid_dictionary = state['dictionaries']['ufid']
+        sponsor_dictionary = state['dictionaries']['sponsor']
+        date_dictionary = state['dictionaries']['date']
+        datetime_interval_dictionary = \
+            state['dictionaries']['datetime_interval']
+        grant_dictionary = state['dictionaries']['grant']
+        set_harvest(*state['harvest'])
+        unsaved_reason = state['unsaved_reason']
+        created = state['created']
+        folded = state['folded']
+        dsp_dictionary = state['dsp_dictionary']
+        action_report = state['action_report']
+        vivo_grants = state['vivo_grants']
+        selected = state['selected']
+        done = progress['done']
+        new_grants = progress['new_grants']
+        log.info("Resume processing after", done, "of", len(selected),
+                 "grants")
+
+    metrics.begin_stage('process')
+    remaining = selected[done:]
+    checkpoint_every = args.checkpoint_every
+    if checkpoint_every <= 0:
+        checkpoint_every = max(1, len(remaining))
+
+    if args.jobs > 1 and len(remaining) > 0:
+
+        #   Split the pcns into contiguous shards, several per worker so that
+        #   work is balanced, and no larger than the checkpoint interval.
+        #   Workers are forked with the dictionaries in place and write shard
+        #   files.  Shards are merged in order as they finish, so the RDF is in
+        #   pcn order as in a serial run, and a checkpoint is saved after each.
+        #   Each worker reseeds random from the system's random source.  A
+        #   shard minting a uri minted before in the run stops the run, and
+        #   neither it nor the shards after it are merged; --resume redoes
+        #   them
+
+        shard_size = min(checkpoint_every,
+                         max(1, -(-len(remaining) // (args.jobs * 4))))
+        shards = [[i, remaining[start:start + shard_size]] for i, start in
+                  enumerate(range(0, len(remaining), shard_size))]
+        log.info("Processing", len(remaining), "grants in", len(shards),
+                 "shards with", args.jobs, "processes")
+        add_file.flush()
+        sub_file.flush()
+        seen_uris = set(minted_uris) | set(new_grants.values())
+        duplicated = None
+        pool = multiprocessing.Pool(args.jobs, initializer=random.seed)
+        for shard_number, log_records, shard_grants, shard_metrics, \
+                shard_uris in pool.imap(process_shard, shards):
+            if duplicated is None:
+                try:
+                    check_minted_uris(seen_uris, shard_uris)
+                except ValueError, error:
+                    duplicated = error
+            if duplicated is not None:
+                for rdf_file in [add_file, sub_file]:
+                    os.remove(shard_file_name(rdf_file.file_name,
+                                              shard_number))
+                continue
+            for rdf_file in [add_file, sub_file]:
+                shard_name = shard_file_name(rdf_file.file_name, shard_number)
+                rdf_file.append_file(shard_name)
+                os.remove(shard_name)
+            for when, pcn, message in log_records:
+                log.debug(pcn, message, when=when, pcn=pcn)
+            new_grants.update(shard_grants)
+            metrics.merge(shard_metrics)
+            done = done + len(shards[shard_number][1])
+            if args.checkpoint_every > 0:
+                save_progress(done, new_grants)
+        pool.close()
+        pool.join()
+        if duplicated is not None:
+            raise duplicated
+    else:
+        for start in range(0, len(remaining), checkpoint_every):
+            block = remaining[start:start + checkpoint_every]
+            [log_records, block_grants] = process_pcns(block, add_file,
+                                                       sub_file)
+            for when, pcn, message in log_records:
+                log.debug(pcn, message, when=when, pcn=pcn)
+            new_grants.update(block_grants)
+            done = done + len(block)
+            if args.checkpoint_every > 0:
+                save_progress(done, new_grants)
+
+
+    #   Done processing the Grants.  Wrap-up
+
+    add_file.write_footer()
+    sub_file.write_footer()
+    log.info("End Processing")
+
+    #   Save the dictionaries as the snapshot for the next run.  The dates,
+    #   datetime intervals and grants created by this run are not in VIVO
+    #   until its RDF is loaded.  They are saved as pending, and are added
+    #   to the dictionaries by a later run once they are found in VIVO.  The
+    #   folded entries of earlier runs of a daemon are pending, and are not
+    #   saved either
+
+    metrics.begin_stage('save_snapshot')
+    dictionaries = {'deptid': deptid_dictionary,
+                    'ufid': ufid_dictionary,
+                    'sponsor': sponsor_dictionary,
+                    'date': date_dictionary,
+                    'datetime_interval': datetime_interval_dictionary,
+                    'grant': grant_dictionary}
+    for name in ['date', 'datetime_interval']:
+        for key in created[name]:
+            del dictionaries[name][key]
+    for name in CREATED_DICTIONARIES:
+        for key, uri in folded[name].items():
+            if dictionaries[name].get(key, None) == uri:
+                del dictionaries[name][key]
+    if unsaved_reason is not None:
+        log.info("VIVO snapshot not saved.", unsaved_reason)
+    else:
+        gs.save_snapshot(snapshot, dictionaries, run_started)
+        log.info("Saved VIVO snapshot", args.snapshot)
+    saved = None
+    if subset is not None:
+        log.info("Pending entries and DSP row fingerprints not saved.  Only "
+                 "a subset of the grants was processed")
+    elif vivo_graph is not None:
+        log.info("Pending entries and DSP row fingerprints not saved.  VIVO "
+                 "was read from a dump, which may not be the VIVO the RDF is "
+                 "loaded into")
+    else:
+        gs.save_pending(snapshot, GrantRecord.date_harvested,
+                        {'date': created['date'],
+                         'datetime_interval': created['datetime_interval'],
+                         'grant': new_grants})
+        log.info("Saved", len(created['date']), "dates,",
+                 len(created['datetime_interval']), "datetime intervals and",
+                 len(new_grants), "grants created by this run as pending in",
+                 args.snapshot)
+        gs.save_pending_fingerprints(snapshot, GrantRecord.date_harvested,
+            dict([(pcn, dsp_dictionary[pcn]['fingerprint'])
+                  for pcn in selected]))
+        log.info("Saved DSP row fingerprints as pending in", args.snapshot)
+        saved = {'date': created['date'],
+                 'datetime_interval': created['datetime_interval'],
+                 'grant': new_grants,
+                 'fingerprint': dict([(pcn, dsp_dictionary[pcn]['fingerprint'])
+                                      for pcn in new_grants])}
+    snapshot.close()
+
+    add_file.close()
+    sub_file.close()
+
+    #   Compact the add and sub RDF in a work directory next to them.  The
+    #   compacted files replace the originals once the checkpoint is
+    #   removed, so that a resumed run never cuts back a compacted file
+
+    if args.compact:
+        metrics.begin_stage('compact')
+        work_directory = tempfile.mkdtemp(
+            prefix=os.path.basename(file_name) + "_compact",
+            dir=os.path.dirname(os.path.abspath(file_name)))
+        [compacted_add, compacted_sub, compact_counts] = compact(
+            add_file, sub_file, work_directory)
+        log.info("Compacted add RDF from", compact_counts['add_triples'],
+                 "to", compact_counts['add_compacted'], "triples.",
+                 compact_counts['cancelled'], "removed by the sub RDF")
+        log.info("Compacted sub RDF from", compact_counts['sub_triples'],
+                 "to", compact_counts['sub_compacted'], "triples")
+        for name, n in compact_counts.items():
+            metrics.count('compact_' + name, n)
+
+    metrics.write(file_name+"_metrics.json", run={'version': __version__,
+        'dsp_file_name': dsp_file_name, 'jobs': args.jobs, 'full': args.full,
+        'selected': len(selected), 'resumed': checkpoint is not None})
+    log.info("Metrics written to", file_name+"_metrics.json")
+
+    gk.remove_checkpoint(file_name)
+    if args.compact:
+        replace_files(add_file, compacted_add)
+        replace_files(sub_file, compacted_sub)
+        shutil.rmtree(work_directory)
+    return [run_started, saved]
+
+
+def landed_files(drop_directory, seen):
+    """
+    Return the names of the DSP files in the drop directory that have
+    landed -- their size and time unchanged since the last look, recorded in
+    seen -- and are not done.  A file is done when its metrics file is newer
+    than it and it has no checkpoint
+    """
+    landed = []
+    for dsp_file_name in glob.glob(os.path.join(drop_directory,
+                                                args.pattern)):
+        if dsp_file_name.endswith("_log.txt") or \
+                dsp_file_name.endswith("_exc.txt"):
+            continue
+        try:
+            status = os.stat(dsp_file_name)
+        except OSError:
+            continue
+        key = (status.st_size, status.st_mtime)
+        last_key = seen.get(dsp_file_name, None)
+        seen[dsp_file_name] = key
+        if key != last_key:
+            continue
+        file_name, file_extension = os.path.splitext(dsp_file_name)
+        metrics_file_name = file_name + "_metrics.json"
+        if os.path.exists(metrics_file_name) and \
+                os.path.getmtime(metrics_file_name) >= status.st_mtime and \
+                not os.path.exists(gk.progress_file_name(file_name)):
+            continue
+        landed.append([status.st_mtime, dsp_file_name])
+    return [dsp_file_name for mtime, dsp_file_name in sorted(landed)]
 
-    if ardf != "":
-        add_file.write(ardf)
-    if srdf != "":
-        sub_file.write(srdf)
 
-#   Done processing the Grants.  Wrap-up
+def watch(drop_directory):
+    """
+    Run as a daemon.  Load the lookup dictionaries once and ingest each DSP
+    file as it lands in the drop directory, oldest first.  Before each run
+    the dictionaries are refreshed with the changes harvested into VIVO
+    since the last, and with the dates, datetime intervals and grants
+    created by earlier runs and since found in VIVO.  Those created by a
+    run of the daemon are folded into its dictionaries at once, so that
+    the next run reuses them, but stay pending in the snapshot until they
+    are found in VIVO, since the RDF of the run may not have been loaded.
+    A run that fails leaves the dictionaries as they were, and its file is
+    not tried again until it changes
+    """
+    global log
+    daemon_log = IngestLog(os.path.join(drop_directory, DAEMON_LOG),
+                           mode='a', level=args.log_level,
+                           format=args.log_format)
+    log = daemon_log
+    log.info("Grant Ingest Version", __version__, "daemon watching",
+             drop_directory, "for", args.pattern)
+    connect_vivo()
+    run_started = datetime.now()
+    snapshot = gs.open_snapshot(args.snapshot)
+    [dictionaries, unsaved_reason] = load_lookups(snapshot, None, run_started)
+    snapshot.close()
+    warm = [dictionaries, run_started, unsaved_reason, no_folded()]
+    seen = {}
+    failed = {}
+    while True:
+        for dsp_file_name in landed_files(drop_directory, seen):
+            if failed.get(dsp_file_name, None) == seen[dsp_file_name]:
+                continue
+            daemon_log.info("Ingest", dsp_file_name)
+            try:
+                [run_started, created] = ingest(dsp_file_name, warm,
+                                                resume=True)
+            except Exception:
+                log = daemon_log
+                daemon_log.error("Ingest of", dsp_file_name, "failed\n" +
+                                 traceback.format_exc())
+                failed[dsp_file_name] = seen[dsp_file_name]
+                continue
+            log = daemon_log
+            warm[1] = run_started
+            if created is not None:
+                for name in created:
+                    warm[3][name].update(created[name])
+            daemon_log.info("Ingested", dsp_file_name, "VIVO grant dictionary "
+                            "has", len(dictionaries['grant']), "entries")
+        time.sleep(args.poll)
+
+
+def main():
+    global args, metrics
+    args = parse_args()
+
+    #   Stage times, counts and SPARQL calls are written to the metrics file
+    #   at the end of each run
+
+    metrics = Metrics()
+    if args.daemon:
+        watch(args.daemon)
+    else:
+        ingest(args.dsp_file_name, resume=args.resume)
 
-add_file.write(vt.rdf_footer())
-sub_file.write(vt.rdf_footer())
-print >>log_file, datetime.now(), "End Processing"
 
-add_file.close()
-sub_file.close()
-log_file.close()
-exc_file.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env/python
+
+"""
+    grant_lookup.py: Resolve only the DeptIDs, UFIDs and SponsorIDs used by
+    the DSP data, rather than loading every department, person and sponsor
+    in VIVO.
+
+    collect_dsp_keys reads the DSP file once for the distinct keys in its
+    DeptID, PI, CoPI, Inv and SponsorID columns.  resolve_keys finds the uris
+    of the keys in a few batched SPARQL queries.  The dictionaries made are
+    like those of make_deptid_dictionary, make_ufid_dictionary and
+    make_sponsor_dictionary, limited to the keys used.  Keys not in VIVO are
+    missing, and are reported as before when the DSP data is resolved.
+
+    KeyResolver resolves the keys of the DSP rows with the find functions of
+    vivofoundation and vivogrants, each a dictionary lookup.  Keys not
+    found are remembered with the pcns of the grants using them and reported
+    once each, with their grants, rather than once for each grant.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import tempita
+import vivofoundation as vt
+from dsp_reader import read_dsp_rows
+
+INVESTIGATOR_COLUMNS = ['PI', 'CoPI', 'Inv']
+
+#   Keys resolved in each query
+
+BATCH_SIZE = 250
+
+
+def collect_dsp_keys(file_name, subset=None):
+    """
+    Return a dictionary of the sets of distinct DeptIDs, UFIDs and
+    SponsorIDs in a DSP file, keyed by deptid, ufid and sponsor.  Given a
+    subset of pcns, only the rows of grants in the subset are used
+    """
+    keys = {'deptid': set(), 'ufid': set(), 'sponsor': set()}
+    for line_number, row in read_dsp_rows(file_name):
+        if row is None:
+            continue
+        if subset is not None and row['AwardID'] not in subset:
+            continue
+        keys['deptid'].add(row['DeptID'])
+        keys['sponsor'].add(row['SponsorID'])
+        for column in INVESTIGATOR_COLUMNS:
+            if row[column] != '' and row[column] is not None:
+                keys['ufid'].update(row[column].split(','))
+    return keys
+
+
+def sparql_literal(value):
+    """
+    Return a value as a SPARQL string literal
+    """
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def resolve_keys(key_property, keys, batch_size=BATCH_SIZE, debug=False):
+    """
+    Return a dictionary of key to uri for the entities having key_property
+    with one of the given keys.  One query is made for each batch of
+    batch_size keys
+    """
+    query = tempita.Template("""
+    SELECT ?x ?key WHERE
+    {
+    ?x {{key_property}} ?key .
+    FILTER (str(?key) IN ({{keys}}))
+    }""")
+    keys = sorted(keys)
+    dictionary = {}
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        result = vt.vivo_sparql_query(query.substitute(
+            key_property=key_property,
+            keys=', '.join([sparql_literal(key) for key in batch])),
+            debug=debug)
+        try:
+            bindings = result["results"]["bindings"]
+        except KeyError:
+            bindings = []
+        for b in bindings:
+            dictionary[b['key']['value']] = b['x']['value']
+    return dictionary
+
+
+class KeyResolver(object):
+    """
+    Resolve keys of each kind -- DeptID, Sponsor and UFID -- to VIVO uris,
+    with finders {kind: [find function, dictionary]}.  Keys not found are
+    recorded for the report
+    """
+
+    def __init__(self, finders):
+        self.finders = finders
+        self.missing = {}
+
+    def resolve(self, kind, key, pcn, role=None):
+        """
+        Return [found, uri] for a key of a kind used by the grant pcn.  A key
+        not found is recorded with the pcn, and the role in which the grant
+        uses it, if given
+        """
+        [find, dictionary] = self.finders[kind]
+        result = find(key, dictionary)
+        if not result[0]:
+            self.missing.setdefault((kind, key), []).append([pcn, role])
+        return result
+
+    def missing_counts(self):
+        """
+        Return a dictionary of the number of distinct keys of each kind not
+        found
+        """
+        counts = dict([(kind, 0) for kind in self.finders])
+        for kind, key in self.missing:
+            counts[kind] = counts[kind] + 1
+        return counts
+
+    def report(self):
+        """
+        Return the lines of the report of the keys not found, one for each
+        key, with the number of grants using it and their pcns
+        """
+        lines = []
+        for kind, key in sorted(self.missing):
+            uses = self.missing[(kind, key)]
+            grants = ", ".join([pcn if role is None else pcn + " (" + role +
+                                ")" for pcn, role in uses])
+            count = len(set([pcn for pcn, role in uses]))
+            noun = " grant: " if count == 1 else " grants: "
+            lines.append(kind + " " + key + " not found in VIVO.  " +
+                         str(count) + noun + grants + "\n")
+        return lines
@@ -0,0 +1,183 @@
+#!/usr/bin/env/python
+
+"""
+    grant_prefetch.py: Fetch the VIVO state of many grants in a few batched
+    SPARQL queries.  Grants are updated against the prefetched state by
+    grant_diff.
+
+    The state of a grant is a dictionary with one entry per grant attribute
+    handled by the ingest (title, amounts, award ids, harvest data, sponsor,
+    administering department and datetime interval) and one entry per role
+    type (pi_roles, coi_roles, inv_roles).  Each attribute entry is the list
+    of its values in VIVO, empty if it has none, as VIVO may hold several
+    labels or sponsors of a grant.  Data property values are SPARQL result
+    bindings, as returned by get_grant, so they carry xml:lang and datatype.
+    Each role entry maps person uri to the list of the person's roles of
+    that type in the grant, most often one.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import tempita
+import vivofoundation as vt
+
+VIVO = "http://vivoweb.org/ontology/core#"
+UFV = "http://vivo.ufl.edu/ontology/vivo-ufl/"
+RDFS = "http://www.w3.org/2000/01/rdf-schema#"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+
+#   Grant attributes by name in the DSP dictionary, and the VIVO predicates
+#   that hold them
+
+GRANT_DATA_PROPERTIES = [
+    ['title', 'rdfs:label', RDFS + 'label'],
+    ['total_award_amount', 'vivo:totalAwardAmount', VIVO + 'totalAwardAmount'],
+    ['grant_direct_costs', 'vivo:grantDirectCosts', VIVO + 'grantDirectCosts'],
+    ['sponsor_award_id', 'vivo:sponsorAwardId', VIVO + 'sponsorAwardId'],
+    ['local_award_id', 'vivo:localAwardId', VIVO + 'localAwardId'],
+    ['harvested_by', 'ufVivo:harvestedBy', UFV + 'harvestedBy'],
+    ['date_harvested', 'ufVivo:dateHarvested', UFV + 'dateHarvested']
+    ]
+
+GRANT_RESOURCE_PROPERTIES = [
+    ['sponsor_uri', 'vivo:grantAwardedBy', VIVO + 'grantAwardedBy'],
+    ['administered_by_uri', 'vivo:administeredBy', VIVO + 'administeredBy'],
+    ['dti_uri', 'vivo:dateTimeInterval', VIVO + 'dateTimeInterval']
+    ]
+
+#   Role types.  For each, the DSP dictionary list of person uris, the state
+#   entry, the role class, the role-to-person and person-to-role predicates
+
+GRANT_ROLES = [
+    ['pi_uris', 'pi_roles', 'vivo:PrincipalInvestigatorRole',
+     'vivo:principalInvestigatorRoleOf', 'vivo:hasPrincipalInvestigatorRole',
+     VIVO + 'principalInvestigatorRoleOf'],
+    ['coi_uris', 'coi_roles', 'vivo:CoPrincipalInvestigatorRole',
+     'vivo:co-PrincipalInvestigatorRoleOf',
+     'vivo:hasCo-PrincipalInvestigatorRole',
+     VIVO + 'co-PrincipalInvestigatorRoleOf'],
+    ['inv_uris', 'inv_roles', 'vivo:InvestigatorRole',
+     'vivo:investigatorRoleOf', 'vivo:hasInvestigatorRole',
+     VIVO + 'investigatorRoleOf']
+    ]
+
+PREFIXES = {
+    'vivo:': VIVO,
+    'ufVivo:': UFV,
+    'rdfs:': RDFS,
+    'rdf:': RDF
+    }
+
+
+def expand_prefix(name):
+    """
+    Given a prefixed name such as vivo:InvestigatorRole, return the full uri
+    """
+    for prefix, namespace in PREFIXES.items():
+        if name.startswith(prefix):
+            return namespace + name[len(prefix):]
+    return name
+
+
+def compact_uri(uri):
+    """
+    Given a full uri such as http://vivoweb.org/ontology/core#InvestigatorRole,
+    return the prefixed name used in RDF/XML element names
+    """
+    for prefix, namespace in PREFIXES.items():
+        if uri.startswith(namespace):
+            return prefix + uri[len(namespace):]
+    return uri
+
+
+def query_bindings(query, debug=False):
+    """
+    Run a SPARQL query against VIVO.  Return the list of result bindings
+    """
+    result = vt.vivo_sparql_query(query, debug=debug)
+    try:
+        return result["results"]["bindings"]
+    except KeyError:
+        return []
+
+
+def empty_grant_state():
+    """
+    Return the state of a grant with no attribute values and no roles
+    """
+    vivo_grant = {}
+    for name, predicate, predicate_uri in GRANT_DATA_PROPERTIES + \
+        GRANT_RESOURCE_PROPERTIES:
+        vivo_grant[name] = []
+    for uri_type, role_type, role_class, role_of, has_role, role_of_uri \
+        in GRANT_ROLES:
+        vivo_grant[role_type] = {}
+    vivo_grant['role_triples'] = {}
+    return vivo_grant
+
+
+def prefetch_grants(grant_uris, batch_size=250, debug=False):
+    """
+    Given a list of grant uris, return a dictionary of grant state keyed by
+    grant uri.  Two queries are made for each batch of batch_size grants --
+    one for the grant attributes and one for the roles of the grants
+    """
+    property_names = {}
+    for name, predicate, predicate_uri in GRANT_DATA_PROPERTIES + \
+        GRANT_RESOURCE_PROPERTIES:
+        property_names[predicate_uri] = name
+    role_names = {}
+    for uri_type, role_type, role_class, role_of, has_role, role_of_uri \
+        in GRANT_ROLES:
+        role_names[role_of_uri] = role_type
+
+    attribute_query = tempita.Template("""
+    SELECT ?grant ?p ?o WHERE
+    {
+    ?grant ?p ?o .
+    FILTER (?grant IN ({{grants}}))
+    FILTER (?p IN ({{predicates}}))
+    }""")
+    role_query = tempita.Template("""
+    SELECT ?grant ?role ?p ?o WHERE
+    {
+    ?grant vivo:relatedRole ?role .
+    ?role ?p ?o .
+    FILTER (?grant IN ({{grants}}))
+    }""")
+    predicates = ', '.join([predicate for name, predicate, predicate_uri in
+                            GRANT_DATA_PROPERTIES + GRANT_RESOURCE_PROPERTIES])
+
+    vivo_grants = {}
+    for grant_uri in grant_uris:
+        vivo_grants[grant_uri] = empty_grant_state()
+
+    for start in range(0, len(grant_uris), batch_size):
+        batch = grant_uris[start:start + batch_size]
+        grants = ', '.join(['<' + uri + '>' for uri in batch])
+
+        query = attribute_query.substitute(grants=grants,
+                                           predicates=predicates)
+        for b in query_bindings(query, debug=debug):
+            name = property_names[b['p']['value']]
+            vivo_grant = vivo_grants[b['grant']['value']]
+            if b['o']['type'] == 'uri':
+                vivo_grant[name].append(b['o']['value'])
+            else:
+                vivo_grant[name].append(b['o'])
+
+        query = role_query.substitute(grants=grants)
+        for b in query_bindings(query, debug=debug):
+            vivo_grant = vivo_grants[b['grant']['value']]
+            role_uri = b['role']['value']
+            vivo_grant['role_triples'].setdefault(role_uri, []).append(
+                [b['p']['value'], b['o']])
+            if b['p']['value'] in role_names:
+                role_type = role_names[b['p']['value']]
+                vivo_grant[role_type].setdefault(b['o']['value'],
+                                                 []).append(role_uri)
+    return vivo_grants
+
@@ -0,0 +1,371 @@
+#!/usr/bin/env/python
+
+"""
+    grant_rdf.py: RDF/XML for lists of triples, such as the add and sub
+    triples of a grant update, from format strings made once.
+
+    The format strings are made when the module is loaded, by calling
+    vivofoundation's assert_data_property and assert_resource_property with
+    marks in place of the subject, predicate and value, and putting format
+    fields where the marks come out.  A triple is then rendered in one
+    formatting rather than one call, with the RDF those functions write,
+    whatever it is.  Values are escaped if assert_data_property escapes
+    them.  If the marks do not come through as expected, triples are
+    rendered by calling the functions.
+
+    A literal read from VIVO keeps its datatype or xml:lang, so that the
+    triple retracting it is the triple VIVO holds.  Its format is made by
+    giving assert_data_property the value as a dictionary, as in SPARQL
+    results, with a mark for the datatype or language.  If that does not
+    come through, the literal is rendered without them.
+
+    New grants are rendered from format strings made the same way, from
+    the RDF vivogrants.add_grant writes for a grant of marks, with
+    get_vivo_uri giving marks for the grant and role uris.  There is a
+    format for each role type, the RDF one role adds to the end of a
+    grant, and a format for each set of grant values present, absent, None
+    or empty, made when a grant first has that set.  add_grant is taken to
+    treat values alike but for None and empty.  Each format is checked to
+    render what add_grant writes -- when the module is loaded, for a grant
+    with every value, a role of each type and values XML may escape, and
+    when it is made, for the grant it is made for -- and add_grant is used
+    where a format does not.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from xml.sax.saxutils import escape
+import vivofoundation as vt
+import vivogrants
+from grant_record import GRANT_FIELDS
+from grant_record import SHARED_FIELDS
+
+#   Marks passed to the assert functions in place of subject, predicate and
+#   value, and a value with the characters XML may escape
+
+MARKS = {'subject': u"http://example.org/grant-rdf-subject-mark",
+         'predicate': u"grant-rdf-predicate-mark",
+         'value': u"grant-rdf-value-mark",
+         'datatype': u"http://example.org/grant-rdf-datatype-mark",
+         'lang': u"grant-rdf-lang-mark"}
+ESCAPED = u"<&>\"'"
+
+
+def make_format(function, value, names=['value']):
+    """
+    Return a format string with %(subject)s, %(predicate)s and a field for
+    each of names in place of the marks in the RDF function makes of a
+    triple, or None if a mark does not come through
+    """
+    names = ['subject', 'predicate'] + names
+    try:
+        rdf = function(MARKS['subject'], MARKS['predicate'], value)
+    except Exception:
+        return None
+    if any([MARKS[name] not in rdf for name in names]):
+        return None
+    rdf = rdf.replace(u"%", u"%%")
+    for name in names:
+        rdf = rdf.replace(MARKS[name], u"%(" + name + u")s")
+    return rdf
+
+
+def value_escaping():
+    """
+    Return True if assert_data_property escapes values, False if it writes
+    them as they are, or None if it does something else
+    """
+    rdf = vt.assert_data_property(MARKS['subject'], MARKS['predicate'],
+                                  ESCAPED)
+    if escape(ESCAPED) in rdf:
+        return True
+    if ESCAPED in rdf:
+        return False
+    return None
+
+DATA_TRIPLE = make_format(vt.assert_data_property, MARKS['value'])
+RESOURCE_TRIPLE = make_format(vt.assert_resource_property, MARKS['value'])
+DATATYPE_TRIPLE = make_format(vt.assert_data_property,
+                              {'value': MARKS['value'],
+                               'datatype': MARKS['datatype']},
+                              ['value', 'datatype'])
+LANG_TRIPLE = make_format(vt.assert_data_property,
+                          {'value': MARKS['value'], 'xml:lang': MARKS['lang']},
+                          ['value', 'lang'])
+ESCAPE_VALUES = value_escaping()
+FORMATTED = DATA_TRIPLE is not None and RESOURCE_TRIPLE is not None and \
+    ESCAPE_VALUES is not None
+
+
+def literal_form_rdf(subject, predicate, value, datatype, lang):
+    """
+    Return RDF/XML for a literal triple with a datatype or a language, or
+    without them if there is no format for them
+    """
+    if datatype is not None:
+        form = DATATYPE_TRIPLE
+    else:
+        form = LANG_TRIPLE
+    if not FORMATTED or form is None:
+        return triple_rdf(subject, predicate, value, True)
+    if ESCAPE_VALUES:
+        value = escape(value)
+    return form % {'subject': subject, 'predicate': predicate, 'value': value,
+                   'datatype': datatype, 'lang': lang}
+
+
+def triple_rdf(subject, predicate, value, literal, datatype=None,
+               lang=None):
+    """
+    Return RDF/XML for one triple, predicate as a prefixed name.  A literal
+    may have a datatype uri or a language
+    """
+    if literal and (datatype is not None or lang is not None):
+        return literal_form_rdf(subject, predicate, value, datatype, lang)
+    if not FORMATTED:
+        if literal:
+            return vt.assert_data_property(subject, predicate, value)
+        return vt.assert_resource_property(subject, predicate, value)
+    if literal:
+        if ESCAPE_VALUES:
+            value = escape(value)
+        return DATA_TRIPLE % {'subject': subject, 'predicate': predicate,
+                              'value': value}
+    return RESOURCE_TRIPLE % {'subject': subject, 'predicate': predicate,
+                              'value': value}
+
+
+def triples_rdf(triples):
+    """
+    Return RDF/XML for a list of triples (subject, predicate, value,
+    literal, datatype, lang), predicates as prefixed names
+    """
+    return u"".join([triple_rdf(*triple) for triple in triples])
+
+
+#   The DSP values of a grant in the format for its grant, and the lists of
+#   people given each role type.  Values of fields named _uri are uris.
+#   The others are literals, escaped as assert_data_property escapes them
+
+ROLE_FIELDS = ['pi_uris', 'coi_uris', 'inv_uris']
+VALUE_FIELDS = [name for name in GRANT_FIELDS + SHARED_FIELDS
+                if name not in ROLE_FIELDS]
+LITERAL_FIELDS = [name for name in VALUE_FIELDS if not name.endswith('_uri')]
+VALUE_MARKS = dict([(name, u"http://example.org/grant-rdf-" + name + u"-mark")
+                    for name in VALUE_FIELDS])
+URI_MARKS = {'grant': u"http://example.org/grant-rdf-grant-mark",
+             'role': u"http://example.org/grant-rdf-role-mark",
+             'person': u"http://example.org/grant-rdf-person-mark"}
+ABSENT = 'absent'
+PRESENT = 'present'
+
+
+def minting(get_uri, call):
+    """
+    Return what call returns when called with get_vivo_uri replaced by
+    get_uri in vivofoundation and vivogrants
+    """
+    modules = [module for module in [vt, vivogrants]
+               if hasattr(module, 'get_vivo_uri')]
+    saved = [module.get_vivo_uri for module in modules]
+    for module in modules:
+        module.get_vivo_uri = get_uri
+    try:
+        return call()
+    finally:
+        for module, get_vivo_uri in zip(modules, saved):
+            module.get_vivo_uri = get_vivo_uri
+
+
+def add_grant_rdf(grant_data, uris):
+    """
+    Return the RDF vivogrants.add_grant writes for grant_data with uris
+    minted in order from uris, or None if it fails
+    """
+    uris = list(uris)
+    try:
+        return minting(lambda: uris.pop(0),
+                       lambda: vivogrants.add_grant(grant_data)[0])
+    except Exception:
+        return None
+
+
+def marked_format(rdf, marks):
+    """
+    Return rdf with a format field in place of each of the marks, a
+    dictionary of field name to mark, or None if there is no rdf
+    """
+    if rdf is None:
+        return None
+    rdf = rdf.replace(u"%", u"%%")
+    for name in sorted(marks, key=lambda name: -len(marks[name])):
+        rdf = rdf.replace(marks[name], u"%(" + name + u")s")
+    return rdf
+
+
+def value_kinds(grant_data):
+    """
+    Return the kind of each value of a grant -- ABSENT, None, empty or
+    PRESENT -- as a tuple in the order of VALUE_FIELDS
+    """
+    kinds = []
+    for name in VALUE_FIELDS:
+        value = grant_data.get(name, ABSENT)
+        if value is ABSENT or value is None or value == u"":
+            kinds.append(value)
+        else:
+            kinds.append(PRESENT)
+    return tuple(kinds)
+
+
+def marked_grant(kinds):
+    """
+    Return a grant of marks with values of the given kinds, and no roles
+    """
+    grant_data = dict([(name, []) for name in ROLE_FIELDS])
+    for name, kind in zip(VALUE_FIELDS, kinds):
+        if kind is PRESENT:
+            grant_data[name] = VALUE_MARKS[name]
+        elif kind is not ABSENT:
+            grant_data[name] = kind
+    return grant_data
+
+
+def make_grant_format(kinds):
+    """
+    Return the format of the RDF add_grant writes for a grant with values
+    of the given kinds and no roles, or None if add_grant fails
+    """
+    marks = dict(VALUE_MARKS)
+    marks['grant'] = URI_MARKS['grant']
+    return marked_format(add_grant_rdf(marked_grant(kinds),
+                                       [URI_MARKS['grant']]), marks)
+
+
+def make_role_formats():
+    """
+    Return the format of the RDF one role of each type adds to the end of
+    the RDF of a grant, or None if a role does not add to the end
+    """
+    grant_data = marked_grant((PRESENT,) * len(VALUE_FIELDS))
+    rdf = add_grant_rdf(grant_data, [URI_MARKS['grant']])
+    if rdf is None:
+        return None
+    role_formats = {}
+    for name in ROLE_FIELDS:
+        grant_data[name] = [URI_MARKS['person']]
+        role_rdf = add_grant_rdf(grant_data,
+                                 [URI_MARKS['grant'], URI_MARKS['role']])
+        grant_data[name] = []
+        if role_rdf is None or not role_rdf.startswith(rdf):
+            return None
+        role_formats[name] = marked_format(role_rdf[len(rdf):], URI_MARKS)
+    return role_formats
+
+
+def render_grant(grant_format, grant_data, get_uri):
+    """
+    Return [rdf, grant_uri] for a new grant from the format of its grant
+    and the role formats, minting uris with get_uri as add_grant does
+    """
+    grant_uri = get_uri()
+    values = {'grant': grant_uri}
+    for name in VALUE_FIELDS:
+        value = grant_data.get(name, None)
+        if ESCAPE_VALUES and name in LITERAL_FIELDS and \
+                isinstance(value, basestring):
+            value = escape(value)
+        values[name] = value
+    rdf = [grant_format % values]
+    for name in ROLE_FIELDS:
+        for person_uri in grant_data.get(name, []):
+            rdf.append(ROLE_FORMATS[name] % {'grant': grant_uri,
+                                             'role': get_uri(),
+                                             'person': person_uri})
+    return [u"".join(rdf), grant_uri]
+
+
+def first_grant_rdf(grant_data, kinds):
+    """
+    Return [rdf, grant_uri] from add_grant for the first grant with values
+    of the given kinds, and keep the format for them if it renders the
+    same RDF with the same uris, or None if it does not
+    """
+    uris = []
+
+    def minted_uri(get_uri=vt.get_vivo_uri):
+        uri = get_uri()
+        uris.append(uri)
+        return uri
+    [rdf, grant_uri] = minting(minted_uri,
+                               lambda: vivogrants.add_grant(grant_data))
+    grant_format = make_grant_format(kinds)
+    if grant_format is not None:
+        found = render_grant(grant_format, grant_data,
+                             lambda: uris.pop(0))[0]
+        if found != rdf:
+            grant_format = None
+    GRANT_FORMATS[kinds] = grant_format
+    return [rdf, grant_uri]
+
+
+def new_grant_rdf(grant_data):
+    """
+    Return [rdf, grant_uri] for a new grant and its roles, as
+    vivogrants.add_grant does
+    """
+    if ROLE_FORMATS is None or not FORMATTED:
+        return vivogrants.add_grant(grant_data)
+    kinds = value_kinds(grant_data)
+    if kinds not in GRANT_FORMATS:
+        return first_grant_rdf(grant_data, kinds)
+    grant_format = GRANT_FORMATS[kinds]
+    if grant_format is None:
+        return vivogrants.add_grant(grant_data)
+    return render_grant(grant_format, grant_data, vt.get_vivo_uri)
+
+
+def sample_grant():
+    """
+    Return a grant with every value, values XML may escape, two PIs and a
+    role of each other type
+    """
+    grant_data = {}
+    for name in VALUE_FIELDS:
+        if name in LITERAL_FIELDS:
+            grant_data[name] = name + u" %s " + ESCAPED
+        else:
+            grant_data[name] = u"http://example.org/grant-rdf-sample/" + name
+    for name in ROLE_FIELDS:
+        grant_data[name] = [u"http://example.org/grant-rdf-sample/" + name]
+    grant_data['pi_uris'].append(u"http://example.org/grant-rdf-sample/pi2")
+    return grant_data
+
+
+def check_formats():
+    """
+    Return True if the formats render the RDF add_grant writes for the
+    sample grant, with the same uris.  The format for its values is kept
+    if they do
+    """
+    grant_data = sample_grant()
+    uris = [u"http://example.org/grant-rdf-sample/uri" + str(i)
+            for i in range(6)]
+    kinds = value_kinds(grant_data)
+    grant_format = make_grant_format(kinds)
+    expected = add_grant_rdf(grant_data, uris)
+    if grant_format is None or expected is None:
+        return False
+    found = render_grant(grant_format, grant_data, lambda: uris.pop(0))[0]
+    if found != expected:
+        return False
+    GRANT_FORMATS[kinds] = grant_format
+    return True
+
+GRANT_FORMATS = {}
+ROLE_FORMATS = make_role_formats()
+if ROLE_FORMATS is not None and not (FORMATTED and check_formats()):
+    ROLE_FORMATS = None
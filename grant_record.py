@@ -0,0 +1,99 @@
+#!/usr/bin/env/python
+
+"""
+    grant_record.py: A compact record of the DSP data for one grant, as kept
+    in the DSP dictionary and passed to add_grant and diff_grant.
+
+    A GrantRecord holds only the values used to add or update a grant in
+    slots rather than in a dictionary.  The raw DSP columns are not kept.
+    local_award_id is the pcn, and harvested_by and date_harvested are the
+    same for every grant in a run, so they are kept once, on the class.
+
+    Records are read like the row dictionaries they replace --
+    record['title'], record.get('sponsor_uri', None), 'dti_uri' in record.
+    A value that was never set is missing, as a key missing from a
+    dictionary would be.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+GRANT_FIELDS = ['pcn', 'title', 'total_award_amount', 'grant_direct_costs',
+                'sponsor_award_id', 'sponsor_uri', 'administered_by_uri',
+                'dti_uri', 'pi_uris', 'coi_uris', 'inv_uris', 'fingerprint']
+
+SHARED_FIELDS = ['local_award_id', 'harvested_by', 'date_harvested']
+
+
+class GrantRecord(object):
+    """
+    The DSP data for one grant
+    """
+    __slots__ = GRANT_FIELDS
+
+    harvested_by = None
+    date_harvested = None
+
+    @property
+    def local_award_id(self):
+        return self.pcn
+
+    def __getitem__(self, name):
+        if name not in GRANT_FIELDS and name not in SHARED_FIELDS:
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [name for name in GRANT_FIELDS + SHARED_FIELDS if name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        for name in GRANT_FIELDS:
+            if name in state:
+                setattr(self, name, state[name])
+
+
+def set_harvest(harvested_by, date_harvested):
+    """
+    Set the harvested_by and date_harvested of every grant in this run
+    """
+    GrantRecord.harvested_by = harvested_by
+    GrantRecord.date_harvested = date_harvested
+
+
+def make_grant_record(row):
+    """
+    Return a GrantRecord with the values of a row dictionary of DSP data.
+    Empty investigator lists are shared
+    """
+    record = GrantRecord()
+    for name in GRANT_FIELDS:
+        if name in row:
+            value = row[name]
+            if isinstance(value, list):
+                value = tuple(value)
+            setattr(record, name, value)
+    return record
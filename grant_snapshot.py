@@ -0,0 +1,379 @@
+#!/usr/bin/env/python
+
+"""
+    grant_snapshot.py: Keep the VIVO lookup dictionaries used by grant ingest
+    in a versioned SQLite snapshot so that each run can load them in seconds
+    rather than rebuilding them from SPARQL.
+
+    A snapshot holds six dictionaries -- deptid, ufid, sponsor, date,
+    datetime_interval and grant.  Each is stored as key/uri pairs.
+
+    Refresh is incremental.  Entities with ufVivo:dateHarvested on or after
+    the last refresh are re-queried and folded into the snapshot.  Entities
+    deleted from VIVO are not seen by a refresh, only by a rebuild.  A full
+    rebuild is done when the snapshot is missing, has a different version,
+    is older than its maximum age, or is requested on the command line.
+
+    The dates, datetime intervals and grants minted by a run are not in VIVO
+    until its RDF is loaded, which may be later or never.  They are kept
+    apart as pending, with the harvest date of the run, and are folded into
+    the dictionaries only when they are found in VIVO -- a grant by its pcn
+    and the harvest date of the run, a date or interval by its uri and
+    value.  Pending entries never found are dropped when they are older than
+    the maximum age of the snapshot.
+
+    The snapshot also holds a fingerprint of the DSP data for each pcn as of
+    the last run that processed it whose RDF is in VIVO.  The fingerprints
+    of a run are pending until its grant is found in VIVO with the harvest
+    date of the run, so the rows of a run never loaded are processed again.
+    Fingerprints are kept apart from the dictionaries and survive rebuilds.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import sqlite3
+import tempita
+import vivofoundation as vt
+from sparql_client import run_concurrently
+
+SNAPSHOT_VERSION = 3
+
+DICTIONARY_NAMES = ['deptid', 'ufid', 'sponsor', 'date', 'datetime_interval',
+                    'grant']
+
+#   Data properties identifying the harvested entities in each dictionary.
+#   Dates and datetime intervals carry no harvest date.  They are refreshed
+#   by folding in the ones the ingest creates, once they are found in VIVO.
+
+HARVESTED_KEYS = {
+    'deptid': 'ufVivo:deptID',
+    'ufid': 'ufVivo:ufid',
+    'sponsor': 'ufVivo:sponsorID',
+    'grant': 'ufVivo:psContractNumber'
+    }
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def encode_key(name, key):
+    """
+    Return the string form of a dictionary key for storage.  Date
+    dictionary keys are datetimes.  Datetime interval keys are tuples of
+    start and end uri, either of which may be None.  They are stored with a
+    space, which is not found in uris, between start and end.  All others
+    are strings
+    """
+    if name == 'date':
+        return key.strftime(DATE_FORMAT)
+    if name == 'datetime_interval':
+        return (key[0] or '') + ' ' + (key[1] or '')
+    return key
+
+
+def decode_key(name, key):
+    """
+    Return the dictionary key for a stored string.  Inverse of encode_key
+    """
+    if name == 'date':
+        return datetime.strptime(key, DATE_FORMAT)
+    if name == 'datetime_interval':
+        [start, end] = key.split(' ')
+        return (start or None, end or None)
+    return key
+
+
+def open_snapshot(file_name):
+    """
+    Open the snapshot database, creating its tables if needed.  Return a
+    connection
+    """
+    snapshot = sqlite3.connect(file_name)
+    snapshot.execute("""CREATE TABLE IF NOT EXISTS snapshot (
+        name TEXT PRIMARY KEY, version INTEGER, refreshed TEXT)""")
+    snapshot.execute("""CREATE TABLE IF NOT EXISTS entry (
+        name TEXT, key TEXT, uri TEXT, PRIMARY KEY (name, key))""")
+    snapshot.execute("""CREATE TABLE IF NOT EXISTS fingerprint (
+        pcn TEXT PRIMARY KEY, fingerprint TEXT)""")
+    snapshot.execute("""CREATE TABLE IF NOT EXISTS pending (
+        harvested TEXT, name TEXT, key TEXT, uri TEXT,
+        PRIMARY KEY (harvested, name, key))""")
+    snapshot.execute("""CREATE TABLE IF NOT EXISTS pending_fingerprint (
+        harvested TEXT, pcn TEXT, fingerprint TEXT,
+        PRIMARY KEY (harvested, pcn))""")
+    snapshot.commit()
+    return snapshot
+
+
+def snapshot_refreshed(snapshot):
+    """
+    Return the datetime of the last refresh of the snapshot, or None if the
+    snapshot is incomplete or was written by a different SNAPSHOT_VERSION.
+    The oldest refresh of any dictionary is the refresh of the snapshot
+    """
+    rows = snapshot.execute("SELECT name, version, refreshed FROM snapshot")\
+        .fetchall()
+    found = dict([(name, (version, refreshed)) for name, version, refreshed
+                  in rows])
+    refreshed = None
+    for name in DICTIONARY_NAMES:
+        if name not in found or found[name][0] != SNAPSHOT_VERSION:
+            return None
+        when = datetime.strptime(found[name][1], DATE_FORMAT)
+        if refreshed is None or when < refreshed:
+            refreshed = when
+    return refreshed
+
+
+def load_snapshot(snapshot):
+    """
+    Return a dictionary of the VIVO lookup dictionaries held in the snapshot,
+    keyed by dictionary name
+    """
+    dictionaries = {}
+    for name in DICTIONARY_NAMES:
+        dictionaries[name] = {}
+    for name, key, uri in snapshot.execute("SELECT name, key, uri FROM entry"):
+        if name in dictionaries:
+            dictionaries[name][decode_key(name, key)] = uri
+    return dictionaries
+
+
+def save_snapshot(snapshot, dictionaries, refreshed):
+    """
+    Replace the contents of the snapshot with the given dictionaries, marking
+    each as refreshed at the given datetime
+    """
+    stamp = refreshed.strftime(DATE_FORMAT)
+    with snapshot:
+        snapshot.execute("DELETE FROM entry")
+        snapshot.execute("DELETE FROM snapshot")
+        for name in DICTIONARY_NAMES:
+            dictionary = dictionaries[name]
+            snapshot.executemany(
+                "INSERT INTO entry (name, key, uri) VALUES (?, ?, ?)",
+                ((name, encode_key(name, key), uri) for key, uri in
+                 dictionary.iteritems()))
+            snapshot.execute("INSERT INTO snapshot (name, version, refreshed) "
+                             "VALUES (?, ?, ?)", (name, SNAPSHOT_VERSION,
+                                                  stamp))
+
+
+def load_fingerprints(snapshot):
+    """
+    Return a dictionary of DSP data fingerprints keyed by pcn
+    """
+    return dict(snapshot.execute("SELECT pcn, fingerprint FROM fingerprint")
+                .fetchall())
+
+
+def save_pending_fingerprints(snapshot, harvested, fingerprints):
+    """
+    Record the fingerprints of the rows processed by the run with the
+    harvest date harvested, a dictionary keyed by pcn, as pending
+    """
+    with snapshot:
+        snapshot.executemany(
+            "INSERT OR REPLACE INTO pending_fingerprint (harvested, pcn, "
+            "fingerprint) VALUES (?, ?, ?)",
+            ((harvested, pcn, fingerprint) for pcn, fingerprint in
+             fingerprints.iteritems()))
+
+
+def make_changed_dictionary(key_property, since, debug=False):
+    """
+    Return a dictionary of key to uri for the entities having the key_property
+    that were harvested on or after the day of the datetime since.  Harvest
+    dates are written both with a space and with a T between date and time,
+    so only the date is compared
+    """
+    query = tempita.Template("""
+    SELECT ?x ?key WHERE
+    {
+    ?x {{key_property}} ?key .
+    ?x ufVivo:dateHarvested ?harvested .
+    FILTER (str(?harvested) >= "{{since}}")
+    }""")
+    query = query.substitute(key_property=key_property,
+                             since=since.date().isoformat())
+    result = vt.vivo_sparql_query(query, debug=debug)
+    changed = {}
+    try:
+        bindings = result["results"]["bindings"]
+    except KeyError:
+        bindings = []
+    for b in bindings:
+        changed[b['key']['value']] = b['x']['value']
+    return changed
+
+
+def refresh_snapshot(dictionaries, since, workers=1, debug=False):
+    """
+    Fold the entities harvested into VIVO since the last refresh into the
+    dictionaries.  The queries for the changes are made in up to workers
+    threads.  Return a dictionary of the number of entries refreshed in each
+    dictionary
+    """
+    names = [name for name in DICTIONARY_NAMES if name in HARVESTED_KEYS]
+    changes = run_concurrently([[make_changed_dictionary,
+                                 [HARVESTED_KEYS[name], since],
+                                 {'debug': debug}] for name in names],
+                               workers)
+    counts = dict([(name, 0) for name in DICTIONARY_NAMES])
+    for name, changed in zip(names, changes):
+        dictionaries[name].update(changed)
+        counts[name] = len(changed)
+    return counts
+
+
+def save_pending(snapshot, harvested, created):
+    """
+    Record the entries created by the run with the harvest date harvested,
+    a dictionary of dictionaries keyed by dictionary name, as pending
+    """
+    with snapshot:
+        for name, dictionary in created.items():
+            snapshot.executemany(
+                "INSERT OR REPLACE INTO pending (harvested, name, key, uri) "
+                "VALUES (?, ?, ?, ?)",
+                ((harvested, name, encode_key(name, key), uri) for key, uri
+                 in dictionary.iteritems()))
+
+
+def pending_keys(snapshot, name):
+    """
+    Return the set of keys of the named dictionary pending in the snapshot
+    """
+    return set([decode_key(name, key) for [key] in snapshot.execute(
+        "SELECT key FROM pending WHERE name = ?", (name,))])
+
+
+def query_bindings(query, debug=False):
+    result = vt.vivo_sparql_query(query, debug=debug)
+    try:
+        return result["results"]["bindings"]
+    except KeyError:
+        return []
+
+
+def find_harvested_grants(harvests, batch_size=250, debug=False):
+    """
+    Return a dictionary of grant uri keyed by [harvest date, pcn] for the
+    grants in VIVO whose harvest date is one of harvests
+    """
+    query = tempita.Template("""
+    SELECT ?x ?pcn ?harvested WHERE
+    {
+    ?x ufVivo:psContractNumber ?pcn .
+    ?x ufVivo:dateHarvested ?harvested .
+    FILTER (str(?harvested) IN ({{harvests}}))
+    }""")
+    found = {}
+    for start in range(0, len(harvests), batch_size):
+        batch = harvests[start:start + batch_size]
+        for b in query_bindings(query.substitute(harvests=", ".join(
+                ['"' + harvested + '"' for harvested in batch])),
+                debug=debug):
+            found[(b['harvested']['value'], b['pcn']['value'])] = \
+                b['x']['value']
+    return found
+
+
+def find_values(predicate, uris, batch_size=250, debug=False):
+    """
+    Return a dictionary of the value of the predicate keyed by uri, for the
+    uris that have the predicate in VIVO
+    """
+    query = tempita.Template("""
+    SELECT ?x ?value WHERE
+    {
+    ?x {{predicate}} ?value .
+    FILTER (?x IN ({{uris}}))
+    }""")
+    found = {}
+    for start in range(0, len(uris), batch_size):
+        batch = uris[start:start + batch_size]
+        for b in query_bindings(query.substitute(predicate=predicate,
+                uris=", ".join(['<' + uri + '>' for uri in batch])),
+                debug=debug):
+            found[b['x']['value']] = b['value']['value']
+    return found
+
+
+def find_keys(name, uris, debug=False):
+    """
+    Return a dictionary of the key in VIVO of each of the uris of the date
+    or datetime_interval dictionary, keyed by uri.  A uri not in VIVO has
+    no key.  Uris are compared by key as well, since a uri minted by a run
+    whose RDF was not loaded may be minted again for another entity
+    """
+    if name == 'date':
+        return dict([(uri, datetime.strptime(value[:19], DATE_FORMAT))
+                     for uri, value in find_values('vivo:dateTime', uris,
+                                                   debug=debug).items()])
+    starts = find_values('vivo:start', uris, debug=debug)
+    ends = find_values('vivo:end', uris, debug=debug)
+    return dict([(uri, (starts.get(uri, None), ends.get(uri, None)))
+                 for uri in set(starts) | set(ends)])
+
+
+def confirm_pending(snapshot, dictionaries, expire_before, debug=False):
+    """
+    Fold the pending entries found in VIVO into the dictionaries, and the
+    pending fingerprints of grants found into the fingerprints, and remove
+    them from the snapshot.  Pending entries and fingerprints of runs
+    harvested before the datetime expire_before are dropped.  Return a
+    dictionary of the number of entries confirmed in each dictionary, with
+    the number of fingerprints confirmed as 'fingerprint', the number of
+    entries still pending as 'pending' and the number dropped as 'expired'
+    """
+    counts = dict([(name, 0) for name in DICTIONARY_NAMES])
+    rows = snapshot.execute("SELECT harvested, name, key, uri FROM pending")\
+        .fetchall()
+    fingerprint_rows = snapshot.execute(
+        "SELECT harvested, pcn, fingerprint FROM pending_fingerprint "
+        "ORDER BY harvested").fetchall()
+    harvests = sorted(set([row[0] for row in rows + fingerprint_rows]))
+    grants = {}
+    if harvests:
+        grants = find_harvested_grants(harvests, debug=debug)
+    keys = {}
+    for name in ['date', 'datetime_interval']:
+        keys[name] = find_keys(name, sorted(set(
+            [row[3] for row in rows if row[1] == name])), debug=debug)
+    confirmed = []
+    for harvested, name, key, uri in rows:
+        if name == 'grant':
+            if (harvested, key) not in grants:
+                continue
+            uri = grants[(harvested, key)]
+        elif keys[name].get(uri, None) != decode_key(name, key):
+            continue
+        dictionaries[name][decode_key(name, key)] = uri
+        counts[name] = counts[name] + 1
+        confirmed.append((harvested, name, key))
+    fingerprints = [(harvested, pcn, fingerprint) for harvested, pcn,
+                    fingerprint in fingerprint_rows
+                    if (harvested, pcn) in grants]
+    counts['fingerprint'] = len(fingerprints)
+    with snapshot:
+        snapshot.executemany("DELETE FROM pending WHERE harvested = ? AND "
+                             "name = ? AND key = ?", confirmed)
+        counts['expired'] = snapshot.execute(
+            "DELETE FROM pending WHERE harvested < ?",
+            (str(expire_before),)).rowcount
+        snapshot.executemany("INSERT OR REPLACE INTO fingerprint (pcn, "
+                             "fingerprint) VALUES (?, ?)",
+                             [(pcn, fingerprint) for harvested, pcn,
+                              fingerprint in fingerprints])
+        snapshot.executemany("DELETE FROM pending_fingerprint WHERE "
+                             "harvested = ? AND pcn = ?",
+                             [(harvested, pcn) for harvested, pcn,
+                              fingerprint in fingerprints])
+        snapshot.execute("DELETE FROM pending_fingerprint WHERE "
+                         "harvested < ?", (str(expire_before),))
+    counts['pending'] = len(rows) - len(confirmed) - counts['expired']
+    return counts
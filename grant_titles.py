@@ -0,0 +1,203 @@
+#!/usr/bin/env/python
+
+"""
+    grant_titles.py: Improve grant titles from DSP by expanding the
+    abbreviations used to fit titles into limited text strings.
+
+    The abbreviations are read once from grant_title_abbreviations.txt, one
+    per line as Abbreviation|Expansion, in the order they are to be applied.
+    Titles are split into words and each word is expanded by lookup, so a
+    title is improved in one pass rather than one pass per abbreviation.
+    Expanded words and improved titles are memoized, up to CACHE_SIZE of
+    each.  A full cache is emptied, so a long-running process, such as one
+    watching for DSP files, does not grow without bound.
+
+    improve_grant_title gives the same result as applying each abbreviation
+    in turn with str.replace, as cascade_grant_title does.  Abbreviations of
+    more than one word are supported when no earlier abbreviation changes
+    their words.  Those that can never match are dropped.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import os
+
+ABBREVIATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "grant_title_abbreviations.txt")
+
+
+def read_abbreviations(file_name=ABBREVIATIONS_FILE):
+    """
+    Read the abbreviations file.  Return a list of [abbreviation, expansion]
+    in file order.  The abbreviations are ASCII, and are kept as str so they
+    can be applied to titles read as str or unicode
+    """
+    abbreviations = []
+    abbreviation_file = open(file_name)
+    abbreviation_file.readline()  # header
+    for line in abbreviation_file:
+        line = line.rstrip('\r\n')
+        if line == '':
+            continue
+        [abbreviation, expansion] = line.split('|')
+        abbreviations.append([abbreviation, expansion])
+    abbreviation_file.close()
+    return abbreviations
+
+
+def make_word_table(abbreviations):
+    """
+    Return a lookup table of single word abbreviations and a list of live
+    phrase (multi-word) abbreviations.  The word table maps each abbreviation
+    to the list of [index, expansion] of its appearances in the abbreviations
+    list.  Each phrase is [index, words, expansion]
+    """
+    word_table = {}
+    phrases = []
+    for index, (abbreviation, expansion) in enumerate(abbreviations):
+        if ' ' not in abbreviation:
+            word_table.setdefault(abbreviation, []).append([index, expansion])
+            continue
+
+        #   A phrase can never match if an earlier abbreviation ends any of
+        #   its words -- the earlier abbreviation has already changed it
+
+        words = abbreviation.split(' ')
+        earlier = [a for a, e in abbreviations[:index] if ' ' not in a]
+        if any([word.endswith(a) for word in words for a in earlier]):
+            continue
+        if any([a.endswith(words[0]) for a in earlier]) or \
+            any([abbreviation in e for a, e in abbreviations[:index]]):
+            raise ValueError("Abbreviation " + abbreviation +
+                             " depends on an earlier abbreviation")
+        phrases.append([index, words, expansion])
+    return [word_table, phrases]
+
+[WORD_TABLE, PHRASES] = make_word_table(read_abbreviations())
+
+#   Most words and titles memoized
+
+CACHE_SIZE = 100000
+
+word_cache = {}
+title_cache = {}
+
+
+def expand_word(word, start=0):
+    """
+    Expand the abbreviations ending a word, using abbreviations from index
+    start onwards.  An abbreviation may end in the middle of a word, for
+    example "(Res".  An expansion is itself expanded by the abbreviations
+    that follow the one expanded
+    """
+    key = (word, start)
+    if key in word_cache:
+        return word_cache[key]
+    best = None
+    for i in range(len(word)):
+        for index, expansion in WORD_TABLE.get(word[i:], []):
+            if index >= start:
+                if best is None or index < best[0]:
+                    best = [index, i, expansion]
+                break
+    if best is None:
+        expanded = word
+    else:
+        index, i, expansion = best
+        expanded = ' '.join([expand_word(part, index + 1) for part in
+                             (word[:i] + expansion).split(' ')])
+    if len(word_cache) >= CACHE_SIZE:
+        word_cache.clear()
+    word_cache[key] = expanded
+    return expanded
+
+
+def expand_words(words):
+    """
+    Expand the abbreviations in a list of words.  Return the expanded text
+    """
+    expanded = []
+    j = 0
+    while j < len(words):
+        word = words[j]
+        for index, phrase, expansion in PHRASES:
+            n = len(phrase)
+            if word.endswith(phrase[0]) and words[j + 1:j + n] == phrase[1:]:
+                expanded.append(expand_word(
+                    word[:len(word) - len(phrase[0])] + expansion, index + 1))
+                j = j + n
+                break
+        else:
+            expanded.append(expand_word(word))
+            j = j + 1
+    return ' '.join(expanded)
+
+
+def prepare_grant_title(s):
+    """
+    Put a grant title in the form the abbreviations are written for --
+    trailing commas removed, title case, a trailing space so the
+    abbreviations can be found as whole words throughout, and separators
+    replaced by placeholders
+    """
+    if s[len(s)-1] == ',':
+        s = s[0:len(s)-1]
+    if s[len(s)-1] == ',':
+        s = s[0:len(s)-1]
+    s = s.lower() # convert to lower
+    s = s.title() # uppercase each word
+    s = s + ' '
+    t = s.replace(", ,", ",")
+    t = t.replace("  ", " ")
+    t = t.replace("/", " @")
+    t = t.replace(",", " !")
+    t = t.replace("-", " #")
+    return t
+
+
+def finish_grant_title(t):
+    """
+    Restore the separators and take off the trailing space
+    """
+    t = t.replace(" @", "/") # restore /
+    t = t.replace(" !", ",") # restore ,
+    t = t.replace(" #", "-") # restore -
+    return t[0].upper() + t[1:-1]
+
+
+def improve_grant_title(s):
+    """
+    DSP uses a series of abbreviations to fit grant titles into limited text
+    strings.  Funding agencies often restrict the length of grant titles and
+    faculty often clip their titles to fit in available space.  Here we reverse
+    the process and lengthen the name for readability
+    """
+    if s == "":
+        return s
+    if s in title_cache:
+        return title_cache[s]
+    t = prepare_grant_title(s)
+    t = expand_words(t.split(' ')[:-1]) + ' '
+    title = finish_grant_title(t)
+    if len(title_cache) >= CACHE_SIZE:
+        title_cache.clear()
+    title_cache[s] = title
+    return title
+
+
+def cascade_grant_title(s, abbreviations=None):
+    """
+    Improve a grant title by applying each abbreviation in turn with
+    str.replace.  Slow.  The reference for improve_grant_title
+    """
+    if s == "":
+        return s
+    if abbreviations is None:
+        abbreviations = read_abbreviations()
+    t = prepare_grant_title(s)
+    for abbreviation, expansion in abbreviations:
+        t = t.replace(abbreviation + ' ', expansion + ' ')
+    return finish_grant_title(t)
@@ -0,0 +1,186 @@
+#!/usr/bin/env/python
+
+"""
+    ingest_log.py: Log and exception files for grant ingest, written by a
+    background thread in batches.
+
+    log puts a record -- the time, a level and the words of the line -- on a
+    queue and returns.  Records below the level of the log are dropped
+    before they are queued.  The writer thread takes all the records waiting
+    on the queue, formats them and writes them in one write.  Times are
+    taken with time.time() and formatted by the writer thread.
+
+    Lines are written as text, the words separated by spaces as print would
+    write them, after the time if the log is stamped, or as JSON lines with
+    the time, level, message and any other fields of the record.
+
+    flush waits until every record queued so far is written and the file is
+    flushed.  close flushes, stops the writer thread and closes the file.
+    Logs still open when the program exits, as after an error, are closed so
+    that the records leading up to the error are written.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import atexit
+import codecs
+from datetime import datetime
+import json
+import Queue
+import threading
+import time
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+FORMATS = ['text', 'json']
+
+#   Most records joined into one write
+
+BATCH_SIZE = 5000
+
+#   Queue entries that are not records
+
+FLUSH = 'flush'
+CLOSE = 'close'
+
+#   Logs open, closed at exit.  A log leaves when it is closed, so a
+#   long-running process opening a log for each run keeps none of them
+
+open_logs = set()
+
+
+def close_open_logs():
+    """
+    Close the logs still open
+    """
+    for ingest_log in list(open_logs):
+        ingest_log.close()
+
+atexit.register(close_open_logs)
+
+
+def format_words(words):
+    """
+    Return the words of a line separated by spaces, as print would write them
+    """
+    return u" ".join([w if isinstance(w, basestring) else str(w)
+                      for w in words])
+
+
+class IngestLog(object):
+    """
+    A log file written in batches by a background thread.  With stamp, text
+    lines begin with the time of the record
+    """
+
+    def __init__(self, file_name, mode='w', level='debug', format='text',
+                 stamp=True):
+        self.file_name = file_name
+        self.level = LEVELS[level]
+        self.format = format
+        self.stamp = stamp
+        self.log_file = codecs.open(file_name, mode=mode, encoding='ascii',
+                                    errors='xmlcharrefreplace')
+        self.log_file.seek(0, 2)
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.write_records)
+        self.thread.daemon = True
+        self.thread.start()
+        open_logs.add(self)
+
+    def log(self, level, *words, **fields):
+        """
+        Queue a line.  fields are added to JSON lines.  when, if given, is
+        the time.time() of the record
+        """
+        if LEVELS[level] < self.level:
+            return
+        when = fields.pop('when', None)
+        if when is None:
+            when = time.time()
+        self.queue.put([when, level, words, fields])
+
+    def debug(self, *words, **fields):
+        self.log('debug', *words, **fields)
+
+    def info(self, *words, **fields):
+        self.log('info', *words, **fields)
+
+    def warning(self, *words, **fields):
+        self.log('warning', *words, **fields)
+
+    def error(self, *words, **fields):
+        self.log('error', *words, **fields)
+
+    def log_lines(self, level, lines):
+        """
+        Queue lines already made, each ending in a new line
+        """
+        for line in lines:
+            self.log(level, line[:-1])
+
+    def format_record(self, record):
+        [when, level, words, fields] = record
+        stamp = datetime.fromtimestamp(when)
+        if self.format == 'json':
+            entry = dict(fields)
+            entry.update({'time': str(stamp), 'level': level,
+                          'message': format_words(words)})
+            return json.dumps(entry, sort_keys=True) + "\n"
+        if self.stamp:
+            words = (stamp,) + tuple(words)
+        return format_words(words) + u"\n"
+
+    def write_records(self):
+        """
+        The writer thread.  Write the records waiting on the queue in one
+        write, until closed
+        """
+        while True:
+            entries = [self.queue.get()]
+            while len(entries) < BATCH_SIZE:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            lines = []
+            for entry in entries:
+                if isinstance(entry, list):
+                    lines.append(self.format_record(entry))
+                    continue
+                if lines:
+                    self.log_file.write(u"".join(lines))
+                    lines = []
+                self.log_file.flush()
+                [request, done] = entry
+                done.set()
+                if request == CLOSE:
+                    return
+            if lines:
+                self.log_file.write(u"".join(lines))
+
+    def request(self, request):
+        done = threading.Event()
+        self.queue.put((request, done))
+        while not done.wait(1.0):
+            if not self.thread.is_alive():
+                raise IOError("Log writer for " + self.file_name +
+                              " has stopped")
+
+    def flush(self):
+        self.request(FLUSH)
+
+    def tell(self):
+        self.flush()
+        return self.log_file.tell()
+
+    def close(self):
+        open_logs.discard(self)
+        if not self.thread.is_alive():
+            return
+        self.request(CLOSE)
+        self.thread.join()
+        self.log_file.close()
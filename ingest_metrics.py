@@ -0,0 +1,215 @@
+#!/usr/bin/env/python
+
+"""
+    ingest_metrics.py: Stage timers, counters, lookup hit and miss counts
+    and SPARQL call counts and latencies for a grant ingest run, written as a
+    JSON report.
+
+    Stages run one after another.  Beginning a stage ends the one before it.
+    Calls made concurrently within a stage, such as the dictionary loads,
+    may be timed separately as timers.  SPARQL calls are counted and timed
+    by wrapping vivo_sparql_query in the modules given to instrument_sparql.
+    Each call is charged to the stage running when it is made and to a
+    histogram of latencies.  SPARQL calls may be made from several threads.
+
+    A run may be profiled by setting profiler to an ingest_profile.Profiler,
+    which follows the stages, and profiles the timed calls.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import json
+import threading
+import time
+
+#   Upper bounds in seconds of the SPARQL latency histogram buckets
+
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0]
+
+
+def bucket_name(seconds):
+    """
+    Return the name of the latency histogram bucket for a call taking the
+    given number of seconds
+    """
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            return "<=" + str(bound)
+    return ">" + str(LATENCY_BUCKETS[-1])
+
+
+class Metrics(object):
+    """
+    Metrics of a grant ingest run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.clear()
+
+    def clear(self):
+        """
+        Discard everything recorded so far, and start again
+        """
+        self.started = datetime.now()
+        self.stages = []
+        self.stage = None
+        self.stage_started = None
+        self.counters = {}
+        self.timers = {}
+        self.lookups = {}
+        self.sparql = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                       'histogram': {}}
+
+    def begin_stage(self, name):
+        """
+        End the current stage, if any, and begin the named stage
+        """
+        self.end_stage()
+        if self.profiler is not None:
+            self.profiler.begin_stage(name)
+        self.stage = {'name': name, 'seconds': 0.0, 'sparql_calls': 0,
+                      'sparql_seconds': 0.0}
+        self.stage_started = time.time()
+
+    def end_stage(self):
+        """
+        End the current stage and record its time
+        """
+        if self.stage is None:
+            return
+        self.stage['seconds'] = time.time() - self.stage_started
+        self.stages.append(self.stage)
+        self.stage = None
+        if self.profiler is not None:
+            self.profiler.end_stage()
+
+    def timed(self, name, function):
+        """
+        Return a wrapper of function that records the time of each call as
+        the named timer, and profiles it if the run is profiled
+        """
+        if self.profiler is not None:
+            function = self.profiler.profiled(function)
+        def timed_function(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.timers[name] = self.timers.get(name, 0.0) + \
+                        time.time() - start
+        return timed_function
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def lookup(self, name, found):
+        """
+        Count a hit or a miss in the named lookup dictionary
+        """
+        if name not in self.lookups:
+            self.lookups[name] = {'hits': 0, 'misses': 0}
+        if found:
+            self.lookups[name]['hits'] = self.lookups[name]['hits'] + 1
+        else:
+            self.lookups[name]['misses'] = self.lookups[name]['misses'] + 1
+
+    def sparql_call(self, seconds):
+        """
+        Record a SPARQL call taking the given number of seconds
+        """
+        with self.lock:
+            self.sparql['calls'] = self.sparql['calls'] + 1
+            self.sparql['seconds'] = self.sparql['seconds'] + seconds
+            self.sparql['max_seconds'] = max(self.sparql['max_seconds'],
+                                             seconds)
+            bucket = bucket_name(seconds)
+            self.sparql['histogram'][bucket] = \
+                self.sparql['histogram'].get(bucket, 0) + 1
+            if self.stage is not None:
+                self.stage['sparql_calls'] = self.stage['sparql_calls'] + 1
+                self.stage['sparql_seconds'] = \
+                    self.stage['sparql_seconds'] + seconds
+
+    def timed_query(self, query):
+        """
+        Return a wrapper of the SPARQL query function query that records
+        each call
+        """
+        def vivo_sparql_query(*args, **kwargs):
+            start = time.time()
+            try:
+                return query(*args, **kwargs)
+            finally:
+                self.sparql_call(time.time() - start)
+        vivo_sparql_query.metrics = self
+        return vivo_sparql_query
+
+    def instrument_sparql(self, modules):
+        """
+        Replace vivo_sparql_query in each of the modules with a wrapper that
+        records its calls
+        """
+        for module in modules:
+            query = getattr(module, 'vivo_sparql_query', None)
+            if query is None or getattr(query, 'metrics', None) is self:
+                continue
+            module.vivo_sparql_query = self.timed_query(query)
+
+    def merge(self, report):
+        """
+        Add the counters, lookups and SPARQL calls of a report made by
+        another Metrics, such as one in a worker process, to this one.  Its
+        SPARQL calls are charged to the current stage
+        """
+        for name, n in report['counters'].items():
+            self.count(name, n)
+        for name, counts in report['lookups'].items():
+            if name not in self.lookups:
+                self.lookups[name] = {'hits': 0, 'misses': 0}
+            for key in ['hits', 'misses']:
+                self.lookups[name][key] = self.lookups[name][key] + \
+                    counts[key]
+        sparql = report['sparql']
+        self.sparql['calls'] = self.sparql['calls'] + sparql['calls']
+        self.sparql['seconds'] = self.sparql['seconds'] + sparql['seconds']
+        self.sparql['max_seconds'] = max(self.sparql['max_seconds'],
+                                         sparql['max_seconds'])
+        for bucket, n in sparql['histogram'].items():
+            self.sparql['histogram'][bucket] = \
+                self.sparql['histogram'].get(bucket, 0) + n
+        if self.stage is not None:
+            self.stage['sparql_calls'] = self.stage['sparql_calls'] + \
+                sparql['calls']
+            self.stage['sparql_seconds'] = self.stage['sparql_seconds'] + \
+                sparql['seconds']
+
+    def report(self):
+        """
+        Return the metrics as a dictionary ready for JSON
+        """
+        return {'started': str(self.started),
+                'stages': list(self.stages),
+                'counters': dict(self.counters),
+                'timers': dict(self.timers),
+                'lookups': dict(self.lookups),
+                'sparql': dict(self.sparql)}
+
+    def write(self, file_name, run=None):
+        """
+        End the current stage and write the metrics as JSON to the named
+        file.  run is a dictionary describing the run, written with them
+        """
+        self.end_stage()
+        report = self.report()
+        report['finished'] = str(datetime.now())
+        report['run'] = run or {}
+        metrics_file = open(file_name, 'w')
+        json.dump(report, metrics_file, indent=2, sort_keys=True)
+        metrics_file.close()
@@ -0,0 +1,296 @@
+#!/usr/bin/env/python
+
+"""
+    ingest_profile.py: Profile each stage of a grant ingest run.
+
+    A Profiler is given to the Metrics of a run, and follows its stages.
+    Each stage is profiled by cProfile and written as a pstats file,
+    numbered in the order of the stages, for example 03_read_dsp.pstats.
+    Calls made in other threads within a stage, such as the dictionary
+    loads, are profiled when they are wrapped by Metrics.timed.  Worker
+    processes profile their shards and write part files, added to the stage
+    when it ends.  run.pstats has the whole run.
+
+    A sampler thread records the stacks of every thread at SAMPLE_INTERVAL
+    as collapsed stacks, rooted at the name of the stage, in stacks.txt --
+    one line per stack, frames separated by semicolons, followed by the
+    number of samples -- for flamegraph.pl and tools like it.  Threads
+    waiting for work are not sampled.
+
+    At the end of the run the TOP_FUNCTIONS functions taking the most time
+    are written to the log.  With no Profiler, nothing is profiled and the
+    run is as fast as ever.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import threading
+
+#   Seconds between samples of the stacks, and the number of functions in
+#   the summary in the log
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 20
+
+#   Functions of threads waiting for work.  A thread whose innermost frame
+#   is a wait, or which is a handler thread of a pool, is not sampled
+
+WAIT_FRAMES = set([('threading', 'wait')])
+HANDLER_FRAMES = set([('pool', '_handle_workers'), ('pool', '_handle_tasks'),
+                      ('pool', '_handle_results')])
+
+
+def frame_module(code):
+    return os.path.splitext(os.path.basename(code.co_filename))[0]
+
+
+def frame_name(code):
+    """
+    Return the name of a frame in a collapsed stack
+    """
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+def add_stats(stats, source):
+    """
+    Return stats with a profile or a pstats file added, or new stats of the
+    source if stats is None.  A source of no calls, which pstats will
+    not load, adds nothing
+    """
+    try:
+        if stats is None:
+            return pstats.Stats(source)
+        stats.add(source)
+    except TypeError:
+        pass
+    return stats
+
+
+def dump_stats(stats, file_name):
+    """
+    Write stats as a pstats file, unless there are none
+    """
+    if stats is not None:
+        stats.dump_stats(file_name)
+
+
+def function_name(function):
+    [file_name, line, name] = function
+    if line == 0:
+        return name
+    return "%s (%s:%d)" % (name, os.path.basename(file_name), line)
+
+
+class Sampler(threading.Thread):
+    """
+    A thread counting the collapsed stacks of the other threads, each rooted
+    at root, until stopped
+    """
+
+    def __init__(self, root, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root = root
+        self.interval = interval
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != self.ident:
+                    self.sample(frame)
+
+    def sample(self, frame):
+        if (frame_module(frame.f_code), frame.f_code.co_name) in \
+                WAIT_FRAMES:
+            return
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if (frame_module(code), code.co_name) in HANDLER_FRAMES:
+                return
+            names.append(frame_name(code))
+            frame = frame.f_back
+        names.append(self.root)
+        stack = ";".join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self):
+        """
+        Stop sampling.  Return the counts of the stacks
+        """
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+class Profiler(object):
+    """
+    Profiles of the stages of a grant ingest run, written to a directory
+    """
+
+    def __init__(self, directory, log=None, top=TOP_FUNCTIONS):
+        self.directory = directory
+        self.log = log
+        self.top = top
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.run_stats = None
+        self.stacks = {}
+        self.stages = []
+        self.stage = None
+        self.part = None
+
+    def stage_prefix(self):
+        return os.path.join(self.directory, "%02d_%s" % (len(self.stages) + 1,
+                                                         self.stage))
+
+    def start(self, root):
+        self.profile = cProfile.Profile()
+        self.thread = threading.current_thread()
+        self.thread_profiles = []
+        self.sampler = Sampler(root)
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling.  Return [stats, stacks] of the calls profiled since
+        start
+        """
+        self.profile.disable()
+        stacks = self.sampler.stop()
+        stats = None
+        for profile in [self.profile] + self.thread_profiles:
+            stats = add_stats(stats, profile)
+        return [stats, stacks]
+
+    def begin_stage(self, name):
+        """
+        End the current stage, if any, and begin profiling the named stage
+        """
+        self.end_stage()
+        self.stage = name
+        self.start(name)
+
+    def end_stage(self):
+        """
+        End the current stage.  Write its pstats file, with the part files
+        of its workers, and add it to the run
+        """
+        if self.stage is None:
+            return
+        [stats, stacks] = self.stop()
+        prefix = self.stage_prefix()
+        for part_name in sorted(glob.glob(prefix + ".part*.pstats")):
+            stats = add_stats(stats, part_name)
+            os.remove(part_name)
+        for part_name in sorted(glob.glob(prefix + ".part*.stacks")):
+            part_file = open(part_name)
+            for line in part_file:
+                [stack, n] = line.rsplit(" ", 1)
+                stacks[stack] = stacks.get(stack, 0) + int(n)
+            part_file.close()
+            os.remove(part_name)
+        if stats is not None:
+            stats.dump_stats(prefix + ".pstats")
+            self.run_stats = add_stats(self.run_stats, prefix + ".pstats")
+        for stack, n in stacks.items():
+            self.stacks[stack] = self.stacks.get(stack, 0) + n
+        seconds = 0.0
+        if stats is not None:
+            seconds = stats.total_tt
+        self.stages.append([self.stage, seconds])
+        self.stage = None
+
+    def begin_part(self, part):
+        """
+        In a worker process forked within a stage, begin profiling a part of
+        the stage, such as a shard.  The profiling of the parent process is
+        not carried on in the worker
+        """
+        self.profile.disable()
+        self.part = part
+        self.start(self.stage + ";worker")
+
+    def end_part(self):
+        """
+        In a worker process, end the part and write its pstats and stacks
+        files, to be added to the stage by the parent process
+        """
+        [stats, stacks] = self.stop()
+        prefix = self.stage_prefix() + ".part%04d" % self.part
+        dump_stats(stats, prefix + ".pstats")
+        stacks_file = open(prefix + ".stacks", 'w')
+        for stack, n in stacks.items():
+            stacks_file.write("%s %d\n" % (stack, n))
+        stacks_file.close()
+        self.part = None
+
+    def profiled(self, function):
+        """
+        Return a wrapper of function that profiles each call made in another
+        thread, which the profile of the stage does not see.  A call in the
+        thread of the stage is in its profile already
+        """
+        def profiled_function(*args, **kwargs):
+            if threading.current_thread() is self.thread:
+                return function(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.thread_profiles.append(profile)
+        return profiled_function
+
+    def summary(self):
+        """
+        Return lines summarizing the run -- the time of each stage and the
+        functions taking the most time of their own
+        """
+        lines = ["Profile of " + str(len(self.stages)) + " stages in " +
+                 self.directory]
+        for stage, seconds in self.stages:
+            lines.append("  %-28s %10.3fs profiled" % (stage, seconds))
+        lines.append("Top " + str(self.top) + " functions by own time:")
+        lines.append("  %10s %10s %10s  %s" % ("own", "cumulative", "calls",
+                                                "function"))
+        functions = []
+        if self.run_stats is not None:
+            functions = self.run_stats.stats.items()
+        functions = sorted(functions,
+                           key=lambda item: item[1][2], reverse=True)
+        for function, [primitive_calls, calls, own_seconds,
+                       cumulative_seconds, callers] in \
+                functions[:self.top]:
+            lines.append("  %9.3fs %9.3fs %10d  %s" % (
+                own_seconds, cumulative_seconds, calls,
+                function_name(function)))
+        return lines
+
+    def close(self):
+        """
+        End the current stage.  Write the run's pstats file and collapsed
+        stacks, and the summary to the log
+        """
+        self.end_stage()
+        dump_stats(self.run_stats, os.path.join(self.directory, "run.pstats"))
+        stacks_file = open(os.path.join(self.directory, "stacks.txt"), 'w')
+        for stack, n in sorted(self.stacks.items()):
+            stacks_file.write("%s %d\n" % (stack, n))
+        stacks_file.close()
+        if self.log is not None:
+            for line in self.summary():
+                self.log.info(line)
@@ -0,0 +1,191 @@
+#!/usr/bin/env/python
+
+"""
+    rdf_compact.py: Compact the add and sub RDF of a run before it is loaded
+    into VIVO.
+
+    The triples of each file are read back as N-Triples lines and sorted
+    with an on-disk merge sort -- runs of at most RUN_LINES lines are sorted
+    in memory and written to files in a work directory, then merged, at most
+    MERGE_WIDTH files at a time.  Duplicate triples, such as those of dates
+    and datetime intervals shared by grants, are dropped as the runs are
+    merged.
+
+    The add file is loaded into VIVO before the sub file.  A triple in both
+    is removed by the sub file whatever the add file does, so it is
+    cancelled from the add file.  Loading the compacted files has the same
+    result as loading the originals.
+
+    The compacted files are written in the format of the originals, sorted
+    so that the triples of each subject are together.  Memory is bounded by
+    RUN_LINES, whatever the size of the run.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import heapq
+import os
+import shutil
+
+#   Lines sorted in memory at a time, and run files merged at a time
+
+RUN_LINES = 200000
+MERGE_WIDTH = 64
+
+
+def write_run(lines, file_name):
+    run_file = open(file_name, 'wb')
+    run_file.writelines(lines)
+    run_file.close()
+    return file_name
+
+
+def unique_lines(lines):
+    """
+    Generate sorted lines without their duplicates
+    """
+    last = None
+    for line in lines:
+        if line != last:
+            yield line
+            last = line
+
+
+def merge_runs(run_names, file_name):
+    """
+    Merge sorted run files into one sorted file of unique lines.  Remove the
+    run files
+    """
+    run_files = [open(name, 'rb') for name in run_names]
+    write_run(unique_lines(heapq.merge(*run_files)), file_name)
+    for run_file in run_files:
+        run_file.close()
+    for name in run_names:
+        os.remove(name)
+    return file_name
+
+
+def sort_unique(lines, work_directory, name, counts):
+    """
+    Sort lines into a file of unique lines in the work directory, in runs of
+    RUN_LINES.  Count the lines read and written.  Return the name of the
+    file
+    """
+    run_names = []
+    run = []
+    read = 0
+    for line in lines:
+        if not line.endswith('\n'):
+            line = line + '\n'
+        run.append(line)
+        read = read + 1
+        if len(run) == RUN_LINES:
+            run.sort()
+            run_names.append(write_run(unique_lines(run), os.path.join(
+                work_directory, name + ".run%06d" % len(run_names))))
+            run = []
+    run.sort()
+    run_names.append(write_run(unique_lines(run), os.path.join(
+        work_directory, name + ".run%06d" % len(run_names))))
+    level = 0
+    while len(run_names) > MERGE_WIDTH:
+        level = level + 1
+        run_names = [merge_runs(run_names[start:start + MERGE_WIDTH],
+                                os.path.join(work_directory, name +
+                                             ".merge%02d.%06d" % (level,
+                                                                  start)))
+                     for start in range(0, len(run_names), MERGE_WIDTH)]
+    sorted_name = merge_runs(run_names, os.path.join(work_directory,
+                                                     name + ".sorted"))
+    counts[name + '_triples'] = read
+    return sorted_name
+
+
+def cancel_lines(lines, other_lines, counts):
+    """
+    Generate the sorted unique lines not in the sorted unique other_lines.
+    Count the lines cancelled
+    """
+    other = next(other_lines, None)
+    cancelled = 0
+    for line in lines:
+        while other is not None and other < line:
+            other = next(other_lines, None)
+        if line == other:
+            cancelled = cancelled + 1
+            continue
+        yield line
+    counts['cancelled'] = cancelled
+
+
+def counted_lines(lines, counts, name):
+    counts[name] = 0
+    for line in lines:
+        counts[name] = counts[name] + 1
+        yield line
+
+
+def write_compacted(sink, lines, work_directory):
+    """
+    Write lines to a new sink like sink, in the work directory with the base
+    name of sink.  Return the new sink, closed
+    """
+    compacted_sink = sink.open_like(os.path.join(
+        work_directory, os.path.basename(sink.file_name)))
+    compacted_sink.write_header()
+    compacted_sink.write_triples(lines)
+    compacted_sink.write_footer()
+    compacted_sink.close()
+    return compacted_sink
+
+
+def compact(add_sink, sub_sink, work_directory):
+    """
+    Compact the closed add and sub sinks of a run.  The compacted files are
+    written to the work directory, with the base names of the originals, by
+    sinks made with open_like.  Return [compacted add sink, compacted sub
+    sink, counts] -- the counts of triples read from each, written to each
+    and cancelled
+    """
+    counts = {}
+    add_sorted = sort_unique(add_sink.triple_lines(), work_directory, 'add',
+                             counts)
+    sub_sorted = sort_unique(sub_sink.triple_lines(), work_directory, 'sub',
+                             counts)
+
+    add_file = open(add_sorted, 'rb')
+    sub_file = open(sub_sorted, 'rb')
+    compacted_add = write_compacted(add_sink, counted_lines(
+        cancel_lines(add_file, sub_file, counts), counts, 'add_compacted'),
+        work_directory)
+    add_file.close()
+    sub_file.close()
+
+    sub_file = open(sub_sorted, 'rb')
+    compacted_sub = write_compacted(sub_sink, counted_lines(
+        sub_file, counts, 'sub_compacted'), work_directory)
+    sub_file.close()
+
+    os.remove(add_sorted)
+    os.remove(sub_sorted)
+    return [compacted_add, compacted_sub, counts]
+
+
+def replace_files(sink, compacted_sink):
+    """
+    Move the files of a compacted sink over those of the original.  Files
+    of the original not replaced, such as chunk files past the last
+    compacted chunk, are removed
+    """
+    directory = os.path.dirname(sink.file_name)
+    replaced = set()
+    for name in compacted_sink.file_names():
+        target = os.path.join(directory, os.path.basename(name))
+        shutil.move(name, target)
+        replaced.add(os.path.abspath(target))
+    for name in sink.file_names():
+        if os.path.abspath(name) not in replaced and os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,544 @@
+#!/usr/bin/env/python
+
+"""
+    rdf_sink.py: Write RDF to a file in large chunks.
+
+    RDF fragments are collected as they are made.  When the collected
+    fragments reach the chunk size they are joined, encoded to ASCII with
+    non-ASCII characters replaced by XML character references, and written
+    to the file in one write.  The file is opened with a buffer of the same
+    size.
+
+    An RdfSink writes RDF/XML.  An NTriplesSink takes the same RDF/XML
+    fragments and writes N-Triples, split into numbered chunk files of at
+    most max_bytes each, optionally gzipped, with a JSON manifest listing
+    them.  Chunk files can be loaded into VIVO separately, in parallel, and
+    a failed load restarted from the chunk that failed.
+
+    checkpoint flushes a sink and returns its position.  A sink opened with
+    resume set to that position cuts its files back to it and carries on.
+
+    Blank nodes without an rdf:nodeID are labelled from a count kept by the
+    sink, carried in its position, so that two of them written by one sink
+    never share a label.  A part of a sink labels its blank nodes with the
+    name of the part.
+
+    Once closed, the triples of a sink can be read back as N-Triples lines
+    with triple_lines, and written to a new sink of the same kind, made
+    with open_like, with write_triples.  RDF/XML is read a node element at
+    a time, and written with one rdf:Description per subject.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+import gzip
+import itertools
+import json
+import os
+import re
+import shutil
+import xml.etree.cElementTree as ElementTree
+import zlib
+import vivofoundation as vt
+from grant_checkpoint import truncate_file
+from vivo_graph import TRIPLE
+from vivo_graph import unescape
+
+CHUNK_SIZE = 1024 * 1024
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDF_DESCRIPTION = "{" + RDF + "}Description"
+RDF_ABOUT = "{" + RDF + "}about"
+RDF_NODE_ID = "{" + RDF + "}nodeID"
+RDF_RESOURCE = "{" + RDF + "}resource"
+RDF_DATATYPE = "{" + RDF + "}datatype"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+XML_NAMESPACE = re.compile(r'xmlns:([\w-]+)="([^"]*)"')
+XML_LOCAL_NAME = re.compile(r'[A-Za-z_][\w.-]*$')
+
+
+class RdfSink(object):
+    """
+    A file of RDF.  write takes an RDF fragment, str or unicode, and
+    collects it.  Collected fragments are written when they reach chunk_size
+    characters, on flush and on close
+    """
+
+    def __init__(self, file_name, chunk_size=CHUNK_SIZE, resume=None):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        if resume is None:
+            self.rdf_file = open(file_name, 'wb', chunk_size)
+        else:
+            truncate_file(file_name, resume['offset'])
+            self.rdf_file = open(file_name, 'ab', chunk_size)
+            self.rdf_file.seek(0, 2)
+        self.fragments = []
+        self.size = 0
+
+    def open_part(self, file_name):
+        """
+        Return a sink of the same kind for a part of this file, such as a
+        shard, to be added to it later with append_file
+        """
+        return RdfSink(file_name, self.chunk_size)
+
+    def write_header(self):
+        self.write(vt.rdf_header())
+
+    def write_footer(self):
+        self.write(vt.rdf_footer())
+
+    def write(self, rdf):
+        if rdf == "":
+            return
+        self.fragments.append(rdf)
+        self.size = self.size + len(rdf)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.fragments:
+            chunk = u"".join(self.fragments)
+            self.rdf_file.write(chunk.encode('ascii', 'xmlcharrefreplace'))
+            self.fragments = []
+            self.size = 0
+        self.rdf_file.flush()
+
+    def checkpoint(self):
+        self.flush()
+        return {'offset': self.rdf_file.tell()}
+
+    def append_file(self, file_name):
+        """
+        Copy the contents of a file written by another RdfSink to this one
+        """
+        self.flush()
+        part_file = open(file_name, 'rb')
+        shutil.copyfileobj(part_file, self.rdf_file, self.chunk_size)
+        part_file.close()
+
+    def close(self):
+        self.flush()
+        self.rdf_file.close()
+
+    def open_like(self, file_name):
+        """
+        Return a new sink of the same kind and options writing to file_name
+        """
+        return RdfSink(file_name, self.chunk_size)
+
+    def file_names(self):
+        return [self.file_name]
+
+    def triple_lines(self):
+        """
+        Generate the N-Triples lines of the RDF written to the file, once
+        closed.  The file is parsed a node element at a time
+        """
+        blank_nodes = BlankNodes()
+        depth = 0
+        root = None
+        for event, element in ElementTree.iterparse(self.file_name,
+                                                    events=('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    root = element
+                depth = depth + 1
+                continue
+            depth = depth - 1
+            if depth == 1:
+                lines = []
+                node_triples(element, lines, blank_nodes)
+                for line in lines:
+                    yield line
+                root.clear()
+
+    def write_triples(self, lines):
+        """
+        Write N-Triples lines as RDF/XML.  Lines for the same subject are
+        written as one rdf:Description when they are together, as in sorted
+        lines
+        """
+        for rdf in ntriples_to_rdfxml(lines):
+            self.write(rdf)
+
+
+def escape_ntriples(text):
+    """
+    Return the text of an N-Triples literal, escaped and in ASCII
+    """
+    text = text.replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    try:
+        return text.encode('ascii')
+    except UnicodeError:
+        pass
+    escaped = []
+    i = 0
+    while i < len(text):
+        code = ord(text[i])
+        if 0xD800 <= code < 0xDC00 and i + 1 < len(text) and \
+                0xDC00 <= ord(text[i + 1]) < 0xE000:
+            code = 0x10000 + ((code - 0xD800) << 10) + \
+                (ord(text[i + 1]) - 0xDC00)
+            i = i + 1
+        if code < 0x80:
+            escaped.append(chr(code))
+        elif code < 0x10000:
+            escaped.append('\\u%04X' % code)
+        else:
+            escaped.append('\\U%08X' % code)
+        i = i + 1
+    return ''.join(escaped)
+
+
+def tag_uri(tag):
+    """
+    Return the uri of an ElementTree tag, {namespace}name
+    """
+    return tag[1:].replace('}', '', 1)
+
+
+class BlankNodes(object):
+    """
+    Labels for blank nodes without an rdf:nodeID -- prefix followed by a
+    count, starting after start
+    """
+
+    def __init__(self, prefix='b', start=0):
+        self.prefix = prefix
+        self.count = start
+        self.counter = itertools.count(start + 1)
+
+    def label(self):
+        self.count = next(self.counter)
+        return self.prefix + str(self.count)
+
+
+def node_triples(node, lines, blank_nodes):
+    """
+    Add the N-Triples of an RDF/XML node element and its property elements
+    to lines.  Blank nodes without an rdf:nodeID are labelled by
+    blank_nodes.  Return the subject of the node
+    """
+    if node.get(RDF_ABOUT) is not None:
+        subject = '<' + node.get(RDF_ABOUT) + '>'
+    else:
+        subject = '_:' + (node.get(RDF_NODE_ID) or blank_nodes.label())
+    if node.tag != RDF_DESCRIPTION:
+        lines.append(subject + ' <' + RDF + 'type> <' + tag_uri(node.tag) +
+                     '> .\n')
+    for element in node:
+        predicate = '<' + tag_uri(element.tag) + '>'
+        if element.get(RDF_RESOURCE) is not None:
+            value = '<' + element.get(RDF_RESOURCE) + '>'
+        elif len(element) > 0:
+            value = node_triples(element[0], lines, blank_nodes)
+        else:
+            value = '"' + escape_ntriples(element.text or '') + '"'
+            if element.get(RDF_DATATYPE) is not None:
+                value = value + '^^<' + element.get(RDF_DATATYPE) + '>'
+            elif element.get(XML_LANG) is not None:
+                value = value + '@' + element.get(XML_LANG)
+        lines.append(subject + ' ' + predicate + ' ' + value + ' .\n')
+    return subject
+
+
+def xml_escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;')\
+        .replace('>', '&gt;').replace('"', '&quot;')
+
+
+def rdfxml_namespaces():
+    """
+    Return a list of [prefix, namespace] declared by vt.rdf_header(), longest
+    namespace first
+    """
+    namespaces = [[prefix, namespace] for prefix, namespace in
+                  XML_NAMESPACE.findall(vt.rdf_header())]
+    return sorted(namespaces, key=lambda n: -len(n[1]))
+
+
+def property_element(predicate, namespaces):
+    """
+    Return [name, declaration] of the property element of a predicate uri --
+    a qualified name, and the namespace declaration it needs if its
+    namespace is not declared by the header
+    """
+    for prefix, namespace in namespaces:
+        if predicate.startswith(namespace) and \
+                XML_LOCAL_NAME.match(predicate[len(namespace):]):
+            return [prefix + ':' + predicate[len(namespace):], '']
+    m = XML_LOCAL_NAME.search(predicate)
+    if m is None:
+        raise ValueError("No RDF/XML name for predicate " + predicate)
+    return ['ns0:' + m.group(0), ' xmlns:ns0="' +
+            xml_escape(predicate[:m.start()]) + '"']
+
+
+def node_attribute(term, uri_attribute):
+    """
+    Return the RDF/XML attribute naming an N-Triples uri or blank node
+    """
+    if term.startswith('_:'):
+        return 'rdf:nodeID="' + xml_escape(term[2:]) + '"'
+    return uri_attribute + '="' + xml_escape(term[1:-1]) + '"'
+
+
+def ntriples_to_rdfxml(lines):
+    """
+    Generate RDF/XML fragments, one rdf:Description for each run of lines
+    with the same subject, for lines of N-Triples
+    """
+    namespaces = rdfxml_namespaces()
+    elements = {}
+    subject = None
+    properties = []
+    for line in lines:
+        m = TRIPLE.match(line.strip())
+        if m is None:
+            raise ValueError("Not an N-Triples line: " + line)
+        s, p, o, value, datatype, lang = m.groups()
+        if s != subject:
+            if properties:
+                yield u'<rdf:Description ' + \
+                    node_attribute(subject, 'rdf:about') + u'>\n' + \
+                    u''.join(properties) + u'</rdf:Description>\n'
+            subject = s
+            properties = []
+        if p not in elements:
+            elements[p] = property_element(p, namespaces)
+        [name, declaration] = elements[p]
+        if o.startswith('"'):
+            attributes = declaration
+            if datatype is not None:
+                attributes = attributes + ' rdf:datatype="' + \
+                    xml_escape(datatype) + '"'
+            elif lang is not None:
+                attributes = attributes + ' xml:lang="' + lang + '"'
+            properties.append(u'    <' + name + attributes + u'>' +
+                              xml_escape(unescape(value.decode('ascii'))) +
+                              u'</' + name + u'>\n')
+        else:
+            properties.append(u'    <' + name + declaration + u' ' +
+                              node_attribute(o, 'rdf:resource') + u'/>\n')
+    if properties:
+        yield u'<rdf:Description ' + node_attribute(subject, 'rdf:about') + \
+            u'>\n' + u''.join(properties) + u'</rdf:Description>\n'
+
+
+def rdfxml_to_ntriples(rdf, blank_nodes):
+    """
+    Return the N-Triples, as a list of lines, of RDF/XML fragments -- node
+    elements without the rdf:RDF element around them, as made by
+    vivofoundation.  The namespaces are those of vt.rdf_header().  Blank
+    nodes without an rdf:nodeID are labelled by blank_nodes
+    """
+    header = XML_DECLARATION.sub('', vt.rdf_header())
+    root = ElementTree.fromstring(header + rdf + vt.rdf_footer())
+    lines = []
+    for node in root:
+        node_triples(node, lines, blank_nodes)
+    return lines
+
+
+class NTriplesSink(object):
+    """
+    A file of RDF in N-Triples.  write takes an RDF/XML fragment, str or
+    unicode, as for an RdfSink.  Collected fragments are converted to
+    N-Triples when they reach chunk_size characters, on flush and on close.
+
+    With max_bytes, the triples are written to chunk files named
+    file_name.0001.nt, file_name.0002.nt and so on, gzipped if compress,
+    each of at most max_bytes of N-Triples (or one triple, if larger).
+    file_name.manifest.json lists them.  Without max_bytes the triples are
+    written to file_name itself.  Blank nodes without an rdf:nodeID are
+    labelled blank_prefix followed by a count
+    """
+
+    def __init__(self, file_name, max_bytes=None, compress=False,
+                 chunk_size=CHUNK_SIZE, resume=None, blank_prefix='b'):
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.blank_nodes = BlankNodes(blank_prefix)
+        self.fragments = []
+        self.size = 0
+        self.chunks = []
+        self.nt_file = None
+        if resume is not None:
+            self.resume(resume)
+        elif max_bytes is None:
+            self.nt_file = open(file_name, 'wb', chunk_size)
+            self.chunks.append({'file': os.path.basename(file_name),
+                                'triples': 0, 'bytes': 0})
+
+    def chunk_name(self, number):
+        name = self.file_name + ".%04d.nt" % number
+        if self.compress:
+            name = name + ".gz"
+        return name
+
+    def resume(self, position):
+        """
+        Cut the files back to a position returned by checkpoint and reopen
+        the last of them.  Chunk files after the position are removed.  A
+        gzipped chunk is rewritten from its uncompressed contents
+        """
+        self.chunks = [dict(chunk) for chunk in position['chunks']]
+        self.blank_nodes = BlankNodes(self.blank_nodes.prefix,
+                                      position.get('blank_nodes', 0))
+        if self.max_bytes is None:
+            truncate_file(self.file_name, self.chunks[0]['bytes'])
+            self.nt_file = open(self.file_name, 'ab', self.chunk_size)
+            return
+        number = len(self.chunks) + 1
+        while os.path.exists(self.chunk_name(number)):
+            os.remove(self.chunk_name(number))
+            number = number + 1
+        if not self.chunks:
+            return
+        name = self.chunk_name(len(self.chunks))
+        length = self.chunks[-1]['bytes']
+        if self.compress:
+            compressed_file = open(name, 'rb')
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            contents = decompressor.decompress(compressed_file.read())
+            compressed_file.close()
+            self.nt_file = gzip.open(name, 'wb')
+            self.nt_file.write(contents[:length])
+        else:
+            truncate_file(name, length)
+            self.nt_file = open(name, 'ab', self.chunk_size)
+
+    def open_part(self, file_name):
+        """
+        Return a sink of N-Triples for a part of this file, such as a shard,
+        to be added to it later with append_file.  Its blank nodes are
+        labelled with the name of the part, so they are not those of this
+        sink or of its other parts
+        """
+        part = re.sub(r'[^0-9A-Za-z]', '', os.path.basename(file_name))
+        return NTriplesSink(file_name, chunk_size=self.chunk_size,
+                            blank_prefix=self.blank_nodes.prefix + part + 'n')
+
+    def write_header(self):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def write(self, rdf):
+        if rdf == "":
+            return
+        self.fragments.append(rdf)
+        self.size = self.size + len(rdf)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def chunk_file(self, line_bytes):
+        """
+        Return the file to write line_bytes more bytes to, starting a new
+        chunk file if the current one would pass max_bytes
+        """
+        if self.max_bytes is not None and (self.nt_file is None or (
+                self.chunks[-1]['bytes'] > 0 and
+                self.chunks[-1]['bytes'] + line_bytes > self.max_bytes)):
+            if self.nt_file is not None:
+                self.nt_file.close()
+            name = self.chunk_name(len(self.chunks) + 1)
+            if self.compress:
+                self.nt_file = gzip.open(name, 'wb')
+            else:
+                self.nt_file = open(name, 'wb', self.chunk_size)
+            self.chunks.append({'file': os.path.basename(name),
+                                'triples': 0, 'bytes': 0})
+        return self.nt_file
+
+    def write_lines(self, lines):
+        """
+        Write lines of N-Triples, keeping each chunk file within max_bytes
+        """
+        for line in lines:
+            self.chunk_file(len(line)).write(line)
+            self.chunks[-1]['triples'] = self.chunks[-1]['triples'] + 1
+            self.chunks[-1]['bytes'] = self.chunks[-1]['bytes'] + len(line)
+
+    def flush(self):
+        if self.fragments:
+            rdf = u"".join(self.fragments).encode('ascii', 'xmlcharrefreplace')
+            self.write_lines(rdfxml_to_ntriples(rdf, self.blank_nodes))
+            self.fragments = []
+            self.size = 0
+        if self.nt_file is not None:
+            self.nt_file.flush()
+
+    def checkpoint(self):
+        self.flush()
+        return {'chunks': [dict(chunk) for chunk in self.chunks],
+                'blank_nodes': self.blank_nodes.count}
+
+    def append_file(self, file_name):
+        """
+        Add the triples of a file written by another NTriplesSink without
+        max_bytes to this one
+        """
+        self.flush()
+        part_file = open(file_name, 'rb', self.chunk_size)
+        self.write_lines(part_file)
+        part_file.close()
+
+    def write_triples(self, lines):
+        self.write_lines(lines)
+
+    def close(self):
+        self.flush()
+        if self.nt_file is not None:
+            self.nt_file.close()
+        if self.max_bytes is not None:
+            manifest_file = open(self.file_name + ".manifest.json", 'w')
+            json.dump({'format': 'N-Triples', 'gzip': self.compress,
+                       'triples': sum([c['triples'] for c in self.chunks]),
+                       'chunks': self.chunks}, manifest_file, indent=2,
+                      sort_keys=True)
+            manifest_file.close()
+
+    def open_like(self, file_name):
+        """
+        Return a new sink of the same kind and options writing to file_name
+        """
+        return NTriplesSink(file_name, self.max_bytes, self.compress,
+                            self.chunk_size)
+
+    def file_names(self):
+        """
+        Return the names of the files written -- the chunk files and the
+        manifest, or the one file
+        """
+        if self.max_bytes is None:
+            return [self.file_name]
+        directory = os.path.dirname(self.file_name)
+        return [os.path.join(directory, chunk['file']) for chunk in
+                self.chunks] + [self.file_name + ".manifest.json"]
+
+    def triple_lines(self):
+        """
+        Generate the N-Triples lines written, once closed
+        """
+        directory = os.path.dirname(self.file_name)
+        for chunk in self.chunks:
+            name = os.path.join(directory, chunk['file'])
+            if name.endswith('.gz'):
+                nt_file = gzip.open(name, 'rb')
+            else:
+                nt_file = open(name, 'rb', self.chunk_size)
+            for line in nt_file:
+                yield line
+            nt_file.close()
@@ -0,0 +1,233 @@
+#!/usr/bin/env/python
+
+"""
+    sparql_client.py: A SPARQL client for VIVO that keeps a pool of
+    keep-alive HTTP connections and can be shared by threads.
+
+    vivofoundation opens a new HTTP connection for every query.  install
+    replaces vivo_sparql_query in the given modules with the query method of
+    a SparqlClient, so every query made by grant ingest, including those made
+    inside vivofoundation and vivogrants, goes through the pool.  The pool is
+    used only when asked for.  Its endpoint is, by default, the one
+    vivo_sparql_query queries, and it declares the prefixes in PREFIXES.  A
+    query made with keyword arguments the pool does not handle, such as
+    another baseURL or format, is passed to the vivo_sparql_query replaced.
+
+    The client throttles itself.  No more than max_connections queries are
+    in flight at once, queries are started no closer together than
+    min_interval seconds, and a query that fails or is refused with a busy
+    status is retried after a growing delay.
+
+    run_concurrently runs independent calls, such as the dictionary loads,
+    in a small pool of threads.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from multiprocessing.pool import ThreadPool
+import httplib
+import inspect
+import json
+import Queue
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+RESULT_FORMAT = "application/sparql-results+json"
+
+PREFIXES = """
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX foaf: <http://xmlns.com/foaf/0.1/>
+PREFIX bibo: <http://purl.org/ontology/bibo/>
+PREFIX vivo: <http://vivoweb.org/ontology/core#>
+PREFIX ufVivo: <http://vivo.ufl.edu/ontology/vivo-ufl/>
+"""
+
+#   HTTP statuses meaning the endpoint is busy.  The query is retried
+
+BUSY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class SparqlError(Exception):
+    pass
+
+
+def default_endpoint(module):
+    """
+    Return the endpoint the vivo_sparql_query of a module queries when it is
+    not given a baseURL, or None if it has no such default
+    """
+    try:
+        [names, varargs, keywords, defaults] = inspect.getargspec(
+            module.vivo_sparql_query)
+    except TypeError:
+        return None
+    defaults = dict(zip(names[len(names) - len(defaults or []):],
+                        defaults or []))
+    return defaults.get('baseURL', None)
+
+
+class SparqlClient(object):
+    """
+    A pool of keep-alive HTTP connections to a SPARQL endpoint
+    """
+
+    def __init__(self, endpoint, max_connections=4,
+                 min_interval=0.0, timeout=300, retries=3, backoff=1.0):
+        parts = urlparse.urlsplit(endpoint)
+        self.endpoint = endpoint
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.secure = parts.scheme == "https"
+        self.max_connections = max_connections
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.idle = Queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.last_start = 0.0
+        self.replaced = None
+
+    def connect(self):
+        if self.secure:
+            return httplib.HTTPSConnection(self.host, self.port,
+                                           timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+
+    def wait_turn(self):
+        """
+        Wait until min_interval seconds have passed since the last query
+        was started
+        """
+        if self.min_interval <= 0:
+            return
+        with self.lock:
+            delay = self.last_start + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_start = time.time()
+
+    def post(self, body):
+        """
+        Post a form body to the endpoint on a pooled connection.  Return the
+        status and the response text.  A connection that fails is closed and
+        not returned to the pool
+        """
+        try:
+            connection = self.idle.get_nowait()
+        except Queue.Empty:
+            connection = self.connect()
+        try:
+            connection.request("POST", self.path, body, {
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": RESULT_FORMAT,
+                "Connection": "keep-alive"})
+            response = connection.getresponse()
+            text = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            raise
+        if response.getheader("connection", "").lower() == "close":
+            connection.close()
+        else:
+            self.idle.put(connection)
+        return [response.status, text]
+
+    def query(self, query, debug=False, **kwargs):
+        """
+        Run a SPARQL query and return the result in SPARQL JSON result form,
+        as vivo_sparql_query does.  baseURL and format are honoured when
+        they are the endpoint and format of the pool.  A query with other
+        keyword arguments is made by the vivo_sparql_query replaced, or
+        refused with TypeError if none was
+        """
+        if kwargs.get('baseURL', self.endpoint) != self.endpoint or \
+                kwargs.get('format', RESULT_FORMAT) != RESULT_FORMAT or \
+                set(kwargs) - set(['baseURL', 'format']):
+            if self.replaced is None:
+                raise TypeError("SparqlClient.query can not handle " +
+                                ", ".join(sorted(kwargs)))
+            return self.replaced(query, debug=debug, **kwargs)
+        query = PREFIXES + query
+        if debug:
+            print "SPARQL query", query
+        body = urllib.urlencode({"query": query, "format": RESULT_FORMAT})
+        delay = self.backoff
+        attempt = 0
+        while True:
+            attempt = attempt + 1
+            self.slots.acquire()
+            try:
+                self.wait_turn()
+                try:
+                    [status, text] = self.post(body)
+                except (httplib.HTTPException, socket.error), error:
+                    status = None
+                    text = str(error)
+            finally:
+                self.slots.release()
+            if status == 200:
+                break
+            if (status is not None and status not in BUSY_STATUSES) or \
+                    attempt > self.retries:
+                raise SparqlError("SPARQL query failed with " + str(status) +
+                                  " " + text[:200])
+            time.sleep(delay)
+            delay = delay * 2
+        result = json.loads(text)
+        if debug:
+            print "SPARQL result", result
+        return result
+
+    def close(self):
+        """
+        Close the idle connections.  In a forked process this discards the
+        connections inherited from the parent
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Queue.Empty:
+                break
+
+    def install(self, modules):
+        """
+        Replace vivo_sparql_query in each of the modules with the query
+        method of this client.  The first vivo_sparql_query replaced makes
+        the queries the pool does not handle
+        """
+        for module in modules:
+            if hasattr(module, 'vivo_sparql_query'):
+                if self.replaced is None:
+                    self.replaced = module.vivo_sparql_query
+                module.vivo_sparql_query = self.query
+
+
+def run_concurrently(calls, workers):
+    """
+    Run each call [function, args, kwargs] in a pool of workers threads.
+    Return their results in the order of the calls.  With one worker the
+    calls are made in order in this thread
+    """
+    if workers <= 1:
+        return [function(*args, **kwargs) for function, args, kwargs in calls]
+    pool = ThreadPool(min(workers, len(calls)))
+    try:
+        pending = [pool.apply_async(function, args, kwargs)
+                   for function, args, kwargs in calls]
+        return [result.get() for result in pending]
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,392 @@
+#!/usr/bin/env/python
+
+"""
+    vivo_graph.py: An N-Triples dump of VIVO held in memory, indexed, and
+    queried in place of the VIVO SPARQL endpoint, so that grant ingest can
+    run without VIVO.
+
+    Triples are indexed by subject, and by predicate and object.  Uris and
+    literals are interned as the dump is read, so each distinct term is held
+    once however many triples use it.  Literal objects are also indexed by
+    their value, for each predicate, when first looked up that way.
+
+    dictionary and date_dictionary make the lookup dictionaries directly
+    from the indexes.  query answers the SELECT queries of grant ingest --
+    basic graph patterns with FILTER (?x IN (...)), FILTER (str(?x) IN
+    (...)) and FILTER (str(?x) >= "...") -- in SPARQL JSON result form.
+    install replaces vivo_sparql_query and get_vivo_uri in the given modules,
+    as SparqlClient.install does, so that the queries made inside
+    vivofoundation and vivogrants, such as those of get_grant, are answered
+    from memory too.
+"""
+
+__author__ = "Michael Conlon"
+__copyright__ = "Copyright 2014, University of Florida"
+__license__ = "BSD 3-Clause license"
+__version__ = "0.1"
+
+from datetime import datetime
+import gzip
+import random
+import re
+from sparql_client import PREFIXES
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+URI_PREFIX = "http://vivo.ufl.edu/individual/n"
+
+TRIPLE = re.compile(r'^(<[^>]*>|_:\S+)\s+<([^>]*)>\s+'
+                    r'(<[^>]*>|_:\S+|"((?:[^"\\]|\\.)*)"'
+                    r'(?:\^\^<([^>]*)>|@([\w-]+))?)\s*\.\s*$')
+
+ESCAPE = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+
+ESCAPES = {'t': u'\t', 'b': u'\b', 'n': u'\n', 'r': u'\r', 'f': u'\f',
+           '"': u'"', "'": u"'", '\\': u'\\'}
+
+PREFIX = re.compile(r'PREFIX\s+([\w-]*):\s*<([^>]*)>', re.I)
+SELECT = re.compile(r'SELECT\s+(DISTINCT\s+)?(.*?)\s*WHERE\s*\{', re.S | re.I)
+TOKEN = re.compile(r'\?\w+|<[^>]*>|"(?:[^"\\]|\\.)*"|[A-Za-z][\w-]*:[\w-]*|'
+                   r'\ba\b|\.|\S+')
+IN_FILTER = re.compile(r'^\(\s*(str\()?\s*(\?\w+)\s*\)?\s+IN\s*\((.*)\)\s*\)$',
+                       re.S | re.I)
+GE_FILTER = re.compile(r'^\(\s*str\(\s*(\?\w+)\s*\)\s*>=\s*'
+                       r'"((?:[^"\\]|\\.)*)"\s*\)$', re.S | re.I)
+
+PREFIX_NAMES = dict(PREFIX.findall(PREFIXES))
+
+
+class Literal(tuple):
+    """
+    A literal -- its value, datatype uri and language, either or both None
+    """
+    __slots__ = ()
+
+    def __new__(cls, value, datatype=None, lang=None):
+        return tuple.__new__(cls, (value, datatype, lang))
+
+
+def unescape(text):
+    """
+    Return the value of the escaped text of an N-Triples literal
+    """
+    def replace(m):
+        code = m.group(1)
+        if code[0] in 'uU' and len(code) > 1:
+            return unichr(int(code[1:], 16))
+        return ESCAPES.get(code, code)
+    return ESCAPE.sub(replace, text)
+
+
+def lexical(value):
+    """
+    Return the string value of a uri or literal, as str() would in SPARQL
+    """
+    if isinstance(value, Literal):
+        return value[0]
+    return value
+
+
+def result_binding(value):
+    """
+    Return the SPARQL JSON result binding of a uri, blank node or literal
+    """
+    if isinstance(value, Literal):
+        b = {'type': 'literal', 'value': value[0]}
+        if value[1] is not None:
+            b['type'] = 'typed-literal'
+            b['datatype'] = value[1]
+        if value[2] is not None:
+            b['xml:lang'] = value[2]
+        return b
+    if value.startswith('_:'):
+        return {'type': 'bnode', 'value': value[2:]}
+    return {'type': 'uri', 'value': value}
+
+
+def split_filters(body):
+    """
+    Return the graph patterns of a WHERE clause without its FILTERs, and
+    the expressions of the FILTERs
+    """
+    filters = []
+    patterns = []
+    position = 0
+    for m in re.finditer(r'FILTER\s*\(', body, re.I):
+        if m.start() < position:
+            continue
+        depth = 0
+        quoted = False
+        for i in range(m.end() - 1, len(body)):
+            c = body[i]
+            if quoted:
+                if c == '\\':
+                    continue
+                if c == '"' and body[i - 1] != '\\':
+                    quoted = False
+            elif c == '"':
+                quoted = True
+            elif c == '(':
+                depth = depth + 1
+            elif c == ')':
+                depth = depth - 1
+                if depth == 0:
+                    break
+        patterns.append(body[position:m.start()])
+        filters.append(body[m.end() - 1:i + 1])
+        position = i + 1
+    patterns.append(body[position:])
+    return ["".join(patterns), filters]
+
+
+class VivoGraph(object):
+    """
+    The triples of a VIVO dump, indexed by subject and by predicate and
+    object
+    """
+
+    def __init__(self):
+        self.spo = {}
+        self.pos = {}
+        self.lexical_index = {}
+        self.triples = 0
+        self.minted = set()
+        self.uri_random = random.SystemRandom()
+
+    def load(self, file_name):
+        """
+        Add the triples of an N-Triples file, gzipped if its name ends in
+        .gz.  Return the number of triples added
+        """
+        if file_name.endswith('.gz'):
+            nt_file = gzip.open(file_name, 'rb')
+        else:
+            nt_file = open(file_name, 'rb')
+        terms = {}
+        count = 0
+        for line in nt_file:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            m = TRIPLE.match(line)
+            if m is None:
+                raise ValueError("Not an N-Triples line in " + file_name +
+                                 ": " + line[:200])
+            s, p, o, value, datatype, lang = m.groups()
+            s = s[1:-1] if s.startswith('<') else s
+            if value is not None or o.startswith('"'):
+                o = Literal(unescape(value.decode('utf-8')), datatype, lang)
+            elif o.startswith('<'):
+                o = o[1:-1]
+            s = terms.setdefault(s, s)
+            p = terms.setdefault(p, p)
+            o = terms.setdefault(o, o)
+            self.spo.setdefault(s, []).append((p, o))
+            self.pos.setdefault(p, {}).setdefault(o, []).append(s)
+            count = count + 1
+        nt_file.close()
+        self.lexical_index = {}
+        self.triples = self.triples + count
+        return count
+
+    def by_lexical(self, p):
+        """
+        Return a dictionary of the string value of each object of a
+        predicate to the [subject, object] pairs having it
+        """
+        index = self.lexical_index.get(p, None)
+        if index is None:
+            index = {}
+            for o, subjects in self.pos.get(p, {}).iteritems():
+                pairs = index.setdefault(lexical(o), [])
+                for s in subjects:
+                    pairs.append([s, o])
+            self.lexical_index[p] = index
+        return index
+
+    def objects(self, s, p):
+        return [o for q, o in self.spo.get(s, []) if q == p]
+
+    def dictionary(self, key_property):
+        """
+        Return a dictionary of key to uri for the entities having the
+        key_property, as make_ufid_dictionary and the like make
+        """
+        return dict([(lexical(o), s) for o, subjects in
+                     self.pos.get(self.expand(key_property), {}).iteritems()
+                     for s in subjects])
+
+    def date_dictionary(self, datetime_precision):
+        """
+        Return a dictionary of datetime to date uri for the dates of the
+        given precision, as make_date_dictionary makes
+        """
+        precision = self.expand(datetime_precision)
+        date_time = self.expand("vivo:dateTime")
+        date_time_precision = self.expand("vivo:dateTimePrecision")
+        date_dictionary = {}
+        for o, subjects in self.pos.get(date_time, {}).iteritems():
+            for s in subjects:
+                if precision in self.objects(s, date_time_precision):
+                    try:
+                        date = datetime.strptime(lexical(o)[:19],
+                                                 '%Y-%m-%dT%H:%M:%S')
+                    except ValueError:
+                        continue
+                    date_dictionary[date] = s
+        return date_dictionary
+
+    def expand(self, name, prefixes=PREFIX_NAMES):
+        """
+        Return the uri of a prefixed name or <uri>
+        """
+        if name.startswith('<'):
+            return name[1:-1]
+        prefix, local = name.split(':', 1)
+        return prefixes[prefix] + local
+
+    def get_vivo_uri(self):
+        """
+        Return a new uri, not in the graph and not returned before.  Uris
+        are drawn from the system's random source, so worker processes do
+        not draw the same ones
+        """
+        while True:
+            uri = URI_PREFIX + str(self.uri_random.randint(1000000000,
+                                                           9999999999))
+            if uri not in self.spo and uri not in self.minted:
+                self.minted.add(uri)
+                return uri
+
+    def parse_term(self, token, prefixes):
+        if token.startswith('?'):
+            return token
+        if token == 'a':
+            return RDF_TYPE
+        if token.startswith('"'):
+            return Literal(unescape(token[1:-1]))
+        return self.expand(token, prefixes)
+
+    def match(self, pattern, solution):
+        """
+        Generate the solutions extending solution that match a triple
+        pattern.  Variables are strings beginning with ?
+        """
+        [s, p, o] = [solution.get(t, t) if isinstance(t, basestring) and
+                     t.startswith('?') else t for t in pattern]
+        s_free = isinstance(s, basestring) and s.startswith('?')
+        p_free = p.startswith('?')
+        o_free = isinstance(o, basestring) and o.startswith('?')
+        if not s_free:
+            for pv, ov in self.spo.get(s, []):
+                if p_free or pv == p:
+                    if o_free or lexical(ov) == lexical(o):
+                        extended = dict(solution)
+                        if p_free:
+                            extended[p] = pv
+                        if o_free:
+                            extended[o] = ov
+                        yield extended
+        elif not p_free:
+            if not o_free:
+                if isinstance(o, Literal):
+                    pairs = self.by_lexical(p).get(o[0], [])
+                else:
+                    pairs = [[sv, o] for sv in self.pos.get(p, {}).get(o, [])]
+                for sv, ov in pairs:
+                    extended = dict(solution)
+                    extended[s] = sv
+                    yield extended
+            else:
+                for ov, subjects in self.pos.get(p, {}).iteritems():
+                    for sv in subjects:
+                        extended = dict(solution)
+                        extended[s] = sv
+                        extended[o] = ov
+                        yield extended
+        else:
+            for sv in self.spo.keys():
+                for extended in self.match([sv, p, o], solution):
+                    extended[s] = sv
+                    yield extended
+
+    def query(self, query, debug=False, **kwargs):
+        """
+        Answer a SPARQL SELECT query of basic graph patterns and IN and >=
+        filters.  Return the result in SPARQL JSON result form
+        """
+        prefixes = dict(PREFIX_NAMES)
+        prefixes.update(dict(PREFIX.findall(query)))
+        select = SELECT.search(query)
+        if select is None:
+            raise ValueError("Not a SELECT query: " + query)
+        distinct = select.group(1) is not None
+        variables = select.group(2).split()
+        body = query[select.end():query.rindex('}')]
+        [body, filters] = split_filters(body)
+
+        patterns = []
+        pattern = []
+        for token in TOKEN.findall(body):
+            if token == '.':
+                continue
+            pattern.append(self.parse_term(token, prefixes))
+            if len(pattern) == 3:
+                patterns.append(pattern)
+                pattern = []
+        if pattern:
+            raise ValueError("Graph pattern not supported: " + body)
+
+        #   IN filters bind their variables first, as VALUES would.  Other
+        #   filters are applied to the solutions
+
+        solutions = [{}]
+        tests = []
+        for expression in filters:
+            m = IN_FILTER.match(expression.strip())
+            if m is not None:
+                var = m.group(2)
+                terms = [self.parse_term(t, prefixes) for t in
+                         TOKEN.findall(m.group(3)) if t != ',']
+                if m.group(1):
+                    terms = [Literal(lexical(t)) for t in terms]
+                solutions = [dict(solution.items() + [(var, term)])
+                             for solution in solutions for term in terms]
+                continue
+            m = GE_FILTER.match(expression.strip())
+            if m is not None:
+                tests.append([m.group(1), unescape(m.group(2))])
+                continue
+            raise ValueError("FILTER not supported: " + expression)
+        for pattern in patterns:
+            solutions = [extended for solution in solutions
+                         for extended in self.match(pattern, solution)]
+        for var, low in tests:
+            solutions = [solution for solution in solutions
+                         if var in solution and lexical(solution[var]) >= low]
+
+        bindings = []
+        seen = set()
+        for solution in solutions:
+            row = dict([(var[1:], solution[var]) for var in variables
+                        if var in solution])
+            if distinct:
+                key = tuple(sorted(row.items()))
+                if key in seen:
+                    continue
+                seen.add(key)
+            bindings.append(dict([(name, result_binding(value)) for
+                                  name, value in row.items()]))
+        return {'head': {'vars': [var[1:] for var in variables]},
+                'results': {'bindings': bindings}}
+
+    def install(self, modules):
+        """
+        Replace vivo_sparql_query and get_vivo_uri in each of the modules
+        with those of the graph
+        """
+        for module in modules:
+            if hasattr(module, 'vivo_sparql_query'):
+                module.vivo_sparql_query = self.query
+            if hasattr(module, 'get_vivo_uri'):
+                module.get_vivo_uri = self.get_vivo_uri